@@ -0,0 +1,52 @@
+# CPython: Host-side simulator for the Stowaway pipeline
+"""
+Runs the real src/ modules - KeyboardReader, init_kbd, reader_task -
+unchanged under CPython, with stand-ins for the CircuitPython modules
+(board, busio, digitalio, usb_hid, displayio, adafruit_hid, ...).
+
+    import sim
+    world = sim.install()      # before importing anything from src/
+    import main, stow_kbd
+
+The fakes talk to `sim.world.world`: script the keyboard through
+`world.keyboard`, read HID reports from `world.hid.reports`.
+"""
+
+import os
+import sys
+
+from sim.world import world
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+FAKES_DIR = os.path.join(_HERE, "fakes")
+SRC_DIR = os.path.join(os.path.dirname(_HERE), "src")
+
+
+def install():
+    """Put the fake modules and src/ on sys.path. Return the world."""
+    for path in (SRC_DIR, FAKES_DIR):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+    return world
+
+
+def scancodes_for(text):
+    """
+    Return the Stowaway make codes for typing `text` (lower case
+    letters, digits, space and the punctuation on the base layer).
+    """
+    install()
+    from adafruit_hid.keycode import Keycode as K
+    import stow_kbd
+    by_char = {" ": K.SPACEBAR, "\n": K.ENTER, "-": K.MINUS, "=": K.EQUALS,
+               ",": K.COMMA, ".": K.PERIOD, "/": K.FORWARD_SLASH,
+               ";": K.SEMICOLON, "'": K.QUOTE}
+    for c in "abcdefghijklmnopqrstuvwxyz":
+        by_char[c] = getattr(K, c.upper())
+    for i, name in enumerate(("ZERO", "ONE", "TWO", "THREE", "FOUR",
+                              "FIVE", "SIX", "SEVEN", "EIGHT", "NINE")):
+        by_char[str(i)] = getattr(K, name)
+    codes = []
+    for c in text:
+        codes.append(stow_kbd.get_keymap().base.index(by_char[c]))
+    return codes
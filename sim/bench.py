@@ -0,0 +1,439 @@
+# CPython: Latency and throughput benchmarks over scancode traces
+"""
+Usage: python -m sim.bench [--only NAME] [--json FILE] [--quick]
+
+Replays scancode traces through the simulator:
+
+- decode: the whole trace is put in the RX buffer at once and drained
+  with KeyboardReader.get() / get_all() - events/s, heap per event
+- pipeline: the trace arrives on the fake UART in real time while
+  main.reader_task runs - arrival-to-HID-report latency, dropped bytes,
+  HID reports per event, UART checks per second (the current proxy)
+
+The storm trace runs with a 128-byte RX buffer, and in the pipeline
+every HID report blocks for 2 ms, like a host that is slow to poll, so
+bytes pile up faster than USB takes them and the overflow compactor
+has to work (see RUN_OPTIONS). Longer stalls block the event loop
+long enough for the fake UART's 64-byte FIFO to overrun first, and
+then the loss isn't in the RX buffer any more. While the compactor is
+the only thing losing bytes, the pipeline run checks that every
+unmatched event is one it dropped: two per dropped make (its break
+changes nothing either), one per dropped break.
+
+Results go to stdout (or --json FILE) as one JSON document, so numbers
+can be compared between runs.
+"""
+
+import argparse
+import asyncio
+import collections
+import contextlib
+import io
+import json
+import random
+import sys
+import time
+import tracemalloc
+
+import sim
+
+world = sim.install()
+
+import main      # noqa: E402 - needs the fakes on sys.path
+import stow_kbd  # noqa: E402
+from adafruit_hid.keycode import Keycode as K  # noqa: E402
+
+
+# --------------------------
+# Traces: lists of (seconds from start, raw byte)
+# --------------------------
+def _code(keycode):
+    return stow_kbd.get_keymap().base.index(keycode)
+
+
+def _letters():
+    return [_code(getattr(K, c)) for c in "ETAOINSHRDLUCMFWGYPBVKXJQZ"]
+
+
+def trace_typing(keys=60, gap_ms=45, hold_ms=70, seed=1):
+    """Sustained typing with rollover: the next key goes down before the last is up."""
+    rnd = random.Random(seed)
+    letters = _letters()
+    ev = []
+    t = 0.0
+    up_at = {}  # Scancode -> release time; a key can't go down while held
+    for _ in range(keys):
+        code = rnd.choice([c for c in letters if up_at.get(c, -1) < t])
+        ev.append((t, code, True))
+        up_at[code] = t + hold_ms / 1000
+        ev.append((up_at[code], code, False))
+        t += rnd.uniform(0.6, 1.4) * gap_ms / 1000
+    return _to_bytes(ev)
+
+
+def trace_chords(chords=20, size=4, gap_ms=150, seed=2):
+    """Bursts of several keys pressed together, then released together."""
+    rnd = random.Random(seed)
+    letters = _letters()
+    ev = []
+    t = 0.0
+    for _ in range(chords):
+        keys = rnd.sample(letters, size)
+        for i, code in enumerate(keys):
+            ev.append((t + i * 0.002, code, True))
+        for i, code in enumerate(keys):
+            ev.append((t + 0.060 + i * 0.002, code, False))
+        t += gap_ms / 1000
+    return _to_bytes(ev)
+
+
+def trace_shortcuts(count=30, gap_ms=120, seed=3):
+    """Modifier-heavy: Ctrl/Cmd/Shift held while tapping a letter."""
+    rnd = random.Random(seed)
+    letters = _letters()
+    mods = [_code(K.CONTROL), _code(K.COMMAND), _code(K.LEFT_SHIFT), _code(K.LEFT_ALT)]
+    ev = []
+    t = 0.0
+    for _ in range(count):
+        held = rnd.sample(mods, rnd.randint(1, 2))
+        code = rnd.choice(letters)
+        for i, m in enumerate(held):
+            ev.append((t + i * 0.010, m, True))
+        ev.append((t + 0.030, code, True))
+        ev.append((t + 0.050, code, False))
+        for i, m in enumerate(held):
+            ev.append((t + 0.070 + i * 0.010, m, False))
+        t += gap_ms / 1000
+    return _to_bytes(ev)
+
+
+def trace_repeat(holds=6, hold_ms=900, delay_ms=500, rate_ms=80, seed=5):
+    """Keys held long enough for the keyboard to auto-repeat their make code."""
+    rnd = random.Random(seed)
+    letters = _letters()
+    ev = []
+    t = 0.0
+    for _ in range(holds):
+        code = rnd.choice(letters)
+        ev.append((t, code, True))
+        r = t + delay_ms / 1000
+        while r < t + hold_ms / 1000:
+            ev.append((r, code, True))
+            r += rate_ms / 1000
+        ev.append((t + hold_ms / 1000, code, False))
+        t += (hold_ms + 200) / 1000
+    return _to_bytes(ev)
+
+
+def trace_idle(taps=5, gap_ms=1500, seed=6):
+    """Single taps with pauses long enough for rx_task to back off."""
+    rnd = random.Random(seed)
+    letters = _letters()
+    ev = []
+    t = 0.0
+    for _ in range(taps):
+        code = rnd.choice(letters)
+        ev.append((t, code, True))
+        ev.append((t + 0.080, code, False))
+        t += gap_ms / 1000
+    return _to_bytes(ev)
+
+
+def trace_storm(taps=300, seed=4):
+    """Buffer overflow storm: taps back to back at full line speed."""
+    rnd = random.Random(seed)
+    letters = _letters()
+    ev = []
+    for _ in range(taps):
+        code = rnd.choice(letters)
+        ev.append((0.0, code, True))
+        ev.append((0.0, code, False))
+    return _to_bytes(ev)
+
+
+def _to_bytes(events):
+    """Turn (t, scancode, down) into raw bytes, doubling the last break."""
+    events.sort(key=lambda e: e[0])
+    held = set()
+    out = []
+    for t, code, down in events:
+        if down:
+            held.add(code)
+            out.append((t, code))
+        else:
+            held.discard(code)
+            out.append((t, code | 0x80))
+            if not held:
+                out.append((t, code | 0x80))
+    return out
+
+
+TRACES = {
+    "typing": trace_typing,
+    "chords": trace_chords,
+    "shortcuts": trace_shortcuts,
+    "storm": trace_storm,
+    "repeat": trace_repeat,
+    "idle": trace_idle,
+}
+
+# Per trace: RX buffer size for the decode runs, ms each HID report
+# blocks in the pipeline run. The storm has to overflow the buffer.
+RUN_OPTIONS = {
+    "storm": {"rxbuf_max": 128, "host_poll_ms": 2},
+}
+
+
+# --------------------------
+# Helpers
+# --------------------------
+def _percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    i = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+    return values[i]
+
+
+def _fresh():
+    """Forget everything from the previous run."""
+    world.reset()
+    stow_kbd.keyboard = None
+    stow_kbd.uart = None
+    main.kbd_active = False
+    main.manager = None
+    main.writer = None
+    main.display = None
+
+
+def _new_reader(rxbuf_max):
+    world.keyboard.handshake_ms = 0
+    kbd = stow_kbd.KeyboardReader(None, 9600, 8, None, 1, "GP0", "GP17", "GP16",
+                                  rxbuf_max=rxbuf_max)
+    kbd.ready = True
+    return kbd
+
+
+# --------------------------
+# Benchmarks
+# --------------------------
+def _overflow(kbd):
+    """Overflow counters of `kbd`: what the RX buffer lost or squeezed out."""
+    comp = kbd._compactor if kbd else None
+    return {
+        "dropped_rx_buffer": kbd._buf.dropped if kbd else None,
+        "overflow_merged": comp.merged if comp else None,
+        "overflow_dropped_makes": comp.dropped_makes if comp else None,
+        "overflow_dropped_breaks": comp.dropped_breaks if comp else None,
+    }
+
+
+def bench_decode(trace, mode, rxbuf_max=4096, repeat=20):
+    """
+    Drain a fully buffered trace with get() or get_all(). A trace longer
+    than `rxbuf_max` overflows while it is put in.
+    """
+    data = bytes(b for _, b in trace)
+    with contextlib.redirect_stdout(io.StringIO()):
+        _fresh()
+        kbd = _new_reader(rxbuf_max)
+        best = None
+        events = 0
+        for _ in range(repeat):
+            kbd._buf.clear()
+            for b in data:
+                kbd._buf.put(b)
+            world.hid.clear()
+            t0 = time.perf_counter()
+            if mode == "get":
+                events = 0
+                while kbd._buf:
+                    kbd.get()
+                    events += 1
+            else:
+                events = kbd.get_all()
+            elapsed = time.perf_counter() - t0
+            best = elapsed if best is None else min(best, elapsed)
+        reports = len(world.hid.reports)
+
+        # Heap use, measured on a separate run; overflow counters are from this run only
+        kbd._buf.clear()
+        kbd._buf.dropped = 0
+        if kbd._compactor:
+            kbd._compactor.merged = kbd._compactor.dropped_makes = 0
+            kbd._compactor.dropped_breaks = 0
+        for b in data:
+            kbd._buf.put(b)
+        tracemalloc.start()
+        before, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        if mode == "get":
+            while kbd._buf:
+                kbd.get()
+        else:
+            kbd.get_all()
+        after, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    res = {
+        "events": events,
+        "events_per_s": round(events / best) if best else None,
+        "us_per_event": round(best / events * 1e6, 2) if events else None,
+        "hid_reports": reports,
+        "heap_peak_bytes_per_event": round((peak - before) / events, 1) if events else None,
+        "heap_net_bytes": after - before,
+    }
+    if len(data) > rxbuf_max:
+        res.update(_overflow(kbd))
+    return res
+
+
+async def _replay(trace, settle_s):
+    reader = asyncio.create_task(main.reader_task())
+    while stow_kbd.keyboard is None or not stow_kbd.keyboard.ready:
+        await asyncio.sleep(0.001)
+    await asyncio.sleep(0.01)
+    world.hid.clear()
+    t0 = time.monotonic()
+    for t, b in trace:
+        world.keyboard.send(bytes((b,)), t0 + t)
+    end = t0 + (trace[-1][0] if trace else 0)
+    while time.monotonic() < end or not world.uart.idle():
+        await asyncio.sleep(0.01)
+    await asyncio.sleep(settle_s)
+    reader.cancel()
+    try:
+        await reader
+    except asyncio.CancelledError:
+        pass
+
+
+def _transitions(reports):
+    """Return (time, keycode, down) for every key that changes from one report to the next."""
+    out = []
+    mods, keys = 0, set()
+    for t, report in reports:
+        m, k = world.hid.keys(report)
+        for bit in range(8):
+            if (m ^ mods) & (1 << bit):
+                out.append((t, 0xE0 + bit, bool(m & (1 << bit))))
+        for keycode in sorted(k ^ keys):
+            out.append((t, keycode, keycode in k))
+        mods, keys = m, k
+    return out
+
+
+def _latencies(arrivals, reports):
+    """
+    Match key bytes to key changes in the HID reports, in order: each
+    report change of (keycode, down) goes to the oldest unmatched byte
+    that asks for it. Return (latencies in ms, unmatched count).
+
+    Bytes the overflow compactor dropped stay unmatched, so a later tap
+    of the same key is matched to the earlier byte; counts are exact,
+    storm latencies a little pessimistic.
+    """
+    waiting = {}  # (keycode, down) -> arrival times, oldest first
+    prev = None
+    held = set()
+    for due, b in arrivals:
+        if b in (0xF9, 0xFB):
+            continue
+        if b & 0x80 and b == prev:
+            prev = None  # Doubled all-up byte
+            continue
+        prev = b
+        if not b & 0x80:
+            if b in held:
+                continue  # Auto-repeat: no report expected
+            held.add(b)
+        else:
+            held.discard(b & 0x7F)
+        entry = stow_kbd.DISPATCH[b]
+        action = entry >> 16
+        if action not in (stow_kbd.ACT_PRESS, stow_kbd.ACT_RELEASE):
+            continue
+        key = (entry & 0xFF, action == stow_kbd.ACT_PRESS)
+        waiting.setdefault(key, collections.deque()).append(due)
+    lat = []
+    for t, keycode, down in _transitions(reports):
+        q = waiting.get((keycode, down))
+        if q and q[0] <= t:
+            lat.append((t - q.popleft()) * 1000)
+    return lat, sum(len(q) for q in waiting.values())
+
+
+def bench_pipeline(trace, settle_s=0.2, host_poll_ms=0):
+    """
+    Replay a trace in real time through main.reader_task (RX buffer:
+    128 bytes, as main.py has it). With `host_poll_ms`, every HID
+    report blocks that long.
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        _fresh()
+        world.display_present = False
+        world.keyboard.handshake_ms = 5
+        world.hid.poll_ms = host_poll_ms
+        polls = main.stow_stats.polls
+        t0 = time.monotonic()
+        asyncio.run(_replay(trace, settle_s))
+        elapsed = time.monotonic() - t0
+        polls = main.stow_stats.polls - polls
+    kbd = stow_kbd.keyboard
+    arrivals = [a for a in world.uart.arrivals]
+    lat, missing = _latencies(arrivals, world.hid.reports)
+    comp = kbd._compactor
+    if comp and not world.uart.overruns and not kbd._buf.dropped:
+        # Only the compactor lost bytes, and a dropped make takes its break along
+        lost = 2 * comp.dropped_makes + comp.dropped_breaks
+        if missing != lost:
+            raise AssertionError("{} unmatched events, but the compactor dropped {} makes "
+                                 "and {} breaks".format(missing, comp.dropped_makes,
+                                                        comp.dropped_breaks))
+    key_events = len(lat) + missing
+    res = {
+        "bytes": len(trace),
+        "key_events": key_events,
+        "latency_ms_p50": round(_percentile(lat, 50), 2) if lat else None,
+        "latency_ms_p99": round(_percentile(lat, 99), 2) if lat else None,
+        "latency_ms_max": round(max(lat), 2) if lat else None,
+        "unmatched_events": missing,
+        "dropped_uart_fifo": world.uart.overruns,
+        "hid_reports": len(world.hid.reports),
+        "reports_per_event": round(len(world.hid.reports) / key_events, 2) if key_events else None,
+        "polls_per_s": round(polls / elapsed),
+    }
+    res.update(_overflow(kbd))
+    return res
+
+
+def main_bench():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--only", choices=sorted(TRACES), action="append")
+    parser.add_argument("--json", help="Write results to this file instead of stdout")
+    parser.add_argument("--quick", action="store_true", help="Skip the real-time pipeline runs")
+    args = parser.parse_args()
+
+    results = {"python": sys.version.split()[0], "traces": {}}
+    for name in args.only or sorted(TRACES):
+        trace = TRACES[name]()
+        opts = RUN_OPTIONS.get(name, {})
+        rxbuf_max = opts.get("rxbuf_max", 4096)
+        res = {
+            "decode_get": bench_decode(trace, "get", rxbuf_max),
+            "decode_get_all": bench_decode(trace, "get_all", rxbuf_max),
+        }
+        if not args.quick:
+            res["pipeline"] = bench_pipeline(trace, host_poll_ms=opts.get("host_poll_ms", 0))
+        results["traces"][name] = res
+        print("{}: done".format(name), file=sys.stderr)
+
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if args.json:
+        with open(args.json, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main_bench()
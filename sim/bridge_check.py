@@ -0,0 +1,145 @@
+# CPython: End-to-end check of tools/stow_bridge.py over a pty pair
+"""
+Usage: python -m sim.bridge_check [-v]
+
+Runs the bridge on the slave side of a pty with a RecordingSink and
+plays the keyboard on the master side: handshake, keys, a rollover
+chord, then closes the master. Checks the reports, that nothing is
+held when the port goes away, and prints the write-to-report latency.
+Exit status 1 on a mismatch.
+
+Uses the real CPython modules, not the sim fakes - this is what the
+bridge runs on.
+"""
+
+import argparse
+import asyncio
+import os
+import pty
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                "tools"))
+
+import stow_bridge  # noqa: E402
+from stow_proto import HANDSHAKE_1, HANDSHAKE_2  # noqa: E402 - src/ is on the path now
+
+A, B, C, SHIFT = 0x04, 0x05, 0x06, 0xE1
+
+
+class _FakePower:
+    """The pty has no modem lines: count the power switches instead."""
+    def __init__(self):
+        self._value = False
+        self.cycles = 0
+
+    @property
+    def value(self):
+        return self._value
+
+    @value.setter
+    def value(self, on):
+        if on and not self._value:
+            self.cycles += 1
+        self._value = on
+
+
+def _scancodes():
+    """Make codes (release = code | 0x80) of a, b, c and Shift in the current layout."""
+    keymap = stow_bridge.stow_kbd.get_keymap()
+    want = {A: None, B: None, C: None, SHIFT: None}
+    for sc in range(0x80):
+        k = keymap.keycode(sc)
+        if k in want and want[k] is None:
+            want[k] = sc
+    return want
+
+
+async def _play(master, bridge, sink, sc, verbose):
+    """Type on the master side; return (failures, latencies in ms)."""
+    failures = []
+    latencies = []
+
+    async def send(data, expect_keys, expect_mods=0):
+        n = len(sink.reports)
+        t0 = time.monotonic()
+        os.write(master, bytes(data))
+        while len(sink.reports) == n:
+            if time.monotonic() - t0 > 1:
+                failures.append("no report for {}".format(bytes(data).hex(" ")))
+                return
+            await asyncio.sleep(0.001)
+        latencies.append((sink.reports[-1][0] - t0) * 1000)
+        await asyncio.sleep(0.01)  # Let a batch that arrived in pieces finish
+        mods, keys = sink.keys()
+        if verbose:
+            print("{} -> mods 0x{:02X} keys {}".format(bytes(data).hex(" "), mods, sorted(keys)))
+        if keys != set(expect_keys) or mods != expect_mods:
+            failures.append("{}: got mods 0x{:02X} keys {}, want 0x{:02X} {}".format(
+                bytes(data).hex(" "), mods, sorted(keys), expect_mods, sorted(expect_keys)))
+
+    await asyncio.sleep(0.05)
+    os.write(master, bytes((HANDSHAKE_1, HANDSHAKE_2)))
+    t0 = time.monotonic()
+    while not bridge.kbd.ready:
+        if time.monotonic() - t0 > 2:
+            failures.append("handshake not seen")
+            return failures, latencies
+        await asyncio.sleep(0.005)
+
+    await send([sc[A]], [A])
+    await send([sc[A] | 0x80], [])
+    await send([sc[SHIFT], sc[B]], [B], 0x02)
+    await send([sc[B] | 0x80, sc[SHIFT] | 0x80], [])
+    # Three keys in one burst: one report, not three
+    n = len(sink.reports)
+    await send([sc[A], sc[B], sc[C]], [A, B, C])
+    if len(sink.reports) - n != 1:
+        failures.append("chord took {} reports, want 1".format(len(sink.reports) - n))
+    # Port goes away with keys down: everything must be released
+    os.close(master)
+    return failures, latencies
+
+
+async def _check(verbose):
+    master, slave = pty.openpty()
+    port = stow_bridge.TtyPort(os.ttyname(slave))
+    os.close(slave)  # The port has its own descriptor
+    sink = stow_bridge.RecordingSink()
+    power = _FakePower()
+    bridge = stow_bridge.Bridge(port, sink, power)
+    run = asyncio.ensure_future(bridge.run())
+    failures, latencies = await _play(master, bridge, sink, _scancodes(), verbose)
+    try:
+        await asyncio.wait_for(run, 2)
+    except asyncio.TimeoutError:
+        failures.append("bridge did not stop at EOF")
+    port.close()
+    if not failures:
+        mods, keys = sink.keys()
+        if mods or keys:
+            failures.append("held after EOF: mods 0x{:02X} keys {}".format(mods, sorted(keys)))
+        if power.value or power.cycles != 1:
+            failures.append("power: on={} cycles={}".format(power.value, power.cycles))
+    return failures, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("-v", "--verbose", action="store_true", help="Show every report")
+    args = parser.parse_args()
+
+    failures, latencies = asyncio.run(_check(args.verbose))
+    if latencies:
+        latencies.sort()
+        print("latency write->report: median {:.2f}ms, max {:.2f}ms ({} reports)".format(
+            latencies[len(latencies) // 2], latencies[-1], len(latencies)))
+    for f in failures:
+        print("FAIL: {}".format(f))
+    print("bridge check: {}".format("FAIL" if failures else "ok"))
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
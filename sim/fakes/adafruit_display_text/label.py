@@ -0,0 +1,9 @@
+# Fake adafruit_display_text.label for the host simulator.
+
+
+class Label:
+    def __init__(self, font, text="", x=0, y=0, **kwargs):
+        self.font = font
+        self.text = text
+        self.x = x
+        self.y = y
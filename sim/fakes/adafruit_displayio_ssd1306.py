@@ -0,0 +1,27 @@
+# Fake adafruit_displayio_ssd1306 for the host simulator: records frames.
+import time
+from sim.world import world
+
+
+class SSD1306:
+    def __init__(self, bus, width=128, height=64, **kwargs):
+        self.bus = bus
+        self.width = width
+        self.height = height
+        self.root_group = None
+        self.auto_refresh = True
+        self.frames = []  # (monotonic time, [row texts])
+        self.brightness = 1.0
+        self.is_awake = True
+        world.display = self
+
+    def sleep(self):
+        self.is_awake = False
+
+    def wake(self):
+        self.is_awake = True
+
+    def refresh(self, **kwargs):
+        rows = [getattr(item, "text", "") for item in (self.root_group or [])]
+        self.frames.append((time.monotonic(), rows))
+        return True
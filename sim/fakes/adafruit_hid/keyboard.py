@@ -0,0 +1,65 @@
+# Fake adafruit_hid.keyboard for the host simulator.
+# Same report handling as the library's boot-protocol Keyboard.
+from .keycode import Keycode
+
+
+def find_device(devices, usage_page=0x01, usage=0x06):
+    for device in devices:
+        if device.usage_page == usage_page and device.usage == usage:
+            return device
+    raise ValueError("Could not find matching HID device.")
+
+
+class Keyboard:
+    def __init__(self, devices, timeout=None):
+        self._keyboard_device = find_device(devices)
+        # [modifiers, reserved, key1..key6]
+        self.report = bytearray(8)
+        self.report_modifier = memoryview(self.report)[0:1]
+        self.report_keys = memoryview(self.report)[2:]
+
+    def press(self, *keycodes):
+        for keycode in keycodes:
+            self._add_keycode_to_report(keycode)
+        self._keyboard_device.send_report(self.report)
+
+    def release(self, *keycodes):
+        for keycode in keycodes:
+            self._remove_keycode_from_report(keycode)
+        self._keyboard_device.send_report(self.report)
+
+    def release_all(self):
+        for i in range(8):
+            self.report[i] = 0
+        self._keyboard_device.send_report(self.report)
+
+    def send(self, *keycodes):
+        self.press(*keycodes)
+        self.release_all()
+
+    def _add_keycode_to_report(self, keycode):
+        modifier = Keycode.modifier_bit(keycode)
+        if modifier:
+            self.report_modifier[0] |= modifier
+            return
+        for i in range(6):
+            if self.report_keys[i] == keycode:
+                return
+        for i in range(6):
+            if self.report_keys[i] == 0:
+                self.report_keys[i] = keycode
+                return
+        raise ValueError("Trying to press more than six keys at once.")
+
+    def _remove_keycode_from_report(self, keycode):
+        modifier = Keycode.modifier_bit(keycode)
+        if modifier:
+            self.report_modifier[0] &= ~modifier
+            return
+        for i in range(6):
+            if self.report_keys[i] == keycode:
+                self.report_keys[i] = 0
+
+    @property
+    def led_status(self):
+        return b"\x00"
@@ -0,0 +1,16 @@
+# Fake CircuitPython `alarm` for the host simulator: light sleep only.
+import time as _time
+
+from sim.world import world
+from alarm import pin, time  # noqa: F401 - alarm.pin / alarm.time, as on the Pico
+
+
+def light_sleep_until_alarms(*alarms):
+    """Wait until a TimeAlarm is due or a PinAlarm's line has a byte on it."""
+    while True:
+        for a in alarms:
+            if isinstance(a, time.TimeAlarm) and _time.monotonic() >= a.monotonic_time:
+                return a
+            if isinstance(a, pin.PinAlarm) and any(u.in_waiting for u in world.uarts.values()):
+                return a
+        _time.sleep(0.001)
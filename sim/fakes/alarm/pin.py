@@ -0,0 +1,7 @@
+# Fake alarm.pin for the host simulator: wired to every simulated UART's RX line.
+
+
+class PinAlarm:
+    def __init__(self, pin, value, edge=False, pull=False):
+        self.pin = pin
+        self.value = value
@@ -0,0 +1,6 @@
+# Fake alarm.time for the host simulator.
+
+
+class TimeAlarm:
+    def __init__(self, monotonic_time=None, epoch_time=None):
+        self.monotonic_time = monotonic_time
@@ -0,0 +1,6 @@
+# Fake CircuitPython `board` for the host simulator: pins are their names.
+
+def __getattr__(name):
+    if name.startswith("GP") or name in ("LED", "SDA", "SCL", "TX", "RX"):
+        return name
+    raise AttributeError(name)
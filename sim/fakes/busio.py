@@ -0,0 +1,31 @@
+# Fake CircuitPython `busio` for the host simulator.
+from sim.world import world, SimUART
+
+
+def UART(tx=None, rx=None, baudrate=9600, bits=8, parity=None, stop=1,
+         timeout=1, receiver_buffer_size=64):
+    uart = SimUART(world, baudrate, receiver_buffer_size)
+    uart.timeout = timeout
+    world.uarts[rx] = uart
+    if world.uart is None:
+        world.uart = uart
+    return uart
+
+
+class I2C:
+    def __init__(self, scl, sda, frequency=100000):
+        self.scl = scl
+        self.sda = sda
+        self.frequency = frequency
+
+    def try_lock(self):
+        return True
+
+    def unlock(self):
+        pass
+
+    def scan(self):
+        return [0x3C] if world.display_present else []
+
+    def deinit(self):
+        pass
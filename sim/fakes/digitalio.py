@@ -0,0 +1,32 @@
+# Fake CircuitPython `digitalio` for the host simulator.
+from sim.world import world
+
+
+class Direction:
+    INPUT = "INPUT"
+    OUTPUT = "OUTPUT"
+
+
+class Pull:
+    UP = "UP"
+    DOWN = "DOWN"
+
+
+class DigitalInOut:
+    def __init__(self, pin):
+        self.pin = pin
+        self.direction = Direction.INPUT
+        self.pull = None
+        self._value = False
+
+    @property
+    def value(self):
+        return self._value
+
+    @value.setter
+    def value(self, v):
+        self._value = bool(v)
+        world.set_pin(self.pin, self._value)
+
+    def deinit(self):
+        pass
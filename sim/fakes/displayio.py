@@ -0,0 +1,9 @@
+# Fake CircuitPython `displayio` for the host simulator.
+
+
+def release_displays():
+    pass
+
+
+class Group(list):
+    pass
@@ -0,0 +1,10 @@
+# Fake CircuitPython `i2cdisplaybus` for the host simulator.
+from sim.world import world
+
+
+class I2CDisplayBus:
+    def __init__(self, i2c, device_address):
+        if not world.display_present:
+            raise ValueError("No I2C device at address: 0x{:x}".format(device_address))
+        self.i2c = i2c
+        self.device_address = device_address
@@ -0,0 +1,9 @@
+# Fake CircuitPython `terminalio` for the host simulator.
+
+
+class _Font:
+    def get_bounding_box(self):
+        return (6, 12)
+
+
+FONT = _Font()
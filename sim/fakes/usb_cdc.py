@@ -0,0 +1,26 @@
+# Fake CircuitPython `usb_cdc` for the host simulator.
+from sim.world import world
+
+
+class _DataPort:
+    """usb_cdc.data: what the device writes ends up in world.cdc_data."""
+    connected = True
+
+    def write(self, buf):
+        world.cdc_data.extend(buf)
+        return len(buf)
+
+    def read(self, n=1):
+        return b""
+
+    @property
+    def in_waiting(self):
+        return 0
+
+
+console = None
+data = _DataPort()
+
+
+def enable(console=True, data=False):
+    pass
@@ -0,0 +1,33 @@
+# Fake CircuitPython `usb_hid` for the host simulator.
+from sim.world import world
+
+
+class Device:
+    def __init__(self, report_descriptor=b"", usage_page=0x01, usage=0x06,
+                 report_ids=(0,), in_report_lengths=(8,), out_report_lengths=(1,)):
+        self.report_descriptor = report_descriptor
+        self.usage_page = usage_page
+        self.usage = usage
+        self.in_report_length = in_report_lengths[0]
+
+    def send_report(self, report, report_id=None):
+        if len(report) != self.in_report_length:
+            raise ValueError("Buffer incorrect size. Should be {} bytes.".format(
+                self.in_report_length))
+        world.hid.send(report)
+
+
+Device.KEYBOARD = Device(usage_page=0x01, usage=0x06)
+devices = [Device.KEYBOARD]
+boot_device = 0
+
+
+def enable(new_devices, boot_device=0):
+    global devices
+    devices = list(new_devices)
+    globals()["boot_device"] = boot_device
+
+
+def get_boot_device():
+    # 1 once the simulated host asked the boot keyboard for the boot protocol
+    return 1 if boot_device == 1 and world.hid.boot_protocol else 0
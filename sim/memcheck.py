@@ -0,0 +1,62 @@
+# CPython: Run stow_memcheck on the simulator
+"""
+Usage: python -m sim.memcheck [--rounds N] [--nkro] [--debounce MS]
+
+Runs src/stow_memcheck.py's trace through a KeyboardReader and checks
+that the key path keeps no heap: exit status 1 if it does. CPython
+frees most temporaries at once, so this finds what the key path keeps
+(lists that grow, caches); run stow_memcheck.run() on the Pico to see
+every allocation. --nkro sends through stow_nkro's keyboard instead of
+the stock one, --debounce runs the chatter filter (stow_filter) too.
+"""
+
+import argparse
+import contextlib
+import io
+import sys
+import tracemalloc
+
+import sim
+
+world = sim.install()
+
+import stow_kbd       # noqa: E402 - needs the fakes on sys.path
+import stow_memcheck  # noqa: E402
+
+SLACK = 64  # Bytes; CPython int objects come and go
+
+
+def main_memcheck():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rounds", type=int, default=200)
+    parser.add_argument("--nkro", action="store_true", help="Use the NKRO keyboard")
+    parser.add_argument("--debounce", type=int, default=0, metavar="MS",
+                        help="Chatter filter window (0: off)")
+    args = parser.parse_args()
+
+    world.reset()
+    world.hid.keep = False  # Count reports, don't keep them
+    if args.nkro:
+        import usb_hid
+        import stow_nkro
+        usb_hid.enable((stow_nkro.device(),), boot_device=1)
+    with contextlib.redirect_stdout(io.StringIO()):
+        kbd = stow_kbd.KeyboardReader(None, 9600, 8, None, 1, "GP0", "GP17", "GP16",
+                                      nkro=args.nkro, debounce_ms=args.debounce)
+    kbd.ready = True
+    data = stow_memcheck.trace(stow_kbd)
+    tracemalloc.start()
+    # CPython keeps a few bytes for whatever int is stored last, whatever
+    # the length of the run - only growth between a short and a long run
+    # counts
+    events1, used1 = stow_memcheck.measure(kbd, data, args.rounds)
+    events2, used2 = stow_memcheck.measure(kbd, data, args.rounds * 5)
+    tracemalloc.stop()
+    kept = used2 - used1
+    print("{} events, {} HID reports, {} bytes kept ({:.3f}/event)".format(
+        events1 + events2, world.hid.count, kept, kept / (events2 - events1)))
+    return 1 if kept > SLACK else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_memcheck())
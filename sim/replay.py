@@ -0,0 +1,199 @@
+# CPython: Replay a stow_capture recording through the real decoder
+"""
+Usage: python -m sim.replay CAPTURE [--speed X] [--dump] [--reports]
+
+Feeds a capture written by stow_capture (see src/stow_capture.py) into
+a KeyboardReader on the simulated hardware - ring buffer, decoder,
+dispatch, HID reports - and prints what the host ended up with.
+
+--speed 1 replays in real time through rx_task / hid_task (the event
+loop as on the Pico), --speed 10 ten times faster; --speed 0 (default)
+pushes the chunks straight through as fast as possible. Power and
+handshake markers are replayed too: "power off" drops the key state
+like the Pico did, and data before a handshake goes through the
+handshake search, so a missed handshake stays missed.
+
+The file is memory-mapped, so captures of any size start right away.
+--dump prints the records instead of replaying them.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import mmap
+import sys
+import time
+
+import sim
+
+world = sim.install()
+
+import stow_capture  # noqa: E402 - needs src/ on sys.path
+import stow_kbd      # noqa: E402
+from stow_async import EventQueue, rx_task, hid_task  # noqa: E402
+from stow_capture import MARK_POWER_OFF, MARK_NAMES  # noqa: E402
+
+
+class _ChunkUART:
+    """Stands in for the UART in --speed 0: holds one recorded chunk."""
+    def __init__(self):
+        self.data = b""
+
+    @property
+    def in_waiting(self):
+        return len(self.data)
+
+    def read(self, n=None):
+        if not self.data:
+            return None
+        n = len(self.data) if n is None else n
+        out, self.data = bytes(self.data[:n]), self.data[n:]
+        return out
+
+    def readinto(self, buf):
+        n = min(len(buf), len(self.data))
+        if not n:
+            return None
+        buf[:n] = self.data[:n]
+        self.data = self.data[n:]
+        return n
+
+
+def _new_reader(rxbuf_max):
+    world.keyboard.dead = True  # The capture brings its own handshakes
+    kbd = stow_kbd.KeyboardReader(None, 9600, 8, None, 1, "GP0", "GP17", "GP16",
+                                  rxbuf_max=rxbuf_max)
+    kbd.power.value = True
+    return kbd
+
+
+def dump(data):
+    for t, chunk, marker in stow_capture.records(data):
+        if chunk is None:
+            print("{:10d}ms  [{}]".format(t, MARK_NAMES[marker] if marker < len(MARK_NAMES)
+                                             else marker))
+        else:
+            print("{:10d}ms  {}".format(t, bytes(chunk).hex(" ")))
+
+
+def replay_direct(kbd, data):
+    """Push every record through as fast as possible. Return the capture length in ms."""
+    uart = _ChunkUART()
+    kbd.uart = uart
+    t = 0
+    for t, chunk, marker in stow_capture.records(data):
+        if chunk is None:
+            if marker == MARK_POWER_OFF:
+                kbd._power_off()
+            continue
+        uart.data = chunk
+        if not kbd.ready:
+            kbd._poll_handshake()
+        kbd._read_data()
+        kbd.get_all()
+    return t
+
+
+async def replay_timed(kbd, data, speed, queue_len=32):
+    """Replay at `speed` times real time through rx_task / hid_task."""
+    uart = kbd.uart
+    uart.baudrate = 9600 * speed  # Recorded chunks arrive `speed` times faster too
+    queue = kbd.queue = EventQueue(queue_len)
+    tasks = [asyncio.create_task(rx_task(kbd, queue, 1)),
+             asyncio.create_task(hid_task(kbd, queue))]
+    t0 = time.monotonic()
+    t = 0
+    for t, chunk, marker in stow_capture.records(data):
+        delay = t0 + t / 1000 / speed - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if chunk is None:
+            if marker == MARK_POWER_OFF:
+                kbd._power_off()
+            continue
+        uart.inject(bytes(chunk))
+        # Not ready: nothing reads the UART but the handshake search
+        while not kbd.ready and not uart.idle():
+            kbd._poll_handshake()
+            await asyncio.sleep(0.001)
+    while not uart.idle() or kbd.any():
+        await asyncio.sleep(0.01)
+    await asyncio.sleep(0.05)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return t
+
+
+def summary(kbd, data, ms):
+    markers = {}
+    nbytes = 0
+    for _, chunk, marker in stow_capture.records(data):
+        if chunk is None:
+            name = MARK_NAMES[marker] if marker < len(MARK_NAMES) else str(marker)
+            markers[name] = markers.get(name, 0) + 1
+        else:
+            nbytes += len(chunk)
+    mods, keys = world.hid.keys()
+    comp = kbd._compactor
+    lines = [
+        "capture: {:.1f}s, {} UART bytes, markers: {}".format(
+            ms / 1000, nbytes, ", ".join("{} {}".format(k, v) for k, v in sorted(markers.items()))
+            or "none"),
+        "reader: ready={} protocol errors={} unknown={} repeats={} rx drops={}".format(
+            kbd.ready, kbd.protocol_errors(), kbd.unknown, kbd.repeats, kbd._buf.dropped),
+        "hid: {} reports".format(len(world.hid.reports)),
+    ]
+    if comp:
+        lines.append("overflow: merged={} dropped makes={} dropped breaks={}".format(
+            comp.merged, comp.dropped_makes, comp.dropped_breaks))
+    if mods or keys:
+        lines.append("STUCK at end: modifiers 0x{:02X} keys {}".format(
+            mods, " ".join("0x{:02X}".format(k) for k in sorted(keys)) or "-"))
+    else:
+        lines.append("at end: no keys held")
+    return "\n".join(lines)
+
+
+def main_replay():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("capture")
+    parser.add_argument("--speed", type=float, default=0,
+                        help="1 = real time, 10 = ten times faster, 0 = no waiting")
+    parser.add_argument("--dump", action="store_true", help="Print the records and stop")
+    parser.add_argument("--reports", action="store_true", help="Print every HID report")
+    parser.add_argument("--rxbuf", type=int, default=128, help="RX ring buffer size, as in main.py")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Show the reader's output")
+    args = parser.parse_args()
+
+    with open(args.capture, "rb") as f:
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            sys.exit("Error: {} is empty".format(args.capture))
+    try:
+        stow_capture.check_header(data)
+    except ValueError as e:
+        sys.exit("Error: {}: {}".format(args.capture, e))
+    if args.dump:
+        dump(data)
+        return
+
+    out = sys.stdout if args.verbose else io.StringIO()
+    with contextlib.redirect_stdout(out):
+        kbd = _new_reader(args.rxbuf)
+        world.hid.clear()
+        if args.speed > 0:
+            ms = asyncio.run(replay_timed(kbd, data, args.speed))
+        else:
+            ms = replay_direct(kbd, data)
+    if args.reports:
+        t0 = world.hid.reports[0][0] if world.hid.reports else 0
+        for t, report in world.hid.reports:
+            print("{:10.1f}ms  {}".format((t - t0) * 1000, report.hex(" ")))
+    print(summary(kbd, data, ms))
+
+
+if __name__ == "__main__":
+    main_replay()
@@ -0,0 +1,64 @@
+# CPython: Run main.reader_task against the simulated keyboard
+"""
+Usage: python -m sim.run [text] [--seconds N] [--no-display]
+
+Powers up the simulated Stowaway through the real init code, types
+`text`, and prints the HID reports the host would have received.
+"""
+
+import argparse
+import asyncio
+import time
+
+import sim
+
+world = sim.install()
+
+import main      # noqa: E402 - needs the fakes on sys.path
+import stow_kbd  # noqa: E402
+
+
+async def type_text(text, gap_ms=60):
+    kbd = world.keyboard
+    for code in sim.scancodes_for(text):
+        kbd.press(code)
+        await asyncio.sleep(gap_ms / 2000)
+        kbd.release(code)
+        await asyncio.sleep(gap_ms / 2000)
+
+
+async def session(text, seconds):
+    t0 = time.monotonic()
+    reader = asyncio.create_task(main.reader_task())
+    while stow_kbd.keyboard is None or not stow_kbd.keyboard.ready:
+        await asyncio.sleep(0.01)
+    print("Keys ready after {:.1f}ms".format((time.monotonic() - t0) * 1000))
+    await type_text(text)
+    await asyncio.sleep(seconds)
+    reader.cancel()
+    try:
+        await reader
+    except asyncio.CancelledError:
+        pass
+
+
+def main_sim():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("text", nargs="?", default="hello world")
+    parser.add_argument("--seconds", type=float, default=0.5)
+    parser.add_argument("--no-display", action="store_true")
+    args = parser.parse_args()
+
+    world.display_present = not args.no_display
+    asyncio.run(session(args.text, args.seconds))
+
+    t0 = world.hid.reports[0][0] if world.hid.reports else 0
+    for t, report in world.hid.reports:
+        print("{:8.1f}ms  {}".format((t - t0) * 1000, report.hex(" ")))
+    print("{} reports".format(len(world.hid.reports)))
+    print("Boot: " + ", ".join("{} {}ms".format(p, main.stow_stats.boot_ms(p))
+                               for p, _ in main.stow_stats.boot_phases))
+
+
+if __name__ == "__main__":
+    main_sim()
@@ -0,0 +1,476 @@
+# CPython: Feed byte streams through the decoder, overflow policy, key state and chatter filter
+"""
+Usage: python -m sim.streamcheck [-v]
+
+Plays short Stowaway byte streams through the pure modules in src/ -
+ScancodeDecoder, RingBuffer with its Compactor, KeyState and
+ChatterFilter - and through a KeyboardReader on a small ring buffer,
+then checks the events, counters and the key state the host ends up
+with. The capture Recorder gets a serial port that comes and goes. Each stream is one case; exit status 1 if any case fails.
+
+Times for the chatter filter are given, not measured, so the result
+doesn't depend on how fast the computer is.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import sys
+
+import sim
+
+world = sim.install()
+
+import stow_kbd  # noqa: E402 - needs the fakes on sys.path
+from ringbuf import RingBuffer  # noqa: E402
+from stow_async import EventQueue, rx_task  # noqa: E402
+from stow_filter import ChatterFilter  # noqa: E402
+from stow_keys import KeyState  # noqa: E402
+from stow_proto import (ScancodeDecoder, Compactor, EV_DOWN, EV_UP,  # noqa: E402
+                        EV_ALL_UP, EV_HANDSHAKE, EV_RESYNC, EVENT_NAMES)
+
+CASES = []
+
+
+def case(fn):
+    CASES.append(fn)
+    return fn
+
+
+def ev(kind, sc):
+    return (kind << 8) | sc
+
+
+def names(events):
+    return " ".join("{}:{:02X}".format(EVENT_NAMES[e >> 8], e & 0x7F) for e in events)
+
+
+def expect(failures, what, got, want):
+    if got != want:
+        failures.append("{}: got {}, want {}".format(what, got, want))
+
+
+# --------------------------
+# A KeyboardReader on a byte stream
+# --------------------------
+class _Wire:
+    """The keyboard's end of the UART: bytes written here are read next."""
+    def __init__(self):
+        self._rx = bytearray()
+
+    def send(self, data):
+        self._rx += bytes(data)
+
+    @property
+    def in_waiting(self):
+        return len(self._rx)
+
+    def read(self, nbytes=None):
+        n = len(self._rx) if nbytes is None else min(nbytes, len(self._rx))
+        data = bytes(self._rx[:n])
+        del self._rx[:n]
+        return data or None
+
+    def readinto(self, buf):
+        n = min(len(buf), len(self._rx))
+        buf[:n] = self._rx[:n]
+        del self._rx[:n]
+        return n or None
+
+
+class _Pin:
+    value = False
+
+
+def reader(rxbuf=16, debounce_ms=0, nkro=False):
+    """Return (KeyboardReader after the handshake, its _Wire)."""
+    world.reset()
+    wire = _Wire()
+    with contextlib.redirect_stdout(io.StringIO()):
+        kbd = stow_kbd.KeyboardReader(None, 9600, 8, None, 1, "GP0", "GP17", "GP16",
+                                      rxbuf_max=rxbuf, uart=wire, power=_Pin(),
+                                      debounce_ms=debounce_ms, nkro=nkro)
+    kbd.ready = True
+    return kbd, wire
+
+
+def sc_of(keycode):
+    """Make code of `keycode` in the layout in use."""
+    return stow_kbd.get_keymap().base.index(keycode)
+
+
+def unmapped():
+    """A scancode the layout doesn't map."""
+    for sc in range(0x7F):
+        if not stow_kbd.DISPATCH[sc] >> 16:
+            return sc
+    raise LookupError("every scancode is mapped")
+
+
+SHIFT, KEY_A, KEY_B, KEY_L = 0xE1, 0x04, 0x05, 0x0F
+
+
+# --------------------------
+# Decoder
+# --------------------------
+@case
+def decoder_chunks():
+    """Every split of one stream into two chunks decodes the same."""
+    failures = []
+    stream = bytes((0xF9, 0xFB, 0x10, 0x11, 0x91, 0x90, 0x90, 0xF9, 0x12, 0x92))
+    want = [ev(EV_HANDSHAKE, 0), ev(EV_DOWN, 0x10), ev(EV_DOWN, 0x11),
+            ev(EV_UP, 0x11), ev(EV_UP, 0x10), ev(EV_ALL_UP, 0x10),
+            ev(EV_DOWN, 0x12), ev(EV_UP, 0x12)]
+    for cut in range(len(stream) + 1):
+        dec = ScancodeDecoder()
+        got = list(dec.feed(stream[:cut])) + list(dec.feed(stream[cut:]))
+        expect(failures, "cut at {}".format(cut), names(got), names(want))
+        expect(failures, "errors, cut at {}".format(cut), dec.errors, 1)  # The lone 0xF9
+    return failures
+
+
+# --------------------------
+# Key state
+# --------------------------
+@case
+def keystate():
+    failures = []
+    keys = KeyState(96)
+    expect(failures, "first press", keys.press(5), True)
+    expect(failures, "repeat", keys.press(5), False)
+    keys.press(40)
+    old = keys.snapshot()
+    keys.release(5)
+    keys.press(90)
+    expect(failures, "out of range", keys.press(100), False)
+    changes = []
+    n = keys.diff(old, lambda sc, down: changes.append((sc, down)))
+    expect(failures, "diff", (n, changes), (2, [(5, False), (90, True)]))
+    released = []
+    expect(failures, "release_all", keys.release_all(released.append), 2)
+    expect(failures, "released", (released, len(keys)), ([40, 90], 0))
+    return failures
+
+
+# --------------------------
+# Overflow policy
+# --------------------------
+def squeeze(stream, size=16):
+    """Put `stream` into a ring of `size` with a Compactor. Return (ring bytes, compactor)."""
+    ring = RingBuffer(size)
+    comp = Compactor(size)
+    ring.on_full = comp
+    for b in stream:
+        ring.put(b)
+    out = bytearray(len(ring))
+    ring.pop_many(out)
+    return bytes(out), comp
+
+
+@case
+def compactor_order():
+    """Repeats go first, then taps; what is kept keeps its order."""
+    failures = []
+    a, b, c = 0x10, 0x11, 0x12
+    # Held a auto-repeats, b and c are tapped
+    stream = bytes((a, a, a, a, b, b | 0x80, c, c | 0x80, a, a, a, a, a, a, a, a, a | 0x80))
+    kept, comp = squeeze(stream)
+    expect(failures, "merged", comp.merged, 11)  # Every repeat, not just the 4 needed
+    expect(failures, "lossy", comp.lossy, False)
+    it = iter(stream)
+    if not all(x in it for x in kept):
+        failures.append("order changed: {}".format(kept.hex(" ")))
+    dec = ScancodeDecoder()
+    expect(failures, "last event", names(list(dec.feed(kept))[-1:]), names([ev(EV_UP, a)]))
+    return failures
+
+
+@case
+def compactor_breaks():
+    """With only breaks left to drop, their scancodes are marked lost."""
+    failures = []
+    stream = bytes(range(0x80 + 0x20, 0x80 + 0x20 + 17))
+    kept, comp = squeeze(stream)
+    expect(failures, "dropped breaks", comp.dropped_breaks, 4)
+    expect(failures, "lossy", comp.lossy, True)
+    lost = [sc for sc in range(128) if comp.lost[sc >> 3] & (1 << (sc & 7))]
+    expect(failures, "lost", lost, [0x20, 0x21, 0x22, 0x23])
+    expect(failures, "kept", len(kept), 13)
+    return failures
+
+
+@case
+def reader_overflow_taps():
+    """Taps that overflow a 16-byte ring leave nothing held on the host."""
+    failures = []
+    kbd, wire = reader(16)
+    burst = bytearray()
+    for sc in sim.scancodes_for("the quick brown fox"):
+        burst += bytes((sc, sc | 0x80))
+    wire.send(burst + bytes((burst[-1],)))  # Ends with "all keys up"
+    kbd.get_all()
+    mods, keys = world.hid.keys()
+    expect(failures, "host keys", (mods, keys), (0, set()))
+    expect(failures, "reader keys", len(kbd.keys), 0)
+    return failures
+
+
+@case
+def reader_overflow_double_letter():
+    """
+    Shift held, L typed, then L again in a burst that overflows: the
+    compactor drops the second L's make, and its break must not pair
+    up with the first L's break into "all keys up".
+    """
+    failures = []
+    kbd, wire = reader(16)
+    shift, l = sc_of(SHIFT), sc_of(KEY_L)
+    wire.send((shift, l, l | 0x80))
+    kbd.get_all()
+    burst = bytearray((l, l | 0x80))
+    for sc in sim.scancodes_for("abcdefgh"):
+        burst += bytes((sc, sc | 0x80))
+    wire.send(burst)
+    kbd.get_all()
+    expect(failures, "host modifiers", world.hid.keys()[0], 0x02)
+    expect(failures, "Shift down", kbd.keys.is_down(shift), True)
+    return failures
+
+
+@case
+def reader_resync_once():
+    """
+    Shift's break is lost in an overflow: one EV_RESYNC comes out, the
+    next call decodes on, and dispatching it releases Shift.
+    """
+    failures = []
+    kbd, wire = reader(16)
+    shift = sc_of(SHIFT)
+    wire.send((shift,))
+    kbd.get_all()
+    others = [sc for sc in sim.scancodes_for("abcdefghijklmnopq") if sc != shift]
+    wire.send(bytes([shift | 0x80] + [sc | 0x80 for sc in others[:16]]))
+    events = []
+    e = kbd.read_event()
+    while e and len(events) < 40:
+        events.append(e)
+        e = kbd.read_event()
+    expect(failures, "first event", names(events[:1]), names([ev(EV_RESYNC, 0)]))
+    expect(failures, "resyncs", sum(1 for e in events if e >> 8 == EV_RESYNC), 1)
+    for e in events:
+        kbd.dispatch(e)
+    kbd.flush()
+    expect(failures, "host modifiers", world.hid.keys()[0], 0)
+    expect(failures, "Shift down", kbd.keys.is_down(shift), False)
+    return failures
+
+
+# --------------------------
+# Chatter filter
+# --------------------------
+def filtered(chatter, timed, until):
+    """Feed (ms, event) pairs, popping every ms up to `until`. Return [(ms, event)]."""
+    out = []
+    timed = list(timed)
+    for now in range(until + 1):
+        e = chatter.pop(now)
+        while e:
+            out.append((now, e))
+            e = chatter.pop(now)
+        while timed and timed[0][0] == now:
+            e = chatter.feed(timed.pop(0)[1], now)
+            if e:
+                out.append((now, e))
+    return out
+
+
+@case
+def chatter_bounces():
+    failures = []
+    stow_kbd.get_keymap()
+    a = sc_of(KEY_A)
+    ghost = unmapped()
+    chatter = ChatterFilter(stow_kbd.DISPATCH, 8)
+    got = filtered(chatter, [
+        (10, ev(EV_DOWN, a)),
+        (50, ev(EV_UP, a)), (53, ev(EV_DOWN, a)),    # Release chatter
+        (60, ev(EV_DOWN, ghost)),                    # Unmapped
+        (100, ev(EV_UP, a)),
+        (104, ev(EV_UP, a)),                         # Stray: lets the held break go
+    ], 130)
+    expect(failures, "events", got, [(10, ev(EV_DOWN, a)), (104, ev(EV_UP, a))])
+    expect(failures, "counters", (chatter.bounces, chatter.ghosts, chatter.strays), (1, 1, 1))
+    return failures
+
+
+@case
+def chatter_double_tap():
+    """A real double tap is slower than the window and goes through."""
+    failures = []
+    a = sc_of(KEY_A)
+    chatter = ChatterFilter(stow_kbd.DISPATCH, 8)
+    got = filtered(chatter, [(0, ev(EV_DOWN, a)), (40, ev(EV_UP, a)),
+                             (80, ev(EV_DOWN, a)), (120, ev(EV_UP, a))], 140)
+    expect(failures, "events", [e for _, e in got],
+           [ev(EV_DOWN, a), ev(EV_UP, a), ev(EV_DOWN, a), ev(EV_UP, a)])
+    expect(failures, "bounces", chatter.bounces, 0)
+    return failures
+
+
+@case
+def chatter_queue_full():
+    """
+    A, A up, B into a queue of two: A up is let go by B and fills the
+    queue, B waits in the filter. rx_task must still send it on once
+    there is room, with nothing more coming from the keyboard.
+    """
+    failures = []
+    kbd, wire = reader(16, debounce_ms=8)
+    a, b = sc_of(KEY_A), sc_of(KEY_B)
+
+    async def run():
+        queue = EventQueue(2)
+        task = asyncio.ensure_future(rx_task(kbd, queue, poll_ms=1))
+        wire.send((a, a | 0x80, b))
+        await asyncio.sleep(0.02)
+        got = [queue.get_nowait(), queue.get_nowait()]
+        await asyncio.sleep(0.05)
+        got.append(queue.get_nowait())
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        return got
+
+    got = asyncio.run(run())
+    expect(failures, "events", names(got),
+           names([ev(EV_DOWN, a), ev(EV_UP, a), ev(EV_DOWN, b)]))
+    return failures
+
+
+@case
+def repower_clears_queue():
+    """
+    A make and a held break are waiting when the watchdog re-powers the
+    keyboard: neither may reach the host after the power-off.
+    """
+    failures = []
+    kbd, wire = reader(16, debounce_ms=8)
+    kbd.queue = EventQueue(4)
+    a, b = sc_of(KEY_A), sc_of(KEY_B)
+    wire.send((a, b, b | 0x80))
+    e = kbd.read_event()
+    while e:
+        kbd.queue.put_nowait(e)
+        e = kbd.read_event()
+    expect(failures, "held before", kbd.chatter.held, ev(EV_UP, b))
+    kbd._power_off()
+    expect(failures, "queued after", len(kbd.queue), 0)
+    expect(failures, "held after", kbd.chatter.pending(), False)
+    e = kbd.queue.get_nowait()
+    while e:
+        kbd.dispatch(e)
+        e = kbd.queue.get_nowait()
+    kbd.flush()
+    expect(failures, "host keys", world.hid.keys(), (0, set()))
+    return failures
+
+
+@case
+def nkro_boot_host():
+    """
+    A host that asked for the boot protocol reads the first 8 bytes of
+    the NKRO report; the report keeps its length, with no bitmap.
+    """
+    import usb_hid
+    import stow_nkro
+    failures = []
+    usb_hid.enable((stow_nkro.device(),), boot_device=1)
+    try:
+        for boot in (False, True):
+            kbd, wire = reader(16, nkro=True)
+            world.hid.boot_protocol = boot
+            a, b = sc_of(KEY_A), sc_of(KEY_B)
+            wire.send((sc_of(SHIFT), a, b))
+            kbd.get_all()
+            report = world.hid.reports[-1][1]
+            expect(failures, "report length, boot={}".format(boot), len(report),
+                   stow_nkro.REPORT_LEN)
+            expect(failures, "bitmap empty, boot={}".format(boot),
+                   not any(report[stow_nkro.BITMAP:]), boot)
+            expect(failures, "keys, boot={}".format(boot), world.hid.keys(),
+                   (0x02, {KEY_A, KEY_B}))
+    finally:
+        usb_hid.enable((usb_hid.Device.KEYBOARD,))
+    return failures
+
+
+# --------------------------
+# Capture
+# --------------------------
+class _Port:
+    """usb_cdc.data with or without a computer listening."""
+    def __init__(self):
+        self.connected = False
+        self.data = bytearray()
+
+    def write(self, data):
+        self.data += data
+
+
+@case
+def capture_disconnected_start():
+    """
+    Nobody listens to the serial port at first, then capture_reader
+    starts: what it gets must still begin with a header, and again
+    after the port goes away and comes back.
+    """
+    import stow_capture
+    failures = []
+    port = _Port()
+    rec = stow_capture.Recorder(port, 64)
+    rec.chunk(b"\x01\x02", 2)
+    rec.flush()
+    expect(failures, "written while disconnected", len(port.data), 0)
+    for session in (1, 2):
+        port.connected = True
+        port.data = bytearray()
+        rec.chunk(b"\x03", 1)
+        rec.flush()
+        try:
+            stow_capture.check_header(port.data)
+        except ValueError as e:
+            failures.append("session {}: {}".format(session, e))
+            continue
+        got = [(None if data is None else bytes(data), marker)
+               for _, data, marker in stow_capture.records(port.data)]
+        expect(failures, "session {} records".format(session), got,
+               [(None, stow_capture.MARK_LOST), (b"\x03", -1)])
+        port.connected = False
+        rec.chunk(b"\x04", 1)
+        rec.flush()
+    return failures
+
+
+def main_streamcheck():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("-v", "--verbose", action="store_true", help="Show every case")
+    args = parser.parse_args()
+
+    failed = 0
+    for fn in CASES:
+        failures = fn()
+        if failures:
+            failed += 1
+        if failures or args.verbose:
+            print("{}: {}".format(fn.__name__, "FAIL" if failures else "ok"))
+        for f in failures:
+            print("  " + f)
+    print("stream check: {} cases, {} failed".format(len(CASES), failed))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_streamcheck())
@@ -0,0 +1,223 @@
+# CPython: Simulated hardware behind the fake CircuitPython modules
+"""
+One `world` object connects the fake modules in sim/fakes:
+
+- `world.keyboard` is a scripted Stowaway: it answers power-up on its
+  power pin with the 0xF9 0xFB handshake and sends make/break bytes
+- `world.uart` is the fake busio.UART the code under test opened first;
+  bytes become readable at their scheduled time, never faster than
+  the baud rate allows, and overflow its receive FIFO like the real one
+- `world.add_keyboard()` wires up one more Stowaway to the UART on
+  another RX pin (`world.uarts` has all of them, by RX pin)
+- `world.hid` records every HID report with a timestamp
+- `world.display` is the fake SSD1306 (None if `display_present` is False)
+- `world.cdc_data` collects what was written to usb_cdc.data
+"""
+
+import time
+
+
+class SimUART:
+    """Receive side of busio.UART, fed by the simulated keyboard."""
+    def __init__(self, world, baudrate=9600, receiver_buffer_size=64):
+        self.world = world
+        self.baudrate = baudrate
+        self.receiver_buffer_size = receiver_buffer_size
+        self.timeout = 1.0
+        self._pending = []    # (due time, byte), sorted by due time
+        self._fifo = bytearray()
+        self._line_free = 0.0 # When the next byte can finish on the wire
+        self.arrivals = []    # (due time, byte) of everything received
+        self.overruns = 0     # Bytes lost because the FIFO was full
+
+    def byte_time(self):
+        # 10 bits per byte: start, 8 data, stop
+        return 10 / self.baudrate
+
+    def inject(self, data, at=None):
+        """Schedule `data` to arrive, starting at monotonic time `at`."""
+        t = time.monotonic() if at is None else at
+        for b in data:
+            t = max(t, self._line_free) + self.byte_time()
+            self._line_free = t
+            self._pending.append((t, b))
+
+    def clear(self):
+        self._pending = []
+        self._fifo = bytearray()
+
+    def _update(self):
+        now = time.monotonic()
+        i = 0
+        while i < len(self._pending) and self._pending[i][0] <= now:
+            due, b = self._pending[i]
+            if len(self._fifo) < self.receiver_buffer_size:
+                self._fifo.append(b)
+                self.arrivals.append((due, b))
+            else:
+                self.overruns += 1
+            i += 1
+        if i:
+            del self._pending[:i]
+
+    def idle(self):
+        """True when nothing is scheduled or waiting to be read."""
+        self._update()
+        return not self._pending and not self._fifo
+
+    # --- busio.UART interface ---
+    @property
+    def in_waiting(self):
+        self._update()
+        return len(self._fifo)
+
+    def read(self, nbytes=None):
+        self._update()
+        if not self._fifo:
+            return None
+        n = len(self._fifo) if nbytes is None else min(nbytes, len(self._fifo))
+        data = bytes(self._fifo[:n])
+        del self._fifo[:n]
+        return data
+
+    def readinto(self, buf):
+        self._update()
+        n = min(len(buf), len(self._fifo))
+        if not n:
+            return None
+        buf[:n] = self._fifo[:n]
+        del self._fifo[:n]
+        return n
+
+    def write(self, buf):
+        return len(buf)
+
+    def reset_input_buffer(self):
+        self._fifo = bytearray()
+
+    def deinit(self):
+        pass
+
+
+class SimKeyboard:
+    """
+    A Stowaway on a power pin. Sends the handshake `handshake_ms` after
+    power-up (unless `dead` is set) and forgets everything on power-down.
+    Talks to the UART on `rx_pin` (None: the first one opened).
+    """
+    def __init__(self, world, power_pin="GP16", handshake_ms=30, rx_pin=None):
+        self.world = world
+        self.power_pin = power_pin
+        self.rx_pin = rx_pin
+        self.handshake_ms = handshake_ms
+        self.dead = False      # Never answer power-up
+        self.powered = False
+        self.power_ups = 0
+        self.held = set()
+
+    @property
+    def uart(self):
+        if self.rx_pin is None:
+            return self.world.uart
+        return self.world.uarts.get(self.rx_pin)
+
+    def set_power(self, on):
+        if on and not self.powered:
+            self.power_ups += 1
+            if not self.dead and self.uart:
+                at = time.monotonic() + self.handshake_ms / 1000
+                self.uart.inject(b"\xf9\xfb", at)
+        elif not on and self.powered:
+            self.held.clear()
+            if self.uart:
+                self.uart.clear()
+        self.powered = on
+
+    def send(self, data, at=None):
+        """Send raw bytes (only while powered, like the real keyboard)."""
+        if self.powered and self.uart:
+            self.uart.inject(data, at)
+
+    def press(self, scancode, at=None):
+        self.held.add(scancode)
+        self.send(bytes((scancode,)), at)
+
+    def release(self, scancode, at=None):
+        self.held.discard(scancode)
+        b = scancode | 0x80
+        # Last key up: the break byte is sent twice ("all keys up")
+        self.send(bytes((b, b)) if not self.held else bytes((b,)), at)
+
+    def tap(self, scancode, at=None):
+        self.press(scancode, at)
+        self.release(scancode)
+
+
+class HidRecorder:
+    """The USB host: records (monotonic time, report bytes)."""
+    def __init__(self):
+        self.reports = []
+        self.count = 0     # Reports sent, kept or not
+        self.keep = True   # False: only count (heap measurements)
+        self.fail = False  # Raise on send, like a stalled host
+        self.boot_protocol = False  # Host asks a boot keyboard for boot reports
+        self.poll_ms = 0   # Each send blocks this long, like a host slow to poll
+
+    def send(self, report):
+        if self.fail:
+            raise OSError("USB busy")
+        if self.poll_ms:
+            time.sleep(self.poll_ms / 1000)
+        self.count += 1
+        if self.keep:
+            self.reports.append((time.monotonic(), bytes(report)))
+
+    def keys(self, report=None):
+        """
+        Return (modifier byte, set of keycodes) for a report (default:
+        last). NKRO reports (longer than 8 bytes) are read from the bitmap,
+        unless the host uses the boot protocol and reads only 8 bytes.
+        """
+        if report is None:
+            if not self.reports:
+                return 0, set()
+            report = self.reports[-1][1]
+        if len(report) > 8 and not self.boot_protocol:
+            return report[0], {k for k in range((len(report) - 8) * 8)
+                               if report[8 + (k >> 3)] & (1 << (k & 7))}
+        return report[0], {k for k in report[2:8] if k}
+
+    def clear(self):
+        self.reports = []
+        self.count = 0
+
+
+class World:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.uart = None
+        self.uarts = {}  # RX pin -> SimUART
+        self.keyboard = SimKeyboard(self)
+        self.keyboards = [self.keyboard]
+        self.hid = HidRecorder()
+        self.display_present = True
+        self.display = None
+        self.pins = {}  # Pin name -> last value written
+        self.cdc_data = bytearray()  # Written to usb_cdc.data
+
+    def add_keyboard(self, power_pin, rx_pin, handshake_ms=30):
+        """Connect one more Stowaway. Return it."""
+        kbd = SimKeyboard(self, power_pin, handshake_ms, rx_pin)
+        self.keyboards.append(kbd)
+        return kbd
+
+    def set_pin(self, pin, value):
+        self.pins[pin] = value
+        for kbd in self.keyboards:
+            if pin == kbd.power_pin:
+                kbd.set_power(value)
+
+
+world = World()
@@ -0,0 +1,22 @@
+# CircuitPython: boot.py - runs once before USB is set up
+# Changes here take effect after a hard reset (not on auto-reload).
+
+import os
+import usb_cdc
+import usb_hid
+
+# Second serial port for stow_stats - keeps the console (REPL) free.
+# Read it on the host with tools/stats_reader.py.
+usb_cdc.enable(console=True, data=True)
+
+# N-key rollover keyboard (STOW_NKRO = 1 in settings.toml) in place of
+# the stock devices; boot_device=1 keeps it usable for BIOS/boot hosts
+if os.getenv("STOW_NKRO"):
+    import stow_nkro
+    usb_hid.enable((stow_nkro.device(),), boot_device=1)
+
+# For stow_capture (main.py: capture = True) to write capture.stc to
+# flash, the Pico needs the filesystem - the computer then sees CIRCUITPY
+# read-only. Uncomment, reset, and comment out again to edit files.
+# import storage
+# storage.remount("/", readonly=False)
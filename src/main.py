@@ -3,13 +3,22 @@
 VERSION = "1.0"
 
 
+import stow_stats
+stow_stats.mark("start")
 import busio
+import os
 import time
 import stow_kbd
 import asyncio
-import board, displayio, terminalio, sys, i2cdisplaybus
-from adafruit_display_text import label
-from adafruit_displayio_ssd1306 import SSD1306
+import stow_log
+from stow_log import log, log_task, INFO, MSG_SHOW_KEY
+from stow_stats import stats_task
+import stow_gc
+import stow_capture
+import stow_power
+import board, sys
+# Display libraries are imported by setup_display(), once a display answers
+stow_stats.mark("imports")
 
 # --------------------------
 # Pin configuration (adjust)
@@ -19,13 +28,98 @@ i2c_sda_pin = board.GP20
 uart_rxd_pin = board.GP17
 uart_txd_pin = board.GP0   # Must be assigned, even if TX is unused
 kbd_power_pin = board.GP16 # Powers the keyboard module (active-high)
+# More keyboards on spare UARTs: (TX pin, RX pin, power pin) each, e.g.
+# extra_keyboards = [(board.GP4, board.GP5, board.GP15)]
+extra_keyboards = []
+
+# --------------------------
+# Keyboard layout
+# --------------------------
+# A compiled keymap in keymaps/ (see tools/keymap_compiler.py);
+# STOW_LAYOUT in settings.toml picks another one without editing code
+keymap_layout = os.getenv("STOW_LAYOUT") or "de"
+# N-key rollover instead of the 6-key boot report: STOW_NKRO = 1 in
+# settings.toml, then a hard reset so boot.py installs it (see stow_nkro)
+hid_nkro = bool(os.getenv("STOW_NKRO"))
+
+# --------------------------
+# Latency / CPU trade-off
+# --------------------------
+rx_poll_ms = 1        # Sleep between UART checks while idle (0 = just yield)
+event_queue_len = 32  # Decoded events waiting for USB
+
+# --------------------------
+# Macros (macro lines in layouts/*.txt, see stow_macro)
+# --------------------------
+macro_pace_ms = 10    # One macro report per this many ms - the host polls every 8 ms (0 = macros off)
+
+# --------------------------
+# Idle power (see stow_power)
+# --------------------------
+# The keyboard stays powered: without power it can't see the first key
+power_active_ms = 500     # Check the UART every rx_poll_ms for this long after a key...
+rx_max_poll_ms = 32       # ...then back off to this (0 = never back off)
+power_sleep_after_s = 60  # Light sleep between checks after this long without a key (0 = never)
+power_sleep_ms = 100      # Longest light sleep
+power_wake_pin = None     # A spare pin wired to the RX line (e.g. board.GP18) ends sleep on the first bit
+
+# --------------------------
+# Chatter filter (see stow_filter)
+# --------------------------
+# For worn membranes that bounce or send phantom codes: drops a key-up
+# followed by the same key's key-down within this window, and codes the
+# layout doesn't map. Key-ups wait up to this long (0 = filter off)
+kbd_debounce_ms = 0
+
+# --------------------------
+# Keyboard watchdog
+# --------------------------
+# Re-power the keyboard after this long without a key (0 = never). Off by
+# default: a key pressed before the keyboard's handshake is lost, and the
+# error check below already catches a keyboard that went bad
+idle_repower_s = 0
+max_kbd_errors = 8    # Re-power after this many protocol errors in one check
+
+# --------------------------
+# Display
+# --------------------------
+display_max_fps = 10  # Upper limit for OLED refreshes
+display_quiet_ms = 50 # Hold refreshes back while keys arrive faster than this...
+display_max_defer_ms = 500  # ...but not for longer than this
+display_dim_s = 30    # Dim the OLED after this long without a key (0 = never)...
+display_off_s = 300   # ...and switch it off after this long (0 = never)
+display_dim_brightness = 0.05
+
+# --------------------------
+# Logging
+# --------------------------
+log_level = stow_log.INFO  # stow_log.DEBUG logs every scancode and keycode
+stats_period_s = 1.0      # Counters/histograms on usb_cdc.data (see boot.py), 0 = off
+
+# --------------------------
+# Capture (see stow_capture, replay with sim/replay.py)
+# --------------------------
+# Records raw UART data to capture_path if boot.py made CIRCUITPY
+# writable for the Pico, else streams it to usb_cdc.data (save it with
+# tools/capture_reader.py); stats are off then, they use the same port
+capture = False
+capture_path = "/capture.stc"
+capture_buffer = 1024  # RAM buffer; records are dropped while it is full
+
+# --------------------------
+# Garbage collection
+# --------------------------
+gc_idle_ms = 300      # Collect once no key has arrived for this long...
+gc_max_interval_s = 10  # ...and at least this often while idle
 
 # --------------------------
 # Global state
 # --------------------------
 kbd_active = False
+manager = None  # stow_kbd.KeyboardManager, once the keyboard is up
 writer = None
 display = None
+display_address = 0x3C
 
 original_stdout = sys.stdout
 
@@ -33,11 +127,27 @@ original_stdout = sys.stdout
 
 # --- Stdout mirroring ---
 class OLEDWriter:
-    def __init__(self, label_obj, max_lines=8, cols=21):
-        self.label = label_obj
-        self.max_lines = max_lines
+    """
+    Line model for the OLED, one Label per row.
+
+    write() only updates the model and is cheap enough for the key path;
+    render() copies changed rows into their Labels and is called by
+    display_task() at a limited frame rate.
+
+    It can be created before the display is up (labels=None): text
+    written until attach() is shown once the Labels are there.
+    """
+    def __init__(self, labels=None, cols=21, rows=5):
+        self.labels = labels
+        self.max_lines = len(labels) if labels else rows
         self.cols = cols
         self.lines = [""]
+        self._shown = [""] * self.max_lines  # Text currently in each Label
+        self.dirty = False
+
+    def attach(self, labels):
+        self.labels = labels
+        self.dirty = True
 
     def write(self, s):
         for ch in s:
@@ -49,9 +159,23 @@ class OLEDWriter:
                 self.lines[-1] += ch
             if len(self.lines) > self.max_lines:
                 self.lines = self.lines[-self.max_lines:]
-        self.label.text = "\n".join(self.lines)
+        self.dirty = True
         return len(s)
 
+    def render(self):
+        """Update the Labels of rows that changed. Return True if any did."""
+        if not self.dirty or not self.labels:
+            return False
+        self.dirty = False
+        changed = False
+        for i in range(self.max_lines):
+            text = self.lines[i] if i < len(self.lines) else ""
+            if text != self._shown[i]:
+                self.labels[i].text = text
+                self._shown[i] = text
+                changed = True
+        return changed
+
     def flush(self):
         pass
 
@@ -77,80 +201,211 @@ def cprint(*args, **kwargs):
         writer.write(msg + "\n")
     print(*args, **kwargs)
 
-def setup_display():
-        # Optional OLED setup
-    print("Trying I2C init")
-    global display
+def probe_display():
+    """
+    Return the I2C bus if something answers at display_address,
+    else None. Needs no display libraries.
+    """
+    # Displays survive a soft reload and would keep the I2C pins busy
+    import displayio
     displayio.release_displays()
-    # If no Group is defined, the display automatically mirrors the terminal. 
-    
     try:
         i2c = busio.I2C(scl=i2c_scl_pin, sda=i2c_sda_pin, frequency=400000)
-        bus = i2cdisplaybus.I2CDisplayBus(i2c, device_address=0x3C)
+    except Exception as e:
+        print(f"No I2C bus: {e}")
+        return None
+    found = False
+    if i2c.try_lock():
+        try:
+            found = display_address in i2c.scan()
+        finally:
+            i2c.unlock()
+    if not found:
+        i2c.deinit()
+        print("No OLED display at 0x{:02X}".format(display_address))
+        return None
+    return i2c
+
+def setup_display(i2c=None):
+    """Set up the SSD1306 on `i2c` (probed if None). Return True if it is on."""
+    global display, writer
+    print("Trying I2C init")
+    if i2c is None:
+        i2c = probe_display()
+        if i2c is None:
+            return False
+    # If no Group is defined, the display automatically mirrors the terminal. 
+    try:
+        import displayio, terminalio, i2cdisplaybus
+        from adafruit_display_text import label
+        from adafruit_displayio_ssd1306 import SSD1306
+
+        bus = i2cdisplaybus.I2CDisplayBus(i2c, device_address=display_address)
         display = SSD1306(bus, width=128, height=64)
+        # Refresh only from display_task(), never from the key path
+        display.auto_refresh = False
         
         splash = displayio.Group()
-        text = label.Label(terminalio.FONT, text="", x=0, y=8)  # y is baseline of first line
-        splash.append(text)
+        row_height = terminalio.FONT.get_bounding_box()[1]
+        rows = []
+        for i in range(5):
+            # y is baseline of the row
+            row = label.Label(terminalio.FONT, text="", x=0, y=8 + i * row_height)
+            splash.append(row)
+            rows.append(row)
         
         # This disables the status bar
         display.root_group = splash
 
         # Manual stdout/stderr mirroring
-        global writer
         print("Preparing writer")
-        writer = OLEDWriter(text, max_lines=5, cols=21)
+        if writer is None:
+            writer = OLEDWriter(cols=21)
+        writer.attach(rows)
         
         # sys.stdout = Tee(original_stdout, writer)
         
         cprint("Custom terminal ready")
         cprint(f"OLED on. V{VERSION}")
+        stow_stats.mark("display")
+        return True
     except Exception as e:
         print(f"No OLED display available: {e}")
+        return False
+
+async def display_task():
+    """
+    Bring up the OLED in the background, then refresh it at low
+    priority: at most display_max_fps frames, and while keys are
+    arriving, wait for a gap so the I2C transfer does not delay the
+    HID path (up to display_max_defer_ms).
+    """
+    await asyncio.sleep(0)  # Keyboard init goes first
+    i2c = probe_display()
+    if i2c is None:
+        return
+    await asyncio.sleep(0)
+    if not setup_display(i2c):
+        return
+    period = 1 / display_max_fps
+    pending_since = None
+    level = 0
+    while True:
+        await asyncio.sleep(period if level < 2 else 1)
+        want = display_level()
+        if want != level:
+            level = want
+            set_display_level(level)
+        if level == 2 or not writer.dirty:
+            continue
+        now = time.monotonic()
+        if pending_since is None:
+            pending_since = now
+        if keys_busy() and (now - pending_since) * 1000 < display_max_defer_ms:
+            continue
+        pending_since = None
+        if writer.render():
+            display.refresh()
+
+def display_level():
+    """0: on, 1: dimmed, 2: off - from how long the keyboard has been quiet."""
+    kbd = manager or stow_kbd.keyboard
+    if kbd is None:
+        return 0
+    quiet = time.monotonic() - kbd.last_rx
+    if display_off_s and quiet > display_off_s:
+        return 2
+    if display_dim_s and quiet > display_dim_s:
+        return 1
+    return 0
+
+def set_display_level(level):
+    try:
+        if level == 2:
+            display.sleep()
+            return
+        if not display.is_awake:
+            display.wake()
+        display.brightness = display_dim_brightness if level == 1 else 1.0
+    except Exception as e:
+        print("Display: {}".format(e))  # Not every driver can dim
 
 # --------------------------
 # Example: read keyboard and show on SSD1306 OLED
 # --------------------------
+def show_key(scancode, key):
+    # Formatted later by log_task, not on the key path
+    log.event(INFO, MSG_SHOW_KEY, scancode, key)
+
+def keys_busy():
+    kbd = manager or stow_kbd.keyboard
+    return kbd is not None and (time.monotonic() - kbd.last_rx) * 1000 < display_quiet_ms
+
 async def reader_task():
     """
-    Periodically check the keyboard buffer and, if data is present,
-    print to the REPL and optionally show on the OLED.
-    """
-    global kbd_active
-    keys = []
+    Bring up the keyboard, then run the UART and HID tasks:
+    the UART task wakes as soon as bytes arrive and feeds decoded
+    events into a bounded queue, the HID task sends them to USB
+    and optionally shows them on the OLED.
 
-    while True:
-        # Ensure init is called repeatedly until ready is observed
-        if not kbd_active:
-            cprint("Init keys...")
-            success = stow_kbd.init_kbd(
-                uart_id=busio.UART,
-                baudrate=9600,
-                bits=8,
-                parity=None,
-                stop=1,
-                tx=uart_txd_pin,
-                rx=uart_rxd_pin,
-                power_pin=kbd_power_pin,
-                ready_timeout_ms=1000,  # Increased timeout to 1000ms
-                rxbuf_max=128,
-            )
-            if success:
-                cprint("Keys ready")
-                kbd_active = True
-            else:
-                cprint("FAIL: timeout")
+    UART and HID come first; the OLED is probed and set up by
+    display_task while the keyboard powers up.
+    """
+    global kbd_active, writer, manager
 
-        if kbd_active and stow_kbd.uart.any():
-            # Use get() method to process keypresses and send USB HID events
-            scancode, key = stow_kbd.uart.get()  # This processes the data and sends USB keypresses automatically
-            if scancode is not None and key is not None:
-                cprint(f"Scan: 0x{scancode:02X} Key: 0x{key:02X}s")
+    log.set_level(log_level)
+    if writer is None:
+        writer = OLEDWriter()  # Keeps boot messages until the OLED is up
+    oled_task = asyncio.create_task(display_task())
+    logger_task = asyncio.create_task(log_task(cprint, busy=keys_busy))
+    try:
+        stow_kbd.use_layout(keymap_layout)
+    except (OSError, ValueError) as e:
+        cprint("Layout {}: {}".format(keymap_layout, e))  # Falls back to the default
+    stow_stats.mark("layout")
+    rec = stow_capture.open_recorder(capture_path, capture_buffer) if capture else None
+    cprint("Init keys...")
+    # Retries with backoff until ready, without blocking the event loop
+    kbd = await stow_kbd.init_kbd_async(
+        uart_id=busio.UART,
+        baudrate=9600,
+        bits=8,
+        parity=None,
+        stop=1,
+        tx=uart_txd_pin,
+        rx=uart_rxd_pin,
+        power_pin=kbd_power_pin,
+        ready_timeout_ms=1000,  # Increased timeout to 1000ms
+        rxbuf_max=128,
+        capture=rec,
+        nkro=hid_nkro,
+        debounce_ms=kbd_debounce_ms,
+    )
+    cprint("Keys ready")
+    kbd_active = True
 
-        await asyncio.sleep(0.02)  # 10ms delay
+    # Further keyboards share the first one's HID report and come up
+    # in the background - one that doesn't answer holds up nothing
+    manager = stow_kbd.KeyboardManager([kbd], macro_pace_ms)
+    for tx, rx, power in extra_keyboards:
+        manager.add(tx, rx, power, ready_timeout_ms=1000, rxbuf_max=128,
+                    debounce_ms=kbd_debounce_ms)
+    tasks = [
+        manager.run(rx_poll_ms, event_queue_len, show_key, stow_gc.check,
+                    idle_repower_s, max_kbd_errors, rx_max_poll_ms, power_active_ms),
+        stow_power.power_task(manager, power_active_ms, power_sleep_after_s,
+                              power_sleep_ms, power_wake_pin),
+        stow_gc.gc_task(manager, gc_idle_ms, gc_max_interval_s),
+        oled_task,
+        logger_task,
+    ]
+    if rec:
+        tasks.append(stow_capture.capture_task(rec, keys_busy))
+    if stats_period_s and not (rec and rec.sink is stow_capture.serial_port()):
+        tasks.append(stats_task(manager, period_s=stats_period_s, idle=stow_power.idle))
+    await asyncio.gather(*tasks)
 
 def main():
-    setup_display()
     # Start the reader loop
     try:
         cprint("Starting reader_task")
@@ -174,6 +429,9 @@ def main_test_text():
         for k in range(21):
             string += str((i+ k+1) % 10)
         cprint(string)
+    if writer:
+        writer.render()
+        display.refresh()
     # Wait for enter to finish
     input()
 
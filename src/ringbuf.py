@@ -0,0 +1,124 @@
+# CircuitPython: Fixed-size byte ring buffer for UART scancodes
+# No hardware imports - sim/streamcheck.py overflows it on CPython.
+
+
+class RingBuffer:
+    """
+    Circular byte buffer, allocated once at construction.
+
+    - ``readinto_from(uart)`` moves bytes from the UART into the buffer
+      through a small preallocated chunk, without allocating
+    - ``peek()`` / ``pop()`` / ``pop_many()`` / ``drop()`` consume data
+      without allocating per byte
+    - When full, ``on_full(ring)`` is called to make room. stow_kbd sets
+      it to a stow_proto.Compactor, which squeezes repeats and whole
+      taps out and notes the breaks it loses, so no key stays down
+    - Only if there is no ``on_full``, or it frees nothing, is the
+      oldest half dropped (counted in ``dropped``)
+    - ``on_read(chunk, n)``, if set, sees every chunk read from the UART
+    """
+    def __init__(self, size, chunk=16):
+        self._data = bytearray(size)
+        self._mv = memoryview(self._data)
+        # UART reads go through views of every length of one chunk,
+        # made once: slicing a memoryview per read would allocate
+        self._chunk = bytearray(chunk)
+        mv = memoryview(self._chunk)
+        self._views = [mv[:n] for n in range(chunk + 1)]
+        self._size = size
+        self._head = 0   # Index of oldest byte
+        self._count = 0  # Number of bytes stored
+        self.dropped = 0 # Bytes lost to overflow
+        self.on_full = None
+        self.on_read = None
+
+    def __len__(self):
+        return self._count
+
+    def capacity(self):
+        return self._size
+
+    def free(self):
+        return self._size - self._count
+
+    def clear(self):
+        self._head = 0
+        self._count = 0
+
+    def peek(self, offset=0):
+        """Return the byte at `offset` from the oldest, or -1 if not available."""
+        if offset >= self._count:
+            return -1
+        return self._data[(self._head + offset) % self._size]
+
+    def pop(self):
+        """Remove and return the oldest byte, or -1 if empty."""
+        if not self._count:
+            return -1
+        b = self._data[self._head]
+        self._head = (self._head + 1) % self._size
+        self._count -= 1
+        return b
+
+    def pop_many(self, dest, n=None):
+        """
+        Copy up to `n` (default: len(dest)) of the oldest bytes into the
+        caller-supplied buffer `dest` and remove them. Return the count.
+        """
+        if n is None or n > len(dest):
+            n = len(dest)
+        if n > self._count:
+            n = self._count
+        # Copy in at most two contiguous runs
+        first = min(n, self._size - self._head)
+        dest[0:first] = self._mv[self._head:self._head + first]
+        if n > first:
+            dest[first:n] = self._mv[0:n - first]
+        self._head = (self._head + n) % self._size
+        self._count -= n
+        return n
+
+    def drop(self, n):
+        """Discard up to `n` of the oldest bytes. Return the count dropped."""
+        if n > self._count:
+            n = self._count
+        self._head = (self._head + n) % self._size
+        self._count -= n
+        return n
+
+    def put(self, b):
+        """Append one byte, making room first if full (see _overflow())."""
+        if self._count == self._size:
+            self._overflow()
+        self._data[(self._head + self._count) % self._size] = b
+        self._count += 1
+
+    def readinto_from(self, uart):
+        """
+        Read everything waiting on `uart` into the buffer: readinto()
+        into the preallocated chunk (16 bytes by default, never more
+        than is waiting, so it doesn't wait for the UART timeout), show
+        it to on_read, then put() each byte, so a full buffer is handled
+        byte by byte. Return the number of bytes received.
+        """
+        total = 0
+        chunk = self._chunk
+        n = uart.in_waiting
+        while n:
+            k = n if n < len(chunk) else len(chunk)
+            got = uart.readinto(self._views[k]) or 0
+            if not got:
+                break
+            if self.on_read:
+                self.on_read(chunk, got)
+            for i in range(got):
+                self.put(chunk[i])
+            total += got
+            n -= got
+        return total
+
+    def _overflow(self):
+        if self.on_full and self.on_full(self) and self._count < self._size:
+            return
+        # No on_full, or it freed nothing: drop the oldest half
+        self.dropped += self.drop(self._size // 2)
@@ -0,0 +1,192 @@
+# CircuitPython: asyncio helpers for the Stowaway keyboard pipeline
+# Only needs `asyncio` and stow_stats - runs unchanged on CPython.
+
+import array
+import asyncio
+import time
+
+import stow_stats
+from stow_stats import ticks_ms, ticks_diff
+
+
+class EventQueue:
+    """
+    Bounded FIFO of decoder event ints (see stow_proto), awaitable
+    from both ends. Storage is a preallocated array; 0 means "empty".
+
+    CircuitPython's asyncio has no Queue, so this is the link between
+    the UART task and the HID task. When it is full, the producer
+    waits and bytes stay in the RX ring buffer.
+    """
+    def __init__(self, size=32):
+        self._q = array.array("H", [0] * size)
+        self._size = size
+        self._head = 0
+        self._count = 0
+        self._not_empty = asyncio.Event()
+        self._not_full = asyncio.Event()
+        self._not_full.set()
+
+    def __len__(self):
+        return self._count
+
+    def full(self):
+        return self._count == self._size
+
+    def put_nowait(self, ev):
+        """Append `ev`. Return False if the queue is full."""
+        if self._count == self._size:
+            return False
+        self._q[(self._head + self._count) % self._size] = ev
+        self._count += 1
+        self._not_empty.set()
+        return True
+
+    def clear(self):
+        """Drop every queued event (the keyboard was powered down)."""
+        self._head = 0
+        self._count = 0
+        self._not_full.set()
+
+    def get_nowait(self):
+        """Remove and return the oldest event, or 0 if empty."""
+        if not self._count:
+            return 0
+        ev = self._q[self._head]
+        self._head = (self._head + 1) % self._size
+        self._count -= 1
+        self._not_full.set()
+        return ev
+
+    async def put(self, ev):
+        while self._count == self._size:
+            self._not_full.clear()
+            await self._not_full.wait()
+        self.put_nowait(ev)
+
+    async def get(self):
+        while not self._count:
+            self._not_empty.clear()
+            await self._not_empty.wait()
+        return self.get_nowait()
+
+
+async def connect(kbd, backoff_ms=50, max_backoff_ms=2000, retries=0):
+    """
+    Power up `kbd` until the ready handshake is seen, doubling the pause
+    between attempts up to `max_backoff_ms`. `retries=0` means forever.
+    Return True when the keyboard is ready.
+    """
+    delay = backoff_ms
+    attempt = 0
+    while not await kbd.power_cycle_async():
+        attempt += 1
+        kbd.retries += 1
+        if retries and attempt >= retries:
+            return False
+        print("Keys retry in {}ms".format(delay))
+        await asyncio.sleep(delay / 1000)
+        delay = min(delay * 2, max_backoff_ms)
+    return True
+
+
+async def watchdog_task(kbd, idle_timeout_s=0, max_errors=8, check_ms=500,
+                        backoff_ms=50, max_backoff_ms=2000):
+    """
+    Re-power the keyboard when it has been silent for `idle_timeout_s`
+    (0: never), or when `max_errors` protocol errors (stray handshake
+    bytes, unknown scancodes) arrive within one `check_ms` window.
+    Silence counts from the last key or re-power, whichever is later:
+    the handshake is not a key (see KeyboardReader._poll_handshake).
+    """
+    errors = kbd.protocol_errors()
+    powered = time.monotonic()
+    while True:
+        await asyncio.sleep(check_ms / 1000)
+        reason = None
+        now_errors = kbd.protocol_errors()
+        if not kbd.ready:
+            reason = "lost"
+        elif max_errors and now_errors - errors >= max_errors:
+            reason = "errors"
+        elif idle_timeout_s and time.monotonic() - max(kbd.last_rx, powered) > idle_timeout_s:
+            reason = "idle"
+        errors = now_errors
+        if reason:
+            print("Keys {}: re-power".format(reason))
+            await connect(kbd, backoff_ms, max_backoff_ms)
+            errors = kbd.protocol_errors()
+            powered = time.monotonic()
+
+
+async def rx_task(kbd, queue, poll_ms=1, max_poll_ms=0, active_ms=500):
+    """
+    Wait for UART bytes, decode them and queue the events.
+
+    `poll_ms` is the latency/CPU trade-off: how long to sleep while the
+    UART is silent. 0 only yields to the other tasks (lowest latency,
+    highest CPU load). Once no byte has come for `active_ms`, the sleep
+    doubles with every empty check, up to `max_poll_ms` (0: no backoff);
+    the UART buffers what arrives meanwhile. The first bytes after such
+    a pause set kbd.wake_ms, so flush() can time the first key.
+    A key-up held back by the chatter filter goes out once its window
+    is over, checked at the same pace, and so does an event that was
+    left behind it when the queue filled up.
+
+    While the queue is full (USB is behind), the UART is still drained
+    into the RX ring buffer, so its overflow policy decides what to keep
+    instead of the UART's hardware FIFO.
+
+    Waits inline rather than in a helper coroutine: every coroutine
+    call allocates a generator.
+    """
+    poll_s = poll_ms / 1000
+    max_s = max_poll_ms / 1000
+    delay = poll_s
+    checked = ticks_ms()  # Last time the UART was found empty
+    while True:
+        last_rx = kbd.rx_ms
+        if not kbd.any():
+            checked = ticks_ms()
+            await asyncio.sleep(delay)
+            stow_stats.polls += 1
+            if kbd.chatter and kbd.chatter.pending():
+                # A key-up the chatter filter held back may be due, or
+                # the event behind it didn't fit into the queue
+                while not queue.full():
+                    ev = kbd.read_event()
+                    if not ev:
+                        break
+                    queue.put_nowait(ev)
+            if delay < max_s and ticks_diff(checked, last_rx) > active_ms:
+                delay = delay * 2 if delay else 0.001
+                if delay > max_s:
+                    delay = max_s
+            continue
+        if ticks_diff(checked, last_rx) > active_ms:
+            kbd.wake_ms = checked  # The bytes came after this check
+        delay = poll_s
+        while not queue.full():
+            ev = kbd.read_event()
+            if not ev:
+                break
+            queue.put_nowait(ev)
+        if queue.full():
+            await asyncio.sleep(poll_s)
+
+
+async def hid_task(kbd, queue, on_key=None, on_flush=None):
+    """
+    Send queued events to USB. Everything that is queued when the task
+    wakes up goes out as one batched report, then on_flush() is called.
+    """
+    while True:
+        ev = await queue.get()
+        while ev:
+            keycode = kbd.dispatch(ev)
+            if on_key and keycode:
+                on_key(kbd.scancode, keycode)
+            ev = queue.get_nowait()
+        kbd.flush()
+        if on_flush:
+            on_flush()
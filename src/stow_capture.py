@@ -0,0 +1,248 @@
+# CircuitPython: Record raw UART data for replay on the computer
+# No hardware imports - sim/replay.py and tools/capture_reader.py read its files.
+"""
+A capture is what the keyboard sent, as the UART delivered it, so a
+field problem (stuck key, missed handshake, lost burst) can be replayed
+through the same decoder at the desk with sim/replay.py.
+
+File format, little-endian, append-only:
+
+    0       b"STCP"
+    4       format version (1)
+    5       3 bytes 0
+    8       records, each:
+              n    uint8   number of data bytes (0: marker)
+              dt   uint16  ms since the previous record (session start
+                           for the first one)
+              n data bytes as read from the UART, or 1 marker byte (MARK_*)
+
+A file that already has data gets MARK_SESSION instead of a new header,
+so captures from several boots can be appended to one file. Gaps longer
+than 65535 ms are written as MARK_GAP records.
+
+On usb_cdc.data the header goes out with the first write that finds a
+computer listening, and again after every disconnect, so
+tools/capture_reader.py can always find the start of a stream.
+
+The Recorder fills a buffer allocated once; capture_task writes it out
+while no keys are arriving. If the buffer is full, records are dropped
+(counted in `lost`, MARK_LOST in the file) - the key path never waits.
+"""
+
+import asyncio
+import os
+
+from stow_stats import ticks_ms, ticks_diff
+
+MAGIC = b"STCP"
+VERSION = 1
+HEADER_SIZE = 8
+HEADER = MAGIC + bytes((VERSION, 0, 0, 0))
+RECORD_HEADER = 3  # n, dt
+
+MARK_SESSION = 0    # A new session starts (appended to an existing file)
+MARK_POWER_OFF = 1  # Keyboard powered down; key state forgotten
+MARK_POWER_ON = 2   # Keyboard powered up, waiting for the handshake
+MARK_READY = 3      # Handshake seen
+MARK_LOST = 4       # Records were dropped here (buffer full)
+MARK_GAP = 5        # Nothing happened, only time passed
+
+MARK_NAMES = ("session", "power off", "power on", "ready", "lost", "gap")
+
+
+class Recorder:
+    """
+    Buffers capture records for `sink` (anything with write(), e.g. a
+    file or usb_cdc.data). Pass new=False when appending to a file that
+    already has a header.
+    """
+    def __init__(self, sink, size=1024, new=True):
+        self.sink = sink
+        self._buf = bytearray(size)
+        self._mv = memoryview(self._buf)
+        self._n = 0
+        self._last = ticks_ms()
+        self._lost = False
+        self.lost = 0      # Records dropped because the buffer was full
+        self.written = 0   # Bytes handed to the sink
+        self._header = new  # HEADER still to be written
+        if not new:
+            self.mark(MARK_SESSION)
+
+    def pending(self):
+        """Bytes waiting to be written."""
+        return self._n
+
+    def capacity(self):
+        return len(self._buf)
+
+    def _start(self, n):
+        """Write a record header for `n` data bytes. Return False if it doesn't fit."""
+        now = ticks_ms()
+        dt = ticks_diff(now, self._last)
+        while dt > 0xFFFF:
+            if not self._put_marker(0xFFFF, MARK_GAP):
+                return False
+            dt -= 0xFFFF
+        if self._lost:
+            if not self._put_marker(dt, MARK_LOST):
+                return False
+            self._lost = False
+            dt = 0
+        size = RECORD_HEADER + (n if n else 1)
+        if self._n + size > len(self._buf):
+            self.lost += 1
+            self._lost = True
+            return False
+        p = self._n
+        self._buf[p] = n
+        self._buf[p + 1] = dt & 0xFF
+        self._buf[p + 2] = dt >> 8
+        self._n = p + RECORD_HEADER
+        self._last = now
+        return True
+
+    def _put_marker(self, dt, marker):
+        p = self._n
+        if p + RECORD_HEADER + 1 > len(self._buf):
+            self.lost += 1
+            self._lost = True
+            return False
+        self._buf[p] = 0
+        self._buf[p + 1] = dt & 0xFF
+        self._buf[p + 2] = dt >> 8
+        self._buf[p + 3] = marker
+        self._n = p + RECORD_HEADER + 1
+        self._last = ticks_ms()
+        return True
+
+    def chunk(self, data, n):
+        """Record the first `n` bytes of `data`, just read from the UART."""
+        i = 0
+        while n > 0:
+            k = n if n < 255 else 255
+            if not self._start(k):
+                return
+            p = self._n
+            buf = self._buf
+            for j in range(k):
+                buf[p + j] = data[i + j]
+            self._n = p + k
+            i += k
+            n -= k
+
+    def mark(self, code):
+        """Record marker `code` (MARK_*)."""
+        if self._start(0):
+            self._buf[self._n] = code
+            self._n += 1
+
+    def flush(self):
+        """Write out what is buffered. Return the number of bytes."""
+        n = self._n
+        if not n:
+            return 0
+        if getattr(self.sink, "connected", True):
+            if self._header:
+                self.sink.write(HEADER)
+                self.written += HEADER_SIZE
+                self._header = False
+            self.sink.write(self._mv[:n])
+            if hasattr(self.sink, "flush"):
+                self.sink.flush()
+            self.written += n
+        else:
+            self.lost += 1  # Nobody listening on the serial port
+            self._lost = True
+            self._header = True  # The next listener starts a new stream
+        self._n = 0
+        return n
+
+    def close(self):
+        self.flush()
+        if hasattr(self.sink, "close"):
+            self.sink.close()
+
+
+def serial_port():
+    """usb_cdc.data, or None if it isn't enabled (see boot.py)."""
+    try:
+        import usb_cdc
+    except ImportError:
+        return None
+    return usb_cdc.data
+
+
+def open_recorder(path, size=1024):
+    """
+    Return a Recorder appending to `path`, or streaming to usb_cdc.data
+    if the filesystem is read-only (the default while CIRCUITPY is
+    mounted on the computer; see boot.py), or None if neither works.
+    """
+    try:
+        try:
+            new = os.stat(path)[6] == 0
+        except OSError:
+            new = True
+        f = open(path, "ab")
+        print("Capture: {}".format(path))
+        return Recorder(f, size, new)
+    except OSError:
+        pass
+    port = serial_port()
+    if port is None:
+        print("Capture: no writable file or usb_cdc.data")
+        return None
+    print("Capture: usb_cdc.data")
+    return Recorder(port, size)
+
+
+async def capture_task(rec, busy=None, check_ms=200):
+    """
+    Write the buffer out every `check_ms` while `busy()` is False, or
+    when it is more than half full - flash writes can take a while.
+    """
+    while True:
+        await asyncio.sleep(check_ms / 1000)
+        if not rec.pending():
+            continue
+        if busy and busy() and rec.pending() < rec.capacity() // 2:
+            continue
+        try:
+            rec.flush()
+        except OSError as e:
+            print("Capture: {}".format(e))  # Filesystem full, port gone...
+
+
+def records(data, offset=HEADER_SIZE):
+    """
+    Iterate over a capture image (bytes, memoryview, mmap) from
+    `offset`, yielding (ms since start, data, marker): `data` is a
+    memoryview of the UART bytes and marker -1, or data is None for a
+    marker record. Time runs on across sessions; a truncated last
+    record ends the iteration.
+    """
+    mv = memoryview(data)
+    end = len(mv)
+    t = 0
+    p = offset
+    while p + RECORD_HEADER < end:
+        n = mv[p]
+        t += mv[p + 1] | mv[p + 2] << 8
+        p += RECORD_HEADER
+        if n:
+            if p + n > end:
+                return
+            yield t, mv[p:p + n], -1
+            p += n
+        else:
+            yield t, None, mv[p]
+            p += 1
+
+
+def check_header(data):
+    """Raise ValueError unless `data` starts with a capture header."""
+    if bytes(data[0:4]) != MAGIC or len(data) < HEADER_SIZE:
+        raise ValueError("Not a capture")
+    if data[4] != VERSION:
+        raise ValueError("Capture version {} not supported".format(data[4]))
@@ -0,0 +1,124 @@
+# CircuitPython: Chatter and ghost-key filter for worn Stowaway membranes
+# No hardware imports - sim/streamcheck.py plays bouncing keys through it.
+"""
+Sits between the decoder and dispatch (KeyboardReader.read_event) and
+drops what a worn membrane adds to the stream before it costs a HID
+report, a log record or a display update:
+
+- ghosts: codes the layout doesn't map (DISPATCH ignores them) - the
+  "Unknown: 0x.." codes
+- bounces: a break followed by a make of the same key within
+  `window_ms`; both go, the host never sees the key up. To see the
+  pair, a break is held back until the window is over or any other
+  event arrives, which then goes out after it - the order stays as
+  the keyboard sent it, and only key-ups ever wait, never presses. A
+  make within the window after the key's last break (with other keys
+  in between) goes as well.
+- strays: a break of a key that isn't down, left over from a dropped make
+
+Per key it keeps one bit (down) and the ticks_ms of its last key-up,
+in arrays allocated once; nothing on the key path allocates.
+"""
+
+import array
+
+from stow_proto import EV_DOWN, EV_UP, ev_raw
+from stow_stats import ticks_diff
+
+
+class ChatterFilter:
+    """
+    Filter for decoded events (see stow_proto). `dispatch` is the
+    256-entry table of stow_kbd: an entry with action 0 is a code the
+    layout doesn't map.
+    """
+    def __init__(self, dispatch, window_ms=8):
+        self._dispatch = dispatch
+        self.window_ms = window_ms
+        self._down = bytearray(16)                # One bit per scancode
+        self._last = array.array("L", [0] * 128)  # ticks_ms of the last key-up
+        self.held = 0       # Break event held back, 0: none
+        self._held_ms = 0
+        self._next = 0      # Event that arrived behind the held break
+        self.ghosts = 0     # Codes the layout doesn't map
+        self.bounces = 0    # Transitions dropped inside the window
+        self.strays = 0     # Breaks of keys that weren't down
+
+    def reset(self):
+        """Forget which keys are down (power off, all keys up, handshake)."""
+        for i in range(16):
+            self._down[i] = 0
+        self.held = 0
+        self._next = 0
+
+    def pending(self):
+        """True while an event waits for pop(): a held break or the one behind it."""
+        return self.held != 0 or self._next != 0
+
+    def pop(self, now):
+        """
+        Return what is due without a new event: the event queued behind
+        a released break, or the held break once its window is over
+        at ticks_ms `now`. 0: nothing.
+        """
+        ev = self._next
+        if ev:
+            self._next = 0
+            return ev
+        if self.held and ticks_diff(now, self._held_ms) >= self.window_ms:
+            return self._release()
+        return 0
+
+    def feed(self, ev, now):
+        """
+        Filter event `ev`, decoded at ticks_ms `now`. Return the event
+        to dispatch now, or 0 (dropped or held back - see pop()).
+        """
+        kind = ev >> 8
+        if kind != EV_DOWN and kind != EV_UP:
+            # All keys up or handshake: the host's keys go up anyway
+            self.reset()
+            return ev
+        if not self._dispatch[ev_raw(ev)] >> 16:
+            self.ghosts += 1
+            return 0
+        held = self.held
+        if not held:
+            return self._accept(ev, now)
+        if (kind == EV_DOWN and ev & 0x7F == held & 0x7F
+                and ticks_diff(now, self._held_ms) < self.window_ms):
+            self.held = 0  # The key never went up
+            self.bounces += 1
+            return 0
+        # Another key: the held break first, this one behind it
+        out = self._release()
+        self._next = self._accept(ev, now)
+        return out
+
+    def _release(self):
+        ev = self.held
+        sc = ev & 0x7F
+        self._down[sc >> 3] &= ~(1 << (sc & 7))
+        self._last[sc] = self._held_ms
+        self.held = 0
+        return ev
+
+    def _accept(self, ev, now):
+        sc = ev & 0x7F
+        i = sc >> 3
+        m = 1 << (sc & 7)
+        if ev >> 8 == EV_DOWN:
+            if self._down[i] & m:
+                return ev  # Auto-repeat: dispatch counts it
+            last = self._last[sc]
+            if last and ticks_diff(now, last) < self.window_ms:
+                self.bounces += 1  # Back down right after its break
+                return 0
+            self._down[i] |= m
+            return ev
+        if not self._down[i] & m:
+            self.strays += 1
+            return 0
+        self.held = ev
+        self._held_ms = now
+        return 0
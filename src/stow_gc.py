@@ -0,0 +1,80 @@
+# CircuitPython: Garbage collection at idle points
+# Runs unchanged on CPython (without gc.mem_free(), busy collections aren't seen).
+"""
+The key path doesn't allocate (check with stow_memcheck), but display,
+logging and stats do, so the heap still fills up - and the VM collects
+whenever an allocation doesn't fit, maybe in the middle of a keystroke.
+
+gc_task collects while the keyboard is idle instead. check() is called
+after each HID report: if the free heap grew without us collecting,
+the VM collected by itself while keys were coming in; that is counted
+in stow_stats.gc_busy and logged.
+"""
+
+import asyncio
+import gc
+
+import stow_stats
+from stow_stats import ticks_ms, ticks_diff
+from stow_log import log, DEBUG, WARNING, MSG_GC_IDLE, MSG_GC_BUSY
+
+_mem_free = getattr(gc, "mem_free", None)
+
+GROWTH = 512  # Free heap growth that counts as a collection, in bytes
+
+_last_free = 0
+_last_check = 0
+
+
+def mem_free():
+    """Free heap in bytes, or 0 where the VM can't tell."""
+    return _mem_free() if _mem_free else 0
+
+
+def collect():
+    """Run a full collection now. Return how long it took in ms."""
+    global _last_free
+    t0 = ticks_ms()
+    gc.collect()
+    ms = ticks_diff(ticks_ms(), t0)
+    _last_free = mem_free()
+    stow_stats.gc_idle += 1
+    if log.level <= DEBUG:
+        log.event(DEBUG, MSG_GC_IDLE, ms, _last_free)
+    return ms
+
+
+def check(active_ms=500):
+    """
+    Call after sending a report. Counts a collection the VM ran since
+    the previous check, if that was less than `active_ms` ago (typing).
+    """
+    global _last_free, _last_check
+    if not _mem_free:
+        return
+    free = _mem_free()
+    now = ticks_ms()
+    if free > _last_free + GROWTH and ticks_diff(now, _last_check) < active_ms:
+        stow_stats.gc_busy += 1
+        log.event(WARNING, MSG_GC_BUSY, free - _last_free)
+    _last_free = free
+    _last_check = now
+
+
+async def gc_task(kbd, idle_ms=300, max_interval_s=10, check_ms=100):
+    """
+    Collect once the keyboard has been quiet for `idle_ms` after
+    activity, and at least every `max_interval_s` while idle.
+    """
+    seen_rx = kbd.bytes_rx
+    last = ticks_ms()
+    while True:
+        await asyncio.sleep(check_ms / 1000)
+        now = ticks_ms()
+        if kbd.bytes_rx != seen_rx and ticks_diff(now, kbd.rx_ms) < idle_ms:
+            continue  # Typing
+        if kbd.bytes_rx == seen_rx and ticks_diff(now, last) < max_interval_s * 1000:
+            continue  # Nothing new to clean up
+        seen_rx = kbd.bytes_rx
+        collect()
+        last = ticks_ms()
@@ -0,0 +1,123 @@
+# CircuitPython: HID report helpers for the Stowaway keyboard
+# No hardware imports - works on any adafruit_hid Keyboard-like object.
+
+ALL_SOURCES = 0xFF
+
+
+class ReportBatcher:
+    """
+    Collects key presses/releases and sends them as one HID report
+    per `flush()` instead of one report per key.
+
+    Has the same press()/release()/release_all() interface as
+    adafruit_hid's Keyboard, so the dispatch code can use either.
+    press_key()/release_key() take a single keycode and, unlike the
+    *keycodes versions, don't allocate an argument tuple.
+
+    A key that is pressed and released (or released and pressed again)
+    within the same batch is not collapsed: the report is flushed in
+    between, so the host still sees the keystroke.
+
+    Several keyboards can share one batcher: each passes its own
+    `source` bit, and a keycode stays down until every source that
+    pressed it has released it. Releasing a key another source holds,
+    or release_all(source), leaves that source's keys alone.
+
+    State is one byte of source bits per keycode and a 256-bit bitmap,
+    so nothing is allocated after construction. A `kbd` with its own
+    send_report() (stow_nkro.NkroKeyboard) sends the reports itself.
+    """
+    def __init__(self, kbd):
+        self.kbd = kbd
+        self._send = getattr(kbd, "send_report", None)
+        self.held = bytearray(256)     # Per keycode: sources holding it down
+        self._changed = bytearray(32)  # Keycodes changed since the last report
+        self._nchanged = 0
+        self._npressed = 0             # Keycodes down on the host
+        self._sources = 0              # Every source that pressed a key so far
+        self.reports = 0               # Number of reports sent
+
+    def is_pressed(self, k):
+        return self.held[k] != 0
+
+    def press(self, *keycodes):
+        for k in keycodes:
+            self.press_key(k)
+
+    def release(self, *keycodes):
+        for k in keycodes:
+            self.release_key(k)
+
+    def press_key(self, k, source=1):
+        held = self.held[k]
+        self._sources |= source
+        if held:
+            self.held[k] = held | source  # Already down on the host
+            return
+        i = k >> 3
+        m = 1 << (k & 7)
+        if self._changed[i] & m:
+            self.flush()  # Released earlier in this batch - keep the tap
+        # Same report edit Keyboard.press() does, minus the send
+        self.kbd._add_keycode_to_report(k)
+        self.held[k] = source
+        self._npressed += 1
+        self._changed[i] |= m
+        self._nchanged += 1
+
+    def release_key(self, k, source=1):
+        held = self.held[k]
+        if not held & source:
+            return
+        held &= ~source
+        self.held[k] = held
+        if held:
+            return  # Another source still holds it
+        i = k >> 3
+        m = 1 << (k & 7)
+        if self._changed[i] & m:
+            self.flush()  # Pressed earlier in this batch - keep the tap
+        self.kbd._remove_keycode_from_report(k)
+        self._npressed -= 1
+        self._changed[i] |= m
+        self._nchanged += 1
+
+    def release_all(self, source=ALL_SOURCES):
+        """Release the keys of `source` (default: everything) and send the report."""
+        self.flush()
+        if self._sources & ~source and self._npressed:
+            # Other keyboards may hold keys: release only ours
+            for k in range(256):
+                if self.held[k] & source:
+                    self.release_key(k, source)
+            self.flush()
+            return
+        if not self._npressed and self._report_empty():
+            return  # Host already has an empty report
+        self.kbd.release_all()
+        if self._npressed:
+            for k in range(256):
+                self.held[k] = 0
+            self._npressed = 0
+        self.reports += 1
+
+    def _report_empty(self):
+        report = self.kbd.report
+        for i in range(len(report)):
+            if report[i]:
+                return False
+        return True
+
+    def flush(self):
+        """Send the report if anything changed since the last one."""
+        if not self._nchanged:
+            return False
+        for i in range(32):
+            self._changed[i] = 0
+        self._nchanged = 0
+        if self._send:
+            self._send()
+        else:
+            self.kbd._keyboard_device.send_report(self.kbd.report)
+        self.reports += 1
+        return True
@@ -2,94 +2,106 @@
 # Hardware targets: e.g. RP2040 (Pico) + UART keyboard module
 
 import time
-import board
-import busio
-import digitalio
-import usb_hid
-from adafruit_hid.keyboard import Keyboard
+import array
+import asyncio
+try:
+    from micropython import const
+except ImportError:
+    def const(x):
+        return x
+try:
+    import busio
+    import digitalio
+    import usb_hid
+    from adafruit_hid.keyboard import Keyboard
+except ImportError:
+    # CPython (tools/stow_bridge.py): pass uart, power and hid in
+    busio = digitalio = usb_hid = Keyboard = None
+from ringbuf import RingBuffer
+from stow_proto import (ScancodeDecoder, Compactor, EV_DOWN, EV_UP, EV_ALL_UP,
+                        EV_HANDSHAKE, EV_RESYNC, ev_raw)
+from stow_hid import ReportBatcher
+from stow_nkro import NkroKeyboard
+from stow_keys import KeyState
+from stow_capture import MARK_POWER_OFF, MARK_POWER_ON, MARK_READY
+from stow_async import connect, EventQueue, rx_task, hid_task, watchdog_task
+from stow_macro import MacroPlayer, macro_task
+from stow_filter import ChatterFilter
+from stow_log import (log, DEBUG, INFO, MSG_SCANCODE, MSG_FN_DOWN, MSG_FN_UP,
+                      MSG_UNKNOWN, MSG_FN_MAP, MSG_PRESS, MSG_RELEASE,
+                      MSG_ALL_UP, MSG_HANDSHAKE, MSG_FIRST_REPORT, MSG_WAKE)
+import stow_keymap
+import stow_stats
+from stow_stats import ticks_ms, ticks_diff
+
+# Build switch for the DEBUG records on the key path (see stow_log).
+# Set it to 0 for a release build: MicroPython then compiles them out,
+# while log_level only skips them at run time. It folds a const only in
+# the module that defines it, so this can't come from stow_log.
+_LOG_DEBUG = const(1)
 
 # -------------------------
-# Keymap constant
+# Keymap
 # -------------------------
-# Taken from the Stowaway documentation:
-STOWAWAY_KEYMAP_US = [
-    "1", "2", "3", "Z", "4", "5", "6", "7", # Y0
-    "CMMD", "Q", "W", "E", "R", "T", "Y", "~", # Y1
-    "X", "A", "S", "D", "F", "G", "H", "Space1", # Y2
-    "CapsLock", "Tab", "Ctrl", None, None, None, None, None, # Y3
-    None, None, "FN", "Alt", None, None, None, None, # Y4
-    None, None, None, None, "C", "V", "B", "N", # Y5
-    "-", "+", "Backspace", "Special1", "8", "9", "0", "Space2", # Y6
-    "[", "]", "\\", "Special2", "U", "I", "O", "P", # Y7 - watch for escaped character \ here
-    "'", "Enter", "Special3", None, "J", "K", "L",  ";", #Y8
-    "/", "Up", "Special4", None, "M", ",", ".", "Done", # Y9
-    "DEL", "Left", "Down", "Right", None, None, None, None, # 10
-    "ShiftL", "ShiftR", None, None, None, None, None, None, # Y11
-]
-
-# Ve Germans want ze proper keyboard umlauts!
-STOWAWAY_KEYMAP_DE = [
-    "1", "2", "3", "Y", "4", "5", "6", "7", # Y0
-    "Cmd", "Q", "W", "E", "R", "T", "Z", "<", # Y1
-    "X", "A", "S", "d", "F", "G", "H", "Leer1", # Y2
-    "CapsLock", "Tab", "Strg", "??", "??", "??", "??", "??", # Y3
-    "??", "??", "Fn", "Alt", "??", "??", "??", "??", # Y4
-    "??", "??", "??", "??", "C", "V", "B", "N", # Y5
-    "Sz", "'", "Backspace", "KALEND", "8", "9", "0", "^", # Y6
-    "Ue", "+", "#", "ADRESS", "U", "I", "O", "P", # Y7 - watch for escaped character \ here
-    "Ae", "Eingabe", "AUFGAB", "??", "J", "K", "L",  "Oe", #Y8
-    "-", "Up", "MEMO", "??", "M", ",", ".", "Fertig", # Y9
-    "DEL", "Left", "Down", "Right", "??", "??", "??", "??", # 10
-    "ShiftL", "ShiftR", "??", "??", "??", "??", "??", "??", # Y11
-]
-
-# STOWAWAY_KEYMAP = STOWAWAY_KEYMAP_US
-STOWAWAY_KEYMAP = STOWAWAY_KEYMAP_DE # Comment this out for US keyboard
-
-""" Keymap for sending USB keystrokes via adafruit_hid library.
-
-    As the original keymap assumes an US-English keyboard, 
-so does the USB driver. As a result, 
-switching to another keyboard layout does not matter: 
-You get what it says on the key. 
-
-A couple of specials: 
-- There is no ESC key on the Stowaway - use DONE key
-- The SpaceRight is ^° on a German keyboard, the key left to
-    the 1 key on a Mac keyboard (which is ´~ on a US Mac, so use
-    GRAVE_ACCENT key
-- The ACTUAL ´~ key is the Non-US \| (which translates to <> on the 
-    German version of the Stowaway - it has code 104)
-- There is no dedicated Fn key on USB keyboards; translate into 
-    RIGHT_ALT, catch in the code, and translate. 
-- The Stowaway's SPECIAL keys for calling dedicated applications
-    are translated into F13-F16. 
-"""
-
-from adafruit_hid.keycode import Keycode as K
-
-
-ADAFRUIT_KEYMAP = [
-    K.ONE, K.TWO, K.THREE, K.Z, K.FOUR, K.FIVE, K.SIX, K.SEVEN, # Y0
-    K.COMMAND, K.Q, K.W, K.E, K.R, K.T, K.Y, K.GRAVE_ACCENT, # Y1
-    # 100 (0x64) is the USB keycode for Non-US \| 
-    K.X, K.A, K.S, K.D, K.F, K.G, K.H, K.SPACEBAR, # Y2
-    K.CAPS_LOCK, K.TAB, K.CONTROL, None, None, None, None, None, # Y3
-    None, None, K.RIGHT_ALT, K.LEFT_ALT, None, None, None, None, # Y4 - Function Key!!!
-    # Right-Alt is actually the Fn key on the Stowaway; catch in code. 
-    None, None, None, None, K.C, K.V, K.B, K.N, # Y5
-    K.MINUS, K.EQUALS, K.BACKSPACE, K.F13, K.EIGHT, K.NINE, K.ZERO, 100, # Y6
-    K.LEFT_BRACKET, K.RIGHT_BRACKET, K.BACKSLASH, K.F14, K.U, K.I, K.O, K.P, # Y7 - watch for escaped character \ here
-    K.QUOTE, K.ENTER, K.F15, None, K.J, K.K, K.L,  K.SEMICOLON, #Y8
-    K.FORWARD_SLASH, K.UP_ARROW, K.F16, None, K.M, K.COMMA, K.PERIOD, K.ESCAPE, # Y9 - ESC is DONE key
-    K.DELETE, K.LEFT_ARROW, K.DOWN_ARROW, K.RIGHT_ARROW, None, None, None, None, # 10
-    K.LEFT_SHIFT, K.RIGHT_SHIFT, None, None, None, None, None, None, # Y11
-]
-
-FUNCTION_KEYS = [
-    K.ONE, K.TWO, K.THREE, K.Z, K.FOUR, K.FIVE, K.SIX, K.SEVEN,
-    K.EIGHT, K.NINE, K.ZERO, K.MINUS, K.EQUALS
-]
+# Layouts live in layouts/*.txt (base keycodes, Fn layer, key labels)
+# and are compiled by tools/keymap_compiler.py into keymaps/<name>.bin
+# (see stow_keymap). Only the labels differ between US and DE: the
+# host picks the characters, so you get what it says on the key.
+DEFAULT_LAYOUT = "de"
+
+# -------------------------
+# Dispatch table
+# -------------------------
+# One entry per raw byte (bit 7 = key up), rebuilt by use_layout():
+#   bits 16..23  action (ACT_*)
+#   bits  8..15  keycode to use while Fn is held
+#   bits  0..7   keycode
+ACT_IGNORE = 0
+ACT_PRESS = 1
+ACT_RELEASE = 2
+ACT_FN_DOWN = 3
+ACT_FN_UP = 4
+
+DISPATCH = array.array("L", [0] * 256)
+SC_FN = stow_keymap.NO_FN  # Scancode of the Fn key
+keymap = None              # stow_keymap.Keymap in use
+
+# Macros, also rebuilt by use_layout(): per trigger (scancode, | 0x80 for
+# the Fn layer) 1 + the offset of its record in keymap.macros, 0: none
+MACRO = array.array("H", [0] * 256)
+
+def use_layout(name):
+    """
+    Load layout `name` and rebuild DISPATCH in place, so it can be
+    switched at run time. Return the Keymap.
+    """
+    global keymap, SC_FN
+    km = stow_keymap.load(name)
+    for i in range(256):
+        DISPATCH[i] = 0
+        MACRO[i] = 0
+    for scancode in range(km.nkeys):
+        if scancode == km.fn_scancode:
+            # Fn key: toggles the layer, never sent to USB
+            DISPATCH[scancode] = ACT_FN_DOWN << 16
+            DISPATCH[scancode | 0x80] = ACT_FN_UP << 16
+            continue
+        keycode = km.base[scancode]
+        if not keycode:
+            continue
+        entry = (km.fn[scancode] << 8) | keycode
+        DISPATCH[scancode] = (ACT_PRESS << 16) | entry
+        DISPATCH[scancode | 0x80] = (ACT_RELEASE << 16) | entry
+    for off in km.macro_offsets():
+        MACRO[km.macros[off]] = off + 1
+    keymap = km
+    SC_FN = km.fn_scancode
+    print("Layout: {}".format(name))
+    return km
+
+def get_keymap():
+    """Return the Keymap in use, loading DEFAULT_LAYOUT on first use."""
+    return keymap or use_layout(DEFAULT_LAYOUT)
 
 
 # --------------------------
@@ -115,6 +127,10 @@ class _KbdProxy:
         # Process buffered data and send USB keypresses
         return self._kbd.get() if self._kbd else None
 
+    def get_all(self, on_key=None):
+        # Process everything buffered, one USB report per call
+        return self._kbd.get_all(on_key) if self._kbd else 0
+
 # --------------------------------
 # Asynchronous keyboard reader
 # --------------------------------
@@ -124,36 +140,87 @@ class KeyboardReader:
 
     - Powers the device via `power_pin`
     - Waits for 'ready' handshake (0xF9, 0xFB) once after power-up
-    - Buffers incoming bytes in RAM
+    - Buffers incoming bytes in a fixed-size RAM ring buffer
+
+    Several readers can run at once (see KeyboardManager): pass them
+    the same ReportBatcher as `hid` and a different `source` bit each.
+    Without `hid`, reports go to the stock boot keyboard, or with
+    `nkro` to the N-key rollover one boot.py installs (see stow_nkro).
+
+    `uart` (anything with in_waiting, read() and readinto()) and `power`
+    (anything with a `value`) replace the busio UART and the power pin,
+    e.g. a serial port and its DTR line on a computer.
+
+    `debounce_ms` turns on the chatter filter (see stow_filter) with
+    that bounce window.
     """
     def __init__(self, uart_id, baudrate, bits, parity, stop, tx, rx,
-                 power_pin, ready_timeout_ms=200, rxbuf_max=1024):
+                 power_pin, ready_timeout_ms=200, rxbuf_max=1024,
+                 compact_overflow=True, hid=None, source=1, nkro=False,
+                 uart=None, power=None, debounce_ms=0):
         # Configure UART
-        print("UART: TX={}, RX={}, baud={}".format(tx, rx, baudrate))
-        try:
-            self.uart = busio.UART(tx=tx, rx=rx, baudrate=baudrate)
-            self.uart.timeout = 0.1  # Set a reasonable timeout
-            print("UART OK")
-        except Exception as e:
-            print("UART fail: {}".format(e))
-            raise
-        self.kbd = Keyboard(usb_hid.devices)
+        if uart is not None:
+            self.uart = uart
+        else:
+            print("UART: TX={}, RX={}, baud={}".format(tx, rx, baudrate))
+            try:
+                self.uart = busio.UART(tx=tx, rx=rx, baudrate=baudrate)
+                self.uart.timeout = 0.1  # Set a reasonable timeout
+                print("UART OK")
+            except Exception as e:
+                print("UART fail: {}".format(e))
+                raise
+        if hid is None:
+            kbd = NkroKeyboard(usb_hid.devices) if nkro else Keyboard(usb_hid.devices)
+            hid = ReportBatcher(kbd)
+        self._batch = hid
+        self.kbd = hid.kbd
+        self.source = source  # This reader's bit in the shared HID state
         # Power control - initialize as OFF first (active-high assumed)
-        self.power = digitalio.DigitalInOut(power_pin)
-        self.power.direction = digitalio.Direction.OUTPUT
+        if power is not None:
+            self.power = power
+        else:
+            self.power = digitalio.DigitalInOut(power_pin)
+            self.power.direction = digitalio.Direction.OUTPUT
         # Explicitly set to OFF initially to ensure clean power cycle
         self.power.value = False
         # State
         self.ready = False
-        self._buf = bytearray()
+        self._buf = RingBuffer(rxbuf_max)
+        self._decoder = ScancodeDecoder()
+        # On overflow, squeeze out repeats and makes before losing any break
+        self._compactor = Compactor(rxbuf_max, self._decoder) if compact_overflow else None
+        self._buf.on_full = self._compactor
+        self._seen_dropped = 0
+        # Loss handed to the EV_RESYNC event in the queue, see _reconcile()
+        self._resync = False             # An EV_RESYNC is out, not dispatched yet
+        self._lost_all = False           # It releases every key
+        self._lost = bytearray(16)       # It releases these scancodes
+        # Between decoder and dispatch: drops bounces and unmapped codes
+        self.chatter = ChatterFilter(DISPATCH, debounce_ms) if debounce_ms else None
         self._rxbuf_max = rxbuf_max
         self._ready_timeout_ms = ready_timeout_ms
-        # Track function and shift keys
-        self.fn = False
-        self.shift = False
-        self.ctrl = False
-        self.alt = False
-        self.cmd = False
+        self.last_rx = time.monotonic()  # Time of the last received key byte
+        self.unknown = 0                 # Scancodes not in the keymap
+        self.retries = 0                 # Failed power-up attempts
+        self.bytes_rx = 0                # Bytes read from the UART
+        self.hid_errors = 0              # Failed HID sends
+        self.rx_ms = ticks_ms()          # ticks_ms() of the last UART read with key bytes
+        self.wake_ms = -1                # Set by rx_task: first bytes after idle came after this
+        self._batch_rx_ms = -1           # rx_ms of the oldest event in the pending report
+        self._first_report = True        # Next report is the first since boot
+        self.repeats = 0                 # Auto-repeated make codes dropped
+        self.scancode = -1               # Raw byte of the last dispatch()ed key event
+        self.capture = None              # stow_capture.Recorder, see start_capture()
+        self.macros = None               # stow_macro.MacroPlayer, see KeyboardManager
+        self.queue = None                # EventQueue between rx_task and hid_task
+        # Which keys are down (Fn and modifiers included), one bit per scancode
+        self.keys = KeyState(get_keymap().nkeys)
+
+    @property
+    def fn(self):
+        """True while the Fn key is held."""
+        return self.keys.is_down(SC_FN)
 
     def start(self):
         """Start the keyboard reader."""
@@ -162,6 +229,21 @@ class KeyboardReader:
         if self.ready:
             print("Kbd reader start...")
 
+    async def start_async(self):
+        """Like start(), but waits for the handshake without blocking the loop."""
+        await self.power_cycle_async()
+        if self.ready:
+            print("Kbd reader start...")
+        return self.ready
+
+    def start_capture(self, rec):
+        """
+        Record everything read from the UART, and power/handshake
+        events, into the stow_capture.Recorder `rec` (None: stop).
+        """
+        self.capture = rec
+        self._buf.on_read = rec.chunk if rec else None
+
     def stop(self):
         """Stop the keyboard reader and power down."""
         # Optionally power off the keyboard
@@ -182,33 +264,66 @@ class KeyboardReader:
         self._read_data()
         if not self._buf:
             return None
-        data = bytes(self._buf)
-        self._buf = bytearray()
-        return data
+        data = bytearray(len(self._buf))
+        self._buf.pop_many(data)
+        return bytes(data)
     
-    def read_one(self):
+    def read_event(self):
         """
-        Return one byte from the buffer
-        and clear the buffer or None if nothing is available.
+        Decode buffered bytes until one protocol event is complete.
+        Return the event int (see stow_proto) or 0 if nothing is available.
+        With the chatter filter on, a key-up it held back can come out
+        later than its byte, when nothing new was read.
         """
         self._read_data()
-        if not self._buf:
-            return None
-        
-        data = bytes(self._buf)[0]
-        self._buf = self._buf[1:]
-        # If all keys are up, release key is sent twice. 
-        # If that is the case, clear second byte and
-        # clear all flags. 
-        if data >= 0x80:
-            if len(self._buf) > 0 and bytes(self._buf)[0] == data: 
-                self._buf = self._buf[1:]
-                self.fn = False
-                self.ctrl = False
-                self.shift = False
-                self.alt = False
-            # self._power_cycle_()
-        return data
+        chatter = self.chatter
+        if chatter:
+            ev = chatter.pop(ticks_ms())
+            if ev:
+                return ev
+        comp = self._compactor
+        if not self._resync and (self._buf.dropped != self._seen_dropped or (
+                comp and comp.lossy)):
+            # Bytes were lost - fix the host's key state before going on.
+            # The loss so far goes with this event, so the next call
+            # decodes on; a later loss gets its own once this one is done.
+            self._resync = True
+            self._lost_all = self._buf.dropped != self._seen_dropped
+            self._seen_dropped = self._buf.dropped
+            if comp and comp.lossy:
+                comp.lossy = False
+                for i in range(16):
+                    self._lost[i] |= comp.lost[i]
+                    comp.lost[i] = 0
+            return EV_RESYNC << 8
+        while self._buf:
+            ev = self._decoder.feed_byte(self._buf.pop())
+            if ev and chatter:
+                ev = chatter.feed(ev, ticks_ms())
+            if ev:
+                return ev
+        return 0
+
+    def read_one(self):
+        """
+        Return one scancode byte from the buffer (bit 7 set on key up)
+        or None if nothing is available. The second byte of an
+        "all keys up" message and handshakes are filtered out.
+        """
+        while True:
+            ev = self.read_event()
+            if not ev:
+                return None
+            kind = ev >> 8
+            if kind == EV_ALL_UP:
+                # If all keys are up, release key is sent twice:
+                # swallow the second byte and forget all keys.
+                self.keys.release_all()
+            elif kind == EV_DOWN or kind == EV_UP:
+                return ev_raw(ev)
+            elif kind == EV_RESYNC:
+                self._reconcile(self._batch)
+                self.flush()
     
     def get(self):
         """
@@ -217,53 +332,201 @@ class KeyboardReader:
         
         Return tuple: (keycode, scancode)
         """
-        d = self.read_one()
-        if not d:
+        ev = self.read_event()
+        if not ev:
             return None, None
-            
-        print("Scancode 0x{:02X}".format(d))
-        scancode = d & 0x7F  # Remove key up/down bit
-        is_keyup = (d & 0x80) != 0
+        keycode = self.dispatch(ev)
+        self.flush()
+        return (self.scancode if self.scancode >= 0 else None), (keycode or None)
+
+    def get_all(self, on_key=None):
+        """
+        Batch mode: process every buffered event and send the net change
+        as one HID report (more only if a key is tapped within the batch).
+
+        Calls on_key(scancode, keycode) for each key sent.
+        Return the number of events processed.
+        """
+        count = 0
+        ev = self.read_event()
+        while ev:
+            count += 1
+            keycode = self.dispatch(ev)
+            if on_key and keycode:
+                on_key(self.scancode, keycode)
+            ev = self.read_event()
+        self.flush()
+        return count
+
+    def dispatch(self, ev):
+        """
+        Batch mode: apply one decoded event to the pending HID report.
+        Return the keycode pressed or released (0: none); the raw
+        scancode byte is left in `scancode` (-1: not a key event).
+        Does not allocate, so it returns no tuple.
+        """
+        if self._batch_rx_ms < 0:
+            self._batch_rx_ms = self.rx_ms
+        return self._handle(ev, self._batch)
+
+    def flush(self):
+        """Batch mode: send the pending HID report, if anything changed."""
+        try:
+            if self._batch.flush():
+                if self._batch_rx_ms >= 0:
+                    stow_stats.latency.add(ticks_diff(ticks_ms(), self._batch_rx_ms))
+                if self.wake_ms >= 0:
+                    ms = ticks_diff(ticks_ms(), self.wake_ms)
+                    stow_stats.wake.add(ms)
+                    log.event(INFO, MSG_WAKE, ms)
+                    self.wake_ms = -1
+                if self._first_report:
+                    self._first_report = False
+                    stow_stats.mark(stow_stats.FIRST_REPORT)
+                    log.event(INFO, MSG_FIRST_REPORT, stow_stats.boot_ms(stow_stats.FIRST_REPORT))
+            self._batch_rx_ms = -1
+        except Exception as e:
+            self.hid_errors += 1
+            print("Key Err: {}".format(e))
+
+    def _handle(self, ev, hid):
+        """
+        Dispatch one decoded event to the ReportBatcher `hid`.
+        Return the keycode (0: none) and set `scancode`.
+        """
+        self.scancode = -1
+        kind = ev >> 8
+        if kind == EV_RESYNC:
+            self._reconcile(hid)
+            return 0
+        if kind != EV_DOWN and kind != EV_UP:
+            # All keys up, or keyboard re-plugged: nothing may stay pressed
+            if _LOG_DEBUG and log.level <= DEBUG:
+                log.event(DEBUG, MSG_ALL_UP if kind == EV_ALL_UP else MSG_HANDSHAKE)
+            self.keys.release_all()
+            try:
+                hid.release_all(self.source)
+            except Exception as e:
+                self.hid_errors += 1
+                print("Key Err: {}".format(e))
+            return 0
+
+        d = ev_raw(ev)
+        if _LOG_DEBUG and log.level <= DEBUG:
+            log.event(DEBUG, MSG_SCANCODE, d)
         
+        entry = DISPATCH[d]
+        action = entry >> 16
+
         # Handle Fn key (mapped to RIGHT_ALT in keymap)
-        if scancode < len(ADAFRUIT_KEYMAP) and ADAFRUIT_KEYMAP[scancode] == K.RIGHT_ALT:
-            if is_keyup:
-                self.fn = False
-                print("Fn release")
-            else:
-                self.fn = True
-                print("Fn pressed")
-            return None, Nonersl  # Don't send the Fn key itself
-            
-        # Get the keycode for this scancode
-        keycode = self.scan_to_keycode(scancode)
-        if keycode is None:
-            print("Unknown: 0x{:02X}".format(scancode))
-            return d, None # d is original scancode
-            
-        # Key conversions for function keys
-        if self.fn and keycode in [K.ONE, K.TWO, K.THREE, K.FOUR, K.FIVE, K.SIX, K.SEVEN, K.EIGHT, K.NINE, K.ZERO]:
-            # Convert numbers to F1-F10 when Fn is pressed
-            original_keycode = keycode
-            if keycode == K.ZERO:
-                keycode = K.F10
-                print("Fn+0 -> F10")
-            else:
-                keycode = K.F1 + keycode - K.ONE
-                print("Fn+{} -> F{}".format(original_keycode - K.ONE + 1, keycode - K.F1 + 1))
-            
+        if action == ACT_FN_DOWN:
+            self.keys.press(d)
+            if _LOG_DEBUG and log.level <= DEBUG:
+                log.event(DEBUG, MSG_FN_DOWN)
+            return 0  # Don't send the Fn key itself
+        if action == ACT_FN_UP:
+            self.keys.release(d & 0x7F)
+            if _LOG_DEBUG and log.level <= DEBUG:
+                log.event(DEBUG, MSG_FN_UP)
+            return 0
+        self.scancode = d  # Original scancode
+        if action == ACT_IGNORE:
+            self.unknown += 1
+            log.event(INFO, MSG_UNKNOWN, d & 0x7F)
+            return 0
+
+        if action == ACT_PRESS:
+            if not self.keys.press(d):
+                # Auto-repeat: the host repeats held keys by itself
+                self.repeats += 1
+                return 0
+            if self.macros:
+                m = MACRO[d | 0x80] if self.keys.is_down(SC_FN) else 0
+                if not m:
+                    m = MACRO[d]
+                if m:
+                    # Played by macro_task; the key's release finds nothing held
+                    self.macros.start(keymap.macros, m - 1)
+                    return 0
+        else:
+            self.keys.release(d & 0x7F)
+
+        base = entry & 0xFF
+        fn_keycode = (entry >> 8) & 0xFF
+        keycode = fn_keycode if self.keys.is_down(SC_FN) else base
+        if _LOG_DEBUG and keycode != base and log.level <= DEBUG:
+            log.event(DEBUG, MSG_FN_MAP, base, keycode)
+
         # Send keypress/release
         try:
-            if is_keyup:
-                self.kbd.release(keycode)
-                print("Keycode {} Release".format(keycode))
+            if action == ACT_RELEASE:
+                hid.release_key(base, self.source)
+                if fn_keycode != base:
+                    # Fn may have changed since the press - release both
+                    hid.release_key(fn_keycode, self.source)
+                if _LOG_DEBUG and log.level <= DEBUG:
+                    log.event(DEBUG, MSG_RELEASE, keycode)
             else:
-                self.kbd.press(keycode)
-                print("Keycode {} Pressed".format(keycode))
+                hid.press_key(keycode, self.source)
+                if _LOG_DEBUG and log.level <= DEBUG:
+                    log.event(DEBUG, MSG_PRESS, keycode)
         except Exception as e:
+            self.hid_errors += 1
             print("Key Err: {}".format(e))
-        return d, keycode
-            
+        return keycode
+
+    def _reconcile(self, hid):
+        """
+        Called in stream order after bytes were lost: release every key
+        whose break was dropped, or all keys if we can't tell which.
+        Works from what read_event() took when it returned EV_RESYNC.
+        """
+        self._resync = False
+        try:
+            if self._lost_all:
+                self._lost_all = False
+                self.keys.release_all()
+                hid.release_all(self.source)
+            lost = self._lost
+            for i in range(16):
+                x = lost[i]
+                if not x:
+                    continue
+                lost[i] = 0
+                for bit in range(8):
+                    if not x & (1 << bit):
+                        continue
+                    sc = (i << 3) | bit
+                    if not self.keys.release(sc):
+                        continue  # Its make was lost as well
+                    entry = DISPATCH[sc | 0x80]
+                    if entry >> 16 == ACT_RELEASE:
+                        hid.release_key(entry & 0xFF, self.source)
+                        hid.release_key((entry >> 8) & 0xFF, self.source)
+        except Exception as e:
+            self.hid_errors += 1
+            print("Key Err: {}".format(e))
+
+    def protocol_errors(self):
+        """Return the number of protocol errors and unknown scancodes so far."""
+        if self.chatter:
+            return self._decoder.errors + self.unknown + self.chatter.ghosts
+        return self._decoder.errors + self.unknown
+
+    def counters(self):
+        """
+        Return the totals stow_stats reports: bytes rx, overflow drops,
+        unknown, hid errors, retries, bounces, ghosts, strays, merged,
+        dropped makes, dropped breaks.
+        """
+        chatter = self.chatter
+        comp = self._compactor
+        return (self.bytes_rx, self._buf.dropped, self.unknown, self.hid_errors,
+                self.retries, chatter.bounces if chatter else 0,
+                chatter.ghosts if chatter else 0, chatter.strays if chatter else 0,
+                comp.merged if comp else 0, comp.dropped_makes if comp else 0,
+                comp.dropped_breaks if comp else 0)
+
 
     def lookup(self, scancode):
         """
@@ -277,7 +540,7 @@ class KeyboardReader:
         # True if key is being released
         # False if key is being pressed
         scancode &= 0x7F
-        return STOWAWAY_KEYMAP[scancode] if scancode < len(STOWAWAY_KEYMAP) else None, modifier
+        return get_keymap().label(scancode), modifier
 
     def scan_to_keycode(self, scancode):
         """
@@ -288,59 +551,24 @@ class KeyboardReader:
             scancode (byte): Stowaway keyboard scancode (0x00-0x7F), 
             should already have bit 7 cleared by caller.
         """
-        if scancode < len(ADAFRUIT_KEYMAP):
-            return ADAFRUIT_KEYMAP[scancode]
-        return None
+        return get_keymap().keycode(scancode)
 
     def _power_cycle(self):
         """
         Power-cycle the keyboard and wait for the ready handshake (0xF9, 0xFB).
+        Blocks for up to ready_timeout_ms - use power_cycle_async() from asyncio code.
         """
-        print("Powercycling keys...")
-        # Ensure power is OFF first, then cycle: OFF -> delay -> ON
-        self.power.value = False
+        self._power_off()
         time.sleep(0.02)  # 20ms additional startup time
         self.power.value = True
+        if self.capture:
+            self.capture.mark(MARK_POWER_ON)
         time.sleep(0.02)  # 20ms delay as required
         print("Wait for Keys handshake")
         # Give the device a moment to power up before listening for handshake
 
-        id_state = 0  # 0: expect 0xF9, 1: expect 0xFB
         t0 = time.monotonic()
-
-        while True:
-            n = self.uart.in_waiting
-            if n:
-                data = self.uart.read(n) or b""
-                hex_str = ' '.join(['{:02X}'.format(b) for b in data])
-                print("RX {} bytes: {}".format(len(data), hex_str))
-                for b in data:
-                    # Wait until keyboard announces it's ready
-                    if not self.ready:
-                        if id_state == 0:
-                            if b == 0xF9:
-                                print("(0xF9)", end=' ')
-                                id_state = 1
-                            # else stay in state 0
-                        elif id_state == 1:
-                            if b == 0xFB:
-                                print("(0xFB) - keys ready")
-                                self.ready = True
-                                return  # Exit successfully when handshake is complete
-                            else:
-                                print("No 0xFB but 0x{:02X}, restarting".format(b))
-                                id_state = 0  # restart sequence
-                        continue
-
-                    # After ready: buffer data (cap length to avoid runaway)
-                    if len(self._buf) < self._rxbuf_max:
-                        self._buf.append(b)
-                    else:
-                        # Drop oldest half if we overflow (simple backpressure)
-                        cut = self._rxbuf_max // 2
-                        self._buf = self._buf[cut:]
-                        self._buf.append(b)
-
+        while not self._poll_handshake():
             # Check for timeout and exit if exceeded
             elapsed = (time.monotonic() - t0) * 1000  # Convert to ms
             if elapsed > self._ready_timeout_ms:
@@ -350,6 +578,83 @@ class KeyboardReader:
             # Small delay to avoid busy-waiting
             time.sleep(0.001)
 
+    async def power_cycle_async(self):
+        """
+        Power-cycle the keyboard and wait for the ready handshake,
+        yielding to the event loop while waiting. Return self.ready.
+        """
+        self._power_off()
+        await asyncio.sleep(0.02)  # 20ms additional startup time
+        self.power.value = True
+        if self.capture:
+            self.capture.mark(MARK_POWER_ON)
+        await asyncio.sleep(0.02)  # 20ms delay as required
+        print("Wait for Keys handshake")
+
+        t0 = time.monotonic()
+        while not self._poll_handshake():
+            elapsed = (time.monotonic() - t0) * 1000  # Convert to ms
+            if elapsed > self._ready_timeout_ms:
+                print("Keys timeout: {:.1f}ms (limit: {}ms)".format(elapsed, self._ready_timeout_ms))
+                return False
+            await asyncio.sleep(0.005)
+        return True
+
+    def _power_off(self):
+        """Power the keyboard down and forget all protocol and key state."""
+        print("Powercycling keys...")
+        # Ensure power is OFF first, then cycle: OFF -> delay -> ON
+        self.power.value = False
+        self.ready = False
+        if self.capture:
+            self.capture.mark(MARK_POWER_OFF)
+        self._buf.clear()
+        self._decoder.reset()
+        self._resync = self._lost_all = False  # Every key goes up below
+        for i in range(16):
+            self._lost[i] = 0
+        if self.chatter:
+            self.chatter.reset()  # Its held break too
+        if self.queue:
+            self.queue.clear()  # Events decoded before power-off must not reach the host
+        self.keys.release_all()
+        try:
+            self._batch.release_all(self.source)
+        except Exception as e:
+            self.hid_errors += 1
+            print("Key Err: {}".format(e))
+
+    def _poll_handshake(self):
+        """
+        Read what the UART has and look for the ready handshake.
+        Bytes after the handshake are buffered. Return self.ready.
+        The handshake itself is not key activity: a re-power leaves
+        last_rx and rx_ms alone, so the display and power_task stay idle.
+        """
+        n = self.uart.in_waiting
+        if n:
+            data = self.uart.read(n) or b""
+            self.bytes_rx += len(data)
+            if self.capture:
+                self.capture.chunk(data, len(data))
+            hex_str = ' '.join(['{:02X}'.format(b) for b in data])
+            print("RX {} bytes: {}".format(len(data), hex_str))
+            for b in data:
+                # Wait until keyboard announces it's ready
+                if not self.ready:
+                    if self._decoder.feed_byte(b) == EV_HANDSHAKE << 8:
+                        print("(0xF9 0xFB) - keys ready")
+                        self.ready = True
+                        if self.capture:
+                            self.capture.mark(MARK_READY)
+                    continue
+
+                # After ready: buffer data (ring drops oldest half on overflow)
+                self._buf.put(b)
+                self.last_rx = time.monotonic()
+                self.rx_ms = ticks_ms()
+        return self.ready
+
     def _read_data(self):
         """
         Read any available data from UART and buffer it.
@@ -358,19 +663,14 @@ class KeyboardReader:
         if not self.ready:
             return
             
-        n = self.uart.in_waiting
+        # Straight from the UART into the ring buffer, no copies
+        # (with a capture running, each chunk is also copied into its
+        # buffer - see start_capture())
+        n = self._buf.readinto_from(self.uart)
         if n:
-            data = self.uart.read(n) or b""
-            if data:
-                for b in data:
-                    # Buffer data (cap length to avoid runaway)
-                    if len(self._buf) < self._rxbuf_max:
-                        self._buf.append(b)
-                    else:
-                        # Drop oldest half if we overflow (simple backpressure)
-                        cut = self._rxbuf_max // 2
-                        self._buf = self._buf[cut:]
-                        self._buf.append(b)
+            self.bytes_rx += n
+            self.last_rx = time.monotonic()
+            self.rx_ms = ticks_ms()
 
 # --------------------------
 # Module-level helpers
@@ -408,4 +708,134 @@ def init_kbd(uart_id, baudrate, bits, parity, stop, tx, rx, power_pin, ready_tim
         except Exception as e:
             print("Keys init err: {}".format(e))
             return False
-    return keyboard.ready
\ No newline at end of file
+    return keyboard.ready
+
+async def init_kbd_async(uart_id, baudrate, bits, parity, stop, tx, rx, power_pin,
+                         ready_timeout_ms=200, rxbuf_max=128,
+                         backoff_ms=50, max_backoff_ms=2000, hid=None,
+                         capture=None, nkro=False, debounce_ms=0):
+    """
+    Like init_kbd(), but never blocks the event loop: powers up the
+    keyboard and retries with exponential backoff until the ready
+    signature has been seen. Return the KeyboardReader.
+    `capture` (a stow_capture.Recorder) records from the first power-up.
+    """
+    global keyboard, uart
+    if keyboard is None:
+        print("Creating KeyboardReader...")
+        keyboard = KeyboardReader(
+            uart_id=uart_id,
+            baudrate=baudrate,
+            bits=bits,
+            parity=parity,
+            stop=stop,
+            tx=tx,
+            rx=rx,
+            power_pin=power_pin,
+            ready_timeout_ms=ready_timeout_ms,
+            rxbuf_max=rxbuf_max,
+            hid=hid,
+            nkro=nkro,
+            debounce_ms=debounce_ms,
+        )
+        stow_stats.mark("uart_hid")
+        uart = _KbdProxy(keyboard)
+        if capture:
+            keyboard.start_capture(capture)
+    await connect(keyboard, backoff_ms, max_backoff_ms)
+    stow_stats.mark("keys_ready")
+    return keyboard
+
+
+# --------------------------
+# Several keyboards
+# --------------------------
+class KeyboardManager:
+    """
+    Runs several KeyboardReaders on one event loop, each with its own
+    UART, power pin, event queue and tasks. They share one
+    ReportBatcher, so the host gets one merged report: a key stays
+    down while any keyboard holds it, and all-keys-up on one keyboard
+    only releases that keyboard's keys.
+
+    With `macro_pace_ms`, the layout's macros are played through the
+    same ReportBatcher, one report per `macro_pace_ms` (see stow_macro).
+    """
+    MAX_READERS = 7  # One source bit each, the last one is for macros
+
+    def __init__(self, readers=(), macro_pace_ms=0):
+        self.readers = []
+        self.hid = None     # Shared ReportBatcher, from the first reader
+        self.macros = None  # stow_macro.MacroPlayer on `hid`
+        self._macro_pace_ms = macro_pace_ms
+        for kbd in readers:
+            self.adopt(kbd)
+
+    def adopt(self, kbd):
+        """Add an existing reader. It must use this manager's `hid` (or be the first)."""
+        if self.hid is None:
+            self.hid = kbd._batch
+            if self._macro_pace_ms:
+                self.macros = MacroPlayer(self.hid, self._macro_pace_ms)
+        elif kbd._batch is not self.hid:
+            raise ValueError("Reader has its own HID state")
+        kbd.macros = self.macros
+        self.readers.append(kbd)
+        return kbd
+
+    def add(self, tx, rx, power_pin, baudrate=9600, **kwargs):
+        """Create a reader for one more keyboard. Return it."""
+        n = len(self.readers)
+        if n >= self.MAX_READERS:
+            raise ValueError("At most {} keyboards".format(self.MAX_READERS))
+        kbd = KeyboardReader(None, baudrate, 8, None, 1, tx, rx, power_pin,
+                             hid=self.hid, source=1 << n, **kwargs)
+        return self.adopt(kbd)
+
+    @property
+    def bytes_rx(self):
+        return sum(kbd.bytes_rx for kbd in self.readers)
+
+    @property
+    def rx_ms(self):
+        """ticks_ms() of the latest UART read on any keyboard."""
+        latest = self.readers[0].rx_ms if self.readers else 0
+        for kbd in self.readers:
+            if ticks_diff(kbd.rx_ms, latest) > 0:
+                latest = kbd.rx_ms
+        return latest
+
+    @property
+    def last_rx(self):
+        return max(kbd.last_rx for kbd in self.readers) if self.readers else 0
+
+    def counters(self):
+        """KeyboardReader.counters(), summed over all keyboards."""
+        totals = [0] * 11
+        for kbd in self.readers:
+            for i, n in enumerate(kbd.counters()):
+                totals[i] += n
+        return totals
+
+    async def run_reader(self, kbd, poll_ms=1, queue_len=32, on_key=None,
+                         on_flush=None, idle_repower_s=0, max_errors=8,
+                         max_poll_ms=0, active_ms=500):
+        """Connect `kbd` if needed, then run its UART, HID and watchdog tasks."""
+        if not kbd.ready:
+            await connect(kbd)
+        queue = kbd.queue = EventQueue(queue_len)
+        await asyncio.gather(
+            rx_task(kbd, queue, poll_ms, max_poll_ms, active_ms),
+            hid_task(kbd, queue, on_key, on_flush),
+            watchdog_task(kbd, idle_repower_s, max_errors),
+        )
+
+    async def run(self, poll_ms=1, queue_len=32, on_key=None, on_flush=None,
+                  idle_repower_s=0, max_errors=8, max_poll_ms=0, active_ms=500):
+        """Run all readers until cancelled. A silent keyboard doesn't hold up the others."""
+        tasks = [self.run_reader(kbd, poll_ms, queue_len, on_key, on_flush,
+                                 idle_repower_s, max_errors, max_poll_ms, active_ms)
+                 for kbd in self.readers]
+        if self.macros:
+            tasks.append(macro_task(self.macros))
+        await asyncio.gather(*tasks)
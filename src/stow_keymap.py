@@ -0,0 +1,127 @@
+# CircuitPython: Compiled keymap tables for the Stowaway keyboard
+# No hardware imports - tools/keymap_compiler.py writes the files it reads.
+"""
+Layouts are written as text in layouts/*.txt and compiled on the
+computer by tools/keymap_compiler.py into one binary image each:
+
+    0       b"STKM"
+    4       format version (2)
+    5       n = number of scancodes
+    6       scancode of the Fn key (0xFF: none)
+    7       number of macros
+    8       keycode per scancode, n bytes (0: key sends nothing)
+    8+n     keycode per scancode while Fn is held, n bytes
+    8+2n    m = size of the macros, uint16 little-endian
+    10+2n   macros, m bytes, each:
+              trigger  scancode, bit 7 set: only while Fn is held
+              k        number of steps
+              k steps  modifier bits, keycode (0: modifiers only) -
+                       one report with these keys down (see stow_macro)
+    10+2n+m n+1 label offsets into the label text, uint16 little-endian
+    12+4n+m label text, UTF-8
+
+The image is a file keymaps/<name>.bin on CIRCUITPY, or DATA in a
+module keymap_<name> (compiled with --py) that can be frozen into the
+firmware, where it stays in flash. Labels are only read when asked for.
+"""
+
+MAGIC = b"STKM"
+VERSION = 2
+HEADER_SIZE = 8
+NO_FN = 0xFF
+MACRO_FN = 0x80  # Trigger bit: the macro is on the Fn layer
+KEYMAP_DIR = "keymaps"
+
+try:
+    _DIR = __file__.rsplit("/", 1)[0] + "/" if "/" in __file__ else ""
+except NameError:
+    _DIR = ""
+
+
+class Keymap:
+    """
+    Keycode tables of one layout. `data` is the start of the image -
+    at least up to the label offsets; `path` is where to read the
+    labels from if `data` stops there. `macros` holds the macro
+    records as stored in the image.
+    """
+    def __init__(self, name, data, path=None):
+        if bytes(data[0:4]) != MAGIC or data[4] != VERSION:
+            raise ValueError("Not a keymap: {}".format(name))
+        n = data[5]
+        self.name = name
+        self.nkeys = n
+        self.fn_scancode = data[6]
+        self.base = bytes(data[HEADER_SIZE:HEADER_SIZE + n])
+        self.fn = bytes(data[HEADER_SIZE + n:HEADER_SIZE + 2 * n])
+        p = HEADER_SIZE + 2 * n
+        m = data[p] | data[p + 1] << 8
+        self.nmacros = data[7]
+        self.macros = bytes(data[p + 2:p + 2 + m])
+        self._labels_at = p + 2 + m  # Label offsets
+        self._data = data
+        self._path = path
+        self._labels = None
+
+    def keycode(self, sc):
+        """Keycode for scancode `sc`, or None if the key sends nothing."""
+        if sc < self.nkeys and self.base[sc]:
+            return self.base[sc]
+        return None
+
+    def fn_keycode(self, sc):
+        """Keycode for scancode `sc` while Fn is held, or None."""
+        if sc < self.nkeys and self.fn[sc]:
+            return self.fn[sc]
+        return None
+
+    def macro_offsets(self):
+        """Yield the offset into `macros` of each macro record."""
+        p = 0
+        for _ in range(self.nmacros):
+            yield p
+            p += 2 + 2 * self.macros[p + 1]
+
+    def label(self, sc):
+        """Text printed on the key, or None. Loads the labels on first use."""
+        if sc >= self.nkeys:
+            return None
+        if self._labels is None:
+            self._load_labels()
+        off = self._labels_at + 2 * sc
+        t = self._labels
+        start = t[off] | t[off + 1] << 8
+        end = t[off + 2] | t[off + 3] << 8
+        if start == end:
+            return None
+        text_at = self._labels_at + 2 * self.nkeys + 2
+        return str(t[text_at + start:text_at + end], "utf-8")
+
+    def _load_labels(self):
+        if self._path is None:
+            self._labels = self._data
+            return
+        with open(self._path, "rb") as f:
+            self._labels = f.read()
+
+
+def load(name):
+    """
+    Return the Keymap for layout `name`: the frozen module
+    keymap_<name> if there is one, else keymaps/<name>.bin.
+    """
+    try:
+        mod = __import__("keymap_" + name)
+        return Keymap(name, mod.DATA)
+    except ImportError:
+        pass
+    path = "{}{}/{}.bin".format(_DIR, KEYMAP_DIR, name)
+    with open(path, "rb") as f:
+        head = f.read(HEADER_SIZE)
+        if len(head) < HEADER_SIZE:
+            raise ValueError("Not a keymap: {}".format(name))
+        # Keycode tables and macros now, labels only when label() is called
+        data = head + f.read(2 * head[5] + 2)
+        p = len(data) - 2
+        data += f.read(data[p] | data[p + 1] << 8)
+    return Keymap(name, data, path)
@@ -0,0 +1,94 @@
+# CircuitPython: Pressed-key bitmap for the Stowaway keyboard
+# No hardware imports - sim/streamcheck.py checks snapshot/diff on CPython.
+
+
+class KeyState:
+    """
+    One bit per scancode, allocated once (96 keys = 12 bytes).
+
+    - ``press()`` / ``release()`` return False if nothing changed, so an
+      auto-repeated make code costs one bit test
+    - ``snapshot()`` copies the bitmap, ``diff()`` reports what changed
+      since a snapshot, ``release_all()`` empties it key by key
+    """
+    def __init__(self, nkeys=96):
+        self.bits = bytearray((nkeys + 7) // 8)
+        self.nkeys = nkeys
+        self.count = 0  # Number of keys down
+
+    def __len__(self):
+        return self.count
+
+    def is_down(self, sc):
+        return sc < self.nkeys and bool(self.bits[sc >> 3] & (1 << (sc & 7)))
+
+    def press(self, sc):
+        """Mark `sc` as down. Return False if it already was (a repeat)."""
+        if sc >= self.nkeys:
+            return False
+        i = sc >> 3
+        m = 1 << (sc & 7)
+        if self.bits[i] & m:
+            return False
+        self.bits[i] |= m
+        self.count += 1
+        return True
+
+    def release(self, sc):
+        """Mark `sc` as up. Return False if it wasn't down."""
+        if sc >= self.nkeys:
+            return False
+        i = sc >> 3
+        m = 1 << (sc & 7)
+        if not self.bits[i] & m:
+            return False
+        self.bits[i] &= ~m
+        self.count -= 1
+        return True
+
+    def clear(self):
+        for i in range(len(self.bits)):
+            self.bits[i] = 0
+        self.count = 0
+
+    def snapshot(self, dest=None):
+        """Copy the bitmap into `dest` (a bytearray, allocated if None) and return it."""
+        if dest is None:
+            dest = bytearray(len(self.bits))
+        dest[:] = self.bits
+        return dest
+
+    def diff(self, old, on_change):
+        """
+        Call on_change(scancode, down) for every key that changed since
+        the snapshot `old`, lowest scancode first. Return the count.
+        """
+        n = 0
+        for i in range(len(self.bits)):
+            x = self.bits[i] ^ old[i]
+            sc = i << 3
+            while x:
+                if x & 1:
+                    on_change(sc, bool(self.bits[i] & (1 << (sc & 7))))
+                    n += 1
+                x >>= 1
+                sc += 1
+        return n
+
+    def release_all(self, on_release=None):
+        """Release every key, calling on_release(scancode) for each. Return the count."""
+        n = 0
+        if not self.count:
+            return 0
+        for i in range(len(self.bits)):
+            x = self.bits[i]
+            sc = i << 3
+            while x:
+                if x & 1 and on_release:
+                    on_release(sc)
+                n += x & 1
+                x >>= 1
+                sc += 1
+            self.bits[i] = 0
+        self.count = 0
+        return n
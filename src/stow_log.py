@@ -0,0 +1,164 @@
+# CircuitPython: Allocation-free leveled logging for the key path
+# Runs unchanged on CPython.
+"""
+Hot-path code logs binary records - (ticks_ms, message code, a, b) -
+into a preallocated ring. Nothing is formatted or printed until
+log_task() drains the ring while the keyboard is idle.
+
+Usage on the hot path:
+
+    if log.level <= DEBUG:
+        log.event(DEBUG, MSG_PRESS, keycode)
+
+The inline level check makes disabled levels cost one attribute load
+and a compare. MIN_LEVEL is a run-time floor: set_level() never goes
+below it. To take DEBUG off the key path altogether, stow_kbd guards
+its calls with its own `_LOG_DEBUG = const(1)` as well; set that to 0
+and MicroPython compiles them out (it folds a const only inside the
+module that defines it, so stow_log can't do it for the caller).
+"""
+
+import array
+import asyncio
+
+try:
+    from micropython import const
+except ImportError:
+    def const(x):
+        return x
+
+try:
+    from supervisor import ticks_ms
+except ImportError:
+    import time
+
+    def ticks_ms():
+        return int(time.monotonic() * 1000) & 0x3FFFFFFF
+
+DEBUG = const(10)
+INFO = const(20)
+WARNING = const(30)
+ERROR = const(40)
+OFF = const(100)
+
+MIN_LEVEL = const(10)  # Lowest level set_level() accepts (a run-time clamp)
+
+# Message codes and their formats (filled in by log_task, never on the key path)
+MSG_SCANCODE = const(0)
+MSG_FN_DOWN = const(1)
+MSG_FN_UP = const(2)
+MSG_UNKNOWN = const(3)
+MSG_FN_MAP = const(4)
+MSG_PRESS = const(5)
+MSG_RELEASE = const(6)
+MSG_ALL_UP = const(7)
+MSG_HANDSHAKE = const(8)
+MSG_SHOW_KEY = const(9)
+MSG_FIRST_REPORT = const(10)
+MSG_GC_IDLE = const(11)
+MSG_GC_BUSY = const(12)
+MSG_SLEEP = const(13)
+MSG_WAKE = const(14)
+MSG_MACRO = const(15)
+
+MESSAGES = (
+    "Scancode 0x{:02X}",
+    "Fn pressed",
+    "Fn release",
+    "Unknown: 0x{:02X}",
+    "Fn+{} -> {}",
+    "Keycode {} Pressed",
+    "Keycode {} Release",
+    "All keys up",
+    "Keys handshake",
+    "Scan: 0x{:02X} Key: 0x{:02X}",
+    "First key after {} ms",
+    "gc: {} ms, {} free",
+    "gc while typing: +{} free",
+    "Idle {} s: light sleep",
+    "Key after idle: {} ms",
+    "Macro 0x{:02X}: {} steps",
+)
+
+_FIELDS = 4  # ticks, level << 8 | code, a, b
+
+
+class Log:
+    """
+    Ring of binary log records. When full, the oldest record is
+    overwritten and counted in `lost`.
+    """
+    def __init__(self, size=64, level=INFO):
+        self._rec = array.array("l", [0] * (size * _FIELDS))
+        self._size = size
+        self._head = 0
+        self._count = 0
+        self.lost = 0
+        self.level = OFF
+        self.set_level(level)
+
+    def __len__(self):
+        return self._count
+
+    def set_level(self, level):
+        self.level = level if level > MIN_LEVEL else MIN_LEVEL
+
+    def event(self, level, code, a=0, b=0):
+        """Store one record. Does not allocate."""
+        if level < self.level:
+            return
+        if self._count == self._size:
+            self._head = (self._head + 1) % self._size
+            self._count -= 1
+            self.lost += 1
+        i = ((self._head + self._count) % self._size) * _FIELDS
+        rec = self._rec
+        rec[i] = ticks_ms()
+        rec[i + 1] = (level << 8) | code
+        rec[i + 2] = a
+        rec[i + 3] = b
+        self._count += 1
+
+    def pop(self, out):
+        """
+        Move the oldest record into the 4-item list `out`:
+        [ticks, level << 8 | code, a, b]. Return False if empty.
+        """
+        if not self._count:
+            return False
+        i = self._head * _FIELDS
+        for k in range(_FIELDS):
+            out[k] = self._rec[i + k]
+        self._head = (self._head + 1) % self._size
+        self._count -= 1
+        return True
+
+
+def format_record(rec):
+    """Return the text for a record popped with Log.pop()."""
+    code = rec[1] & 0xFF
+    if code >= len(MESSAGES):
+        return "Log code {}: {} {}".format(code, rec[2], rec[3])
+    return MESSAGES[code].format(rec[2], rec[3])
+
+
+log = Log()
+
+
+async def log_task(sink=print, idle_ms=50, batch=4, busy=None):
+    """
+    Format and write pending records to `sink`, a few at a time.
+    Holds back while busy() returns True (e.g. keys are arriving).
+    """
+    rec = [0] * _FIELDS
+    while True:
+        await asyncio.sleep(idle_ms / 1000)
+        if busy and busy():
+            continue
+        n = batch
+        while n and log.pop(rec):
+            sink(format_record(rec))
+            n -= 1
+        if log.lost:
+            sink("Log: {} lost".format(log.lost))
+            log.lost = 0
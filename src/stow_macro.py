@@ -0,0 +1,126 @@
+# CircuitPython: Macro playback for the Fn layer and the Special keys
+# Needs only asyncio and stow_log - tools/stow_bridge.py plays macros on CPython.
+"""
+Macros are compiled with the layout (tools/keymap_compiler.py, format
+in stow_keymap): a step is two bytes, the modifier bits and keycode of
+one keystroke. use_layout() indexes them by trigger key; a press of
+such a key only queues its macro here, so the key path never waits.
+
+macro_task plays the queue, one report every `pace_ms`. The host polls
+the keyboard about every 8 ms, so faster reports would only wait in
+send_report() and hold up the event loop; in between, rx_task and
+hid_task run, so the UART buffer is drained and live typing goes on
+while a long macro plays. Macro keys are pressed under their own
+ReportBatcher source bit (MACRO_SOURCE): a key held on the keyboard
+stays down through a macro, and all-keys-up doesn't cut one short.
+
+Steps share a report where they can - the next key goes down in the
+report that lets the last one up - unless it is the same key again or
+the modifiers change, which need a report with the keys up between.
+"""
+
+import array
+import asyncio
+
+from stow_log import log, INFO, MSG_MACRO
+
+MACRO_SOURCE = 0x80  # ReportBatcher source bit; keyboards use the others
+
+
+class MacroPlayer:
+    """
+    Macros waiting to be played through the ReportBatcher `hid` by
+    macro_task. Up to `queue_len` can wait; more are dropped and
+    counted.
+    """
+    def __init__(self, hid, pace_ms=10, queue_len=4, source=MACRO_SOURCE):
+        self.hid = hid
+        self.pace_ms = pace_ms
+        self.source = source
+        self.data = b""  # Keymap.macros of the layout in use
+        self._queue = array.array("H", [0] * queue_len)  # Offsets into data
+        self._head = 0
+        self._count = 0
+        self._wake = asyncio.Event()
+        self._mods = 0   # Macro keys down on the host
+        self._key = 0
+        self.played = 0   # Macros played to the end
+        self.dropped = 0  # Macros not played: queue full
+        self.reports = 0  # Reports sent for macros
+
+    def start(self, data, offset):
+        """
+        Queue the macro at `offset` in `data` (a Keymap's macros).
+        Return False if the queue is full. Does not allocate.
+        """
+        if self._count == len(self._queue):
+            self.dropped += 1
+            return False
+        self.data = data
+        self._queue[(self._head + self._count) % len(self._queue)] = offset
+        self._count += 1
+        self._wake.set()
+        log.event(INFO, MSG_MACRO, data[offset] & 0x7F, data[offset + 1])
+        return True
+
+    def busy(self):
+        """True while a macro is playing or waiting."""
+        return self._count > 0
+
+    def _set(self, mods, key):
+        """Make `mods` and `key` the macro's keys on the host, in one report."""
+        hid = self.hid
+        src = self.source
+        changed = mods ^ self._mods
+        for bit in range(8):
+            if changed & (1 << bit):
+                if mods & (1 << bit):
+                    hid.press_key(0xE0 + bit, src)
+                else:
+                    hid.release_key(0xE0 + bit, src)
+        if key != self._key:
+            if self._key:
+                hid.release_key(self._key, src)
+            if key:
+                hid.press_key(key, src)
+        self._mods = mods
+        self._key = key
+        hid.flush()
+        self.reports += 1
+
+    async def _play(self, offset):
+        data = self.data
+        pace = self.pace_ms / 1000
+        p = offset + 2
+        for _ in range(data[offset + 1]):
+            mods = data[p]
+            key = data[p + 1]
+            p += 2
+            if (key == self._key or mods != self._mods) and (self._mods or self._key):
+                self._set(0, 0)
+                await asyncio.sleep(pace)
+            self._set(mods, key)
+            await asyncio.sleep(pace)
+        self._set(0, 0)
+        await asyncio.sleep(pace)
+
+
+async def macro_task(player):
+    """Play the macros queued in `player`, one after the other."""
+    while True:
+        while not player._count:
+            player._wake.clear()
+            await player._wake.wait()
+        offset = player._queue[player._head]
+        try:
+            await player._play(offset)
+            player.played += 1
+        except Exception as e:
+            print("Macro Err: {}".format(e))
+            try:
+                player.hid.release_all(player.source)
+            except Exception:
+                pass
+            player._mods = player._key = 0
+        player._head = (player._head + 1) % len(player._queue)
+        player._count -= 1
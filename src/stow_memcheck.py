@@ -0,0 +1,94 @@
+# CircuitPython: Heap allocation check for the key path
+# Runs on the Pico (gc.mem_free) and under CPython (sim/memcheck.py).
+"""
+From the REPL (the keyboard doesn't need to be connected):
+
+    import stow_memcheck
+    stow_memcheck.run()
+
+Feeds a scancode trace - Shift and Fn presses, auto-repeats, all keys
+up - through the steady-state key path of a KeyboardReader: ring
+buffer -> read_event() -> dispatch() -> flush(), HID send included.
+The collector is off meanwhile, so every allocation shows up as a drop
+in free heap. Only modifier keys are used: the USB host sees nothing
+but Shift going down and up.
+"""
+
+import gc
+
+try:
+    _mem_free = gc.mem_free
+except AttributeError:
+    # CPython: bytes still allocated, as traced by tracemalloc
+    import tracemalloc
+
+    def _mem_free():
+        return -tracemalloc.get_traced_memory()[0]
+
+
+def trace(kbd_module):
+    """Return the raw bytes of one round of the test trace."""
+    km = kbd_module.get_keymap()
+    shift_l = km.base.index(0xE1)  # Keycode.LEFT_SHIFT
+    shift_r = km.base.index(0xE5)  # Keycode.RIGHT_SHIFT
+    fn = kbd_module.SC_FN
+    return bytes((
+        shift_l, shift_l, shift_l,  # Press, two auto-repeats
+        fn, shift_r,                # Fn layer on, second key
+        shift_r | 0x80, fn | 0x80,
+        shift_l | 0x80, shift_l | 0x80,  # Last key up: doubled
+    ))
+
+
+def _feed(kbd, data):
+    """Push `data` through the key path. Return the number of events."""
+    buf = kbd._buf
+    for i in range(len(data)):  # No iterator object
+        buf.put(data[i])
+    events = 0
+    ev = kbd.read_event()
+    while ev:
+        kbd.dispatch(ev)
+        events += 1
+        ev = kbd.read_event()
+    kbd.flush()
+    return events
+
+
+def measure(kbd, data, rounds=50, warmup=3):
+    """
+    Run `rounds` rounds of `data` with the collector off.
+    Return (events, heap bytes used).
+    """
+    for _ in range(warmup):
+        _feed(kbd, data)  # First use may set things up
+    gc.collect()
+    gc.disable()
+    try:
+        before = _mem_free()
+        events = 0
+        n = rounds
+        while n:
+            events += _feed(kbd, data)
+            n -= 1
+        after = _mem_free()
+    finally:
+        gc.enable()
+    return events, before - after
+
+
+def run(kbd=None, rounds=50):
+    """
+    Print the heap used per event and return it. Without `kbd`, a
+    KeyboardReader is made on the pins from main.py (not powered up).
+    """
+    import stow_kbd
+    if kbd is None:
+        import main
+        kbd = stow_kbd.KeyboardReader(None, 9600, 8, None, 1, main.uart_txd_pin,
+                                      main.uart_rxd_pin, main.kbd_power_pin)
+        kbd.ready = True  # Fed by hand, no handshake
+    events, used = measure(kbd, trace(stow_kbd), rounds)
+    per_event = used / events if events else 0
+    print("memcheck: {} events, {} bytes, {:.2f} bytes/event".format(events, used, per_event))
+    return per_event
@@ -0,0 +1,191 @@
+# CircuitPython: N-key rollover keyboard report
+# No hardware imports - report bytes can be checked on CPython.
+"""
+The stock adafruit_hid Keyboard sends the 8-byte boot report: six key
+slots, and a ValueError for the seventh key. With NKRO on (STOW_NKRO = 1
+in settings.toml, then a hard reset so boot.py installs the
+descriptor), every key has its own bit instead:
+
+    0       modifier bits (Left Ctrl 0xE0 .. Right GUI 0xE7)
+    1       0
+    2..7    up to six keycodes, as in the boot report
+    8..35   one bit per keycode 0x00..0xDF
+
+Under the report protocol, the descriptor makes the host ignore bytes
+1..7 and read the bitmap. A BIOS or other host that asks for the boot
+protocol (usb_hid.get_boot_device() == 1) reads only the first 8
+bytes, a standard boot report with the first six keys; the report still
+has the length the descriptor declares, with the bitmap left empty. If
+the keyboard device turns out to be the stock one (STOW_NKRO set
+without a hard reset), only the first 8 bytes are sent.
+"""
+
+REPORT_LEN = 36
+BITMAP = 8         # Offset of the bitmap in the report
+BITMAP_KEYS = 0xE0 # Keycodes 0x00..0xDF have a bit
+BOOT_KEYS = 6
+
+REPORT_DESCRIPTOR = bytes((
+    0x05, 0x01,        # Usage Page (Generic Desktop)
+    0x09, 0x06,        # Usage (Keyboard)
+    0xA1, 0x01,        # Collection (Application)
+    0x05, 0x07,        #   Usage Page (Keyboard/Keypad)
+    0x19, 0xE0,        #   Usage Minimum (Left Control)
+    0x29, 0xE7,        #   Usage Maximum (Right GUI)
+    0x15, 0x00,        #   Logical Minimum (0)
+    0x25, 0x01,        #   Logical Maximum (1)
+    0x75, 0x01,        #   Report Size (1)
+    0x95, 0x08,        #   Report Count (8)
+    0x81, 0x02,        #   Input (Data, Variable, Absolute) - modifiers
+    0x75, 0x08,        #   Report Size (8)
+    0x95, 0x07,        #   Report Count (7)
+    0x81, 0x01,        #   Input (Constant) - reserved byte and boot keys
+    0x05, 0x08,        #   Usage Page (LEDs)
+    0x19, 0x01,        #   Usage Minimum (Num Lock)
+    0x29, 0x05,        #   Usage Maximum (Kana)
+    0x75, 0x01,        #   Report Size (1)
+    0x95, 0x05,        #   Report Count (5)
+    0x91, 0x02,        #   Output (Data, Variable, Absolute) - LEDs
+    0x75, 0x03,        #   Report Size (3)
+    0x95, 0x01,        #   Report Count (1)
+    0x91, 0x01,        #   Output (Constant) - padding
+    0x05, 0x07,        #   Usage Page (Keyboard/Keypad)
+    0x19, 0x00,        #   Usage Minimum (0)
+    0x29, BITMAP_KEYS - 1,  # Usage Maximum (0xDF)
+    0x15, 0x00,        #   Logical Minimum (0)
+    0x25, 0x01,        #   Logical Maximum (1)
+    0x75, 0x01,        #   Report Size (1)
+    0x96, BITMAP_KEYS, 0x00,  # Report Count (224)
+    0x81, 0x02,        #   Input (Data, Variable, Absolute) - key bitmap
+    0xC0,              # End Collection
+))
+
+
+def device():
+    """The usb_hid.Device for boot.py: usb_hid.enable((device(),), boot_device=1)."""
+    import usb_hid
+    return usb_hid.Device(
+        report_descriptor=REPORT_DESCRIPTOR,
+        usage_page=0x01,
+        usage=0x06,
+        report_ids=(0,),
+        in_report_lengths=(REPORT_LEN,),
+        out_report_lengths=(1,),
+    )
+
+
+class NkroKeyboard:
+    """
+    Drop-in for adafruit_hid's Keyboard as used by ReportBatcher: a
+    press or release flips one bit (and a boot slot) in a report that is
+    allocated once, and the batcher sends it. `devices` is usb_hid.devices
+    or anything with a keyboard-usage device that has send_report().
+    `boot_device` returns what the host asked for, as
+    usb_hid.get_boot_device() (the default, where there is one) does.
+    """
+    def __init__(self, devices, boot_device=None):
+        self._keyboard_device = None
+        for dev in devices:
+            if dev.usage_page == 0x01 and dev.usage == 0x06:
+                self._keyboard_device = dev
+                break
+        if self._keyboard_device is None:
+            raise ValueError("Could not find matching HID device.")
+        self._report = bytearray(REPORT_LEN)
+        self._boot_report = memoryview(self._report)[0:BITMAP]
+        self._boot_only = bytearray(REPORT_LEN)  # Boot protocol: no bitmap
+        self.report = self._report
+        self.rollover = 0  # Keys down that don't fit into the boot slots
+        if boot_device is None:
+            try:
+                import usb_hid
+                boot_device = getattr(usb_hid, "get_boot_device", None)
+            except ImportError:
+                pass  # CPython (tools/stow_bridge.py): report protocol only
+        self._boot_device = boot_device
+
+    def _add_keycode_to_report(self, k):
+        r = self._report
+        if 0xE0 <= k <= 0xE7:
+            r[0] |= 1 << (k - 0xE0)
+            return
+        if k >= BITMAP_KEYS:
+            return  # Not a keyboard usage
+        i = BITMAP + (k >> 3)
+        m = 1 << (k & 7)
+        if r[i] & m:
+            return
+        r[i] |= m
+        for j in range(2, 2 + BOOT_KEYS):
+            if not r[j]:
+                r[j] = k
+                return
+        self.rollover += 1
+
+    def _remove_keycode_from_report(self, k):
+        r = self._report
+        if 0xE0 <= k <= 0xE7:
+            r[0] &= ~(1 << (k - 0xE0))
+            return
+        if k >= BITMAP_KEYS:
+            return
+        i = BITMAP + (k >> 3)
+        m = 1 << (k & 7)
+        if not r[i] & m:
+            return
+        r[i] &= ~m
+        for j in range(2, 2 + BOOT_KEYS):
+            if r[j] == k:
+                r[j] = 0
+                if self.rollover:
+                    self._refill(j)
+                return
+        self.rollover -= 1  # It was one of the keys without a boot slot
+
+    def _refill(self, slot):
+        """Give the free boot slot to a held key that has none."""
+        r = self._report
+        for k in range(BITMAP_KEYS):
+            if r[BITMAP + (k >> 3)] & (1 << (k & 7)):
+                for j in range(2, 2 + BOOT_KEYS):
+                    if r[j] == k:
+                        break
+                else:
+                    r[slot] = k
+                    self.rollover -= 1
+                    return
+
+    def send_report(self):
+        report = self.report
+        if report is self._report and self._boot_device and self._boot_device() == 1:
+            # The host reads boot reports only (BIOS, boot loader)
+            b = self._boot_only
+            for i in range(BITMAP):
+                b[i] = report[i]
+            report = b
+        try:
+            self._keyboard_device.send_report(report)
+        except ValueError:
+            if self.report is self._boot_report:
+                raise
+            # The stock 8-byte keyboard (no hard reset since STOW_NKRO was set)
+            print("NKRO descriptor not installed - sending boot reports")
+            self.report = self._boot_report
+            self._keyboard_device.send_report(self.report)
+
+    def press(self, *keycodes):
+        for k in keycodes:
+            self._add_keycode_to_report(k)
+        self.send_report()
+
+    def release(self, *keycodes):
+        for k in keycodes:
+            self._remove_keycode_from_report(k)
+        self.send_report()
+
+    def release_all(self):
+        r = self._report
+        for i in range(REPORT_LEN):
+            r[i] = 0
+        self.rollover = 0
+        self.send_report()
@@ -0,0 +1,89 @@
+# CircuitPython: Adaptive idle power for the keyboard pipeline
+# Runs unchanged on CPython (without `alarm`, light sleep is a plain sleep).
+"""
+Three states, from the time since the last UART byte:
+
+- ACTIVE: a key within `active_ms` - rx_task polls at rx_poll_ms
+- IDLE: rx_task doubles its pause per empty check, up to max_poll_ms
+- SLEEP: after `sleep_after_s`, power_task light-sleeps the whole chip
+  for up to `sleep_ms` between event loop rounds
+
+No keystroke is lost on the way back: the UART keeps receiving into its
+buffer during light sleep (the chip only waits for an interrupt), and
+the keyboard stays powered - it needs power to see the first key at
+all. With a `wake_pin` wired to the keyboard's TX line, the start bit
+of the first byte ends the sleep and the key is read at the next UART
+check (max_poll_ms); without, it can wait `sleep_ms` longer.
+
+The time from the last empty UART check to the HID report of the
+first key after an idle spell goes into stow_stats.wake; the UART
+checks per second (stow_stats.polls) stand in for the current drawn.
+"""
+
+import asyncio
+import time
+
+import stow_stats
+from stow_stats import ticks_ms, ticks_diff
+from stow_log import log, INFO, MSG_SLEEP
+
+try:
+    import alarm
+except ImportError:
+    alarm = None
+
+ACTIVE = 0
+IDLE = 1
+SLEEP = 2
+
+state = ACTIVE
+
+
+def idle():
+    """True once the keyboard has been quiet for longer than active_ms."""
+    return state != ACTIVE
+
+
+def light_sleep(ms, wake_pin=None):
+    """
+    Light-sleep for up to `ms`, or until `wake_pin` goes low.
+    Return True if the pin ended it.
+    """
+    if alarm is None:
+        time.sleep(ms / 1000)
+        return False
+    alarms = [alarm.time.TimeAlarm(monotonic_time=time.monotonic() + ms / 1000)]
+    if wake_pin is not None:
+        alarms.append(alarm.pin.PinAlarm(wake_pin, value=False, pull=True))
+    woke = alarm.light_sleep_until_alarms(*alarms)
+    return wake_pin is not None and isinstance(woke, alarm.pin.PinAlarm)
+
+
+async def power_task(kbd, active_ms=500, sleep_after_s=60, sleep_ms=100,
+                     wake_pin=None, check_ms=100):
+    """
+    Track the power state of `kbd` (a KeyboardReader or KeyboardManager)
+    and light-sleep while it has been quiet for `sleep_after_s`
+    (0: never sleep).
+    """
+    global state
+    while True:
+        quiet = ticks_diff(ticks_ms(), kbd.rx_ms)
+        if sleep_after_s and quiet > sleep_after_s * 1000:
+            if state != SLEEP:
+                state = SLEEP
+                log.event(INFO, MSG_SLEEP, quiet // 1000)
+            woke = light_sleep(sleep_ms, wake_pin)
+            stow_stats.sleeps += 1
+            if woke:
+                # A byte is coming: stay up until the readers have seen it
+                await asyncio.sleep(check_ms / 1000)
+            else:
+                # One round for everyone else; the second yield lets tasks
+                # whose sleep ran out meanwhile go first (CPython's loop
+                # queues them behind us)
+                await asyncio.sleep(0)
+                await asyncio.sleep(0)
+            continue
+        state = IDLE if quiet > active_ms else ACTIVE
+        await asyncio.sleep(check_ms / 1000)
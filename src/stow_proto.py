@@ -0,0 +1,201 @@
+# CircuitPython: Incremental decoder for the Stowaway UART protocol
+# No hardware imports - sim/streamcheck.py feeds it recorded byte streams.
+"""
+The Stowaway sends one byte per key transition:
+
+- 0x00..0x7F  key down (make) for that scancode
+- 0x80..0xFF  key up (break), scancode in the lower 7 bits
+- The same break byte twice in a row means "all keys are up"
+- 0xF9 0xFB   ready handshake after power-up (also on hot-replug)
+
+Events are returned as a single small int, ``(kind << 8) | scancode``,
+so decoding does not allocate.
+"""
+
+EV_NONE = 0
+EV_DOWN = 1
+EV_UP = 2
+EV_ALL_UP = 3
+EV_HANDSHAKE = 4
+EV_RESYNC = 5     # Not from the wire: bytes were lost, reconcile key state
+
+HANDSHAKE_1 = 0xF9
+HANDSHAKE_2 = 0xFB
+
+EVENT_NAMES = ("None", "Down", "Up", "AllUp", "Handshake", "Resync")
+
+
+def ev_kind(ev):
+    """Return the event kind (EV_DOWN, EV_UP, ...) of an event int."""
+    return ev >> 8
+
+
+def ev_code(ev):
+    """Return the 7-bit scancode of an event int."""
+    return ev & 0x7F
+
+
+def ev_raw(ev):
+    """Return the raw byte the event was decoded from (bit 7 set on key up)."""
+    if ev >> 8 == EV_DOWN:
+        return ev & 0x7F
+    return (ev & 0x7F) | 0x80
+
+
+class ScancodeDecoder:
+    """
+    Byte-at-a-time state machine; keeps just enough state to see the
+    doubled "all up" byte and the two-byte handshake across chunk borders.
+    """
+    def __init__(self):
+        self.handshakes = 0  # Number of handshakes seen
+        self.errors = 0      # Bytes that break the protocol
+        self.reset()
+
+    def reset(self):
+        self._last = -1       # Previous break byte, -1 if none
+        self._hs = False      # True after 0xF9, waiting for 0xFB
+
+    def feed_byte(self, b):
+        """Decode one byte. Return an event int, or EV_NONE."""
+        if self._hs:
+            self._hs = False
+            if b == HANDSHAKE_2:
+                self._last = -1
+                self.handshakes += 1
+                return EV_HANDSHAKE << 8
+            # A lone 0xF9 would be key-up of scancode 0x79, which does not
+            # exist on the Stowaway - discard it and decode `b` normally.
+            self.errors += 1
+        if b == HANDSHAKE_1:
+            self._hs = True
+            return EV_NONE
+        if b & 0x80:
+            if b == self._last:
+                # Second copy of the same break byte: all keys up
+                self._last = -1
+                return (EV_ALL_UP << 8) | (b & 0x7F)
+            self._last = b
+            return (EV_UP << 8) | (b & 0x7F)
+        self._last = -1
+        return (EV_DOWN << 8) | b
+
+    def feed(self, data):
+        """Decode a whole chunk in one pass, yielding event ints."""
+        for b in data:
+            ev = self.feed_byte(b)
+            if ev:
+                yield ev
+
+
+class Compactor:
+    """
+    Overflow policy for a RingBuffer of raw Stowaway bytes (set it as
+    ``ring.on_full``). Frees a quarter of the buffer without reordering:
+
+    1. repeated make codes (auto-repeat) - lossless, counted in `merged`
+    2. make codes whose break is still buffered - the tap is lost,
+       but no key can stick
+    3. other make codes, oldest first
+    4. only then break codes, oldest first - their scancodes are set in
+       the `lost` bitmap so the reader can release them on the host
+
+    Handshake bytes are always kept. All storage is preallocated.
+    `decoder` is the ScancodeDecoder that reads the ring: its last byte
+    comes right before the ring's oldest, which matters when a dropped
+    make would leave a break after a copy of itself.
+    """
+    def __init__(self, size, decoder=None):
+        self._decoder = decoder
+        self._scratch = bytearray(size)
+        self._drop = bytearray(size)  # 1 = remove this byte
+        self._seen = bytearray(128)   # Per-scancode scratch state
+        self.lost = bytearray(16)     # Bitmap: scancodes whose break was dropped
+        self.merged = 0
+        self.dropped_makes = 0
+        self.dropped_breaks = 0
+        self.lossy = False            # Set when `lost` has bits; reader clears it
+
+    def __call__(self, ring):
+        buf = self._scratch
+        drop = self._drop
+        seen = self._seen
+        n = ring.pop_many(buf)
+        for i in range(n):
+            drop[i] = 0
+        need = n // 4
+
+        # 1. Repeated makes: same make with no break in between
+        for k in range(128):
+            seen[k] = 0
+        for i in range(n):
+            b = buf[i]
+            if b == HANDSHAKE_1 or b == HANDSHAKE_2:
+                for k in range(128):
+                    seen[k] = 0
+            elif b & 0x80:
+                seen[b & 0x7F] = 0
+            elif seen[b]:
+                drop[i] = 1
+                self.merged += 1
+                need -= 1
+            else:
+                seen[b] = 1
+
+        # 2. Makes that have a later break: scan backwards, drop oldest first
+        if need > 0:
+            for k in range(128):
+                seen[k] = 0
+            for i in range(n - 1, -1, -1):
+                b = buf[i]
+                if b == HANDSHAKE_1 or b == HANDSHAKE_2:
+                    continue
+                if b & 0x80:
+                    seen[b & 0x7F] = 1
+                elif seen[b] and not drop[i]:
+                    drop[i] = 2  # Candidate
+            for i in range(n):
+                if drop[i] == 2:
+                    if need > 0:
+                        drop[i] = 1
+                        self.dropped_makes += 1
+                        need -= 1
+                    else:
+                        drop[i] = 0
+
+        # 3. Any other make, oldest first
+        i = 0
+        while need > 0 and i < n:
+            b = buf[i]
+            if not drop[i] and not b & 0x80:
+                drop[i] = 1
+                self.dropped_makes += 1
+                need -= 1
+            i += 1
+
+        # 4. Breaks, oldest first - remember them for reconciliation
+        i = 0
+        while need > 0 and i < n:
+            b = buf[i]
+            if not drop[i] and b != HANDSHAKE_1 and b != HANDSHAKE_2:
+                drop[i] = 1
+                self.lost[(b & 0x7F) >> 3] |= 1 << (b & 7)
+                self.lossy = True
+                self.dropped_breaks += 1
+                need -= 1
+            i += 1
+
+        # Put back what is left. A break that now follows a copy of itself
+        # (its make was dropped) would look like "all keys up" - skip it.
+        # The decoder's last break counts: it was read just before buf[0].
+        before = self._decoder._last if self._decoder else -1
+        last = before
+        for i in range(n):
+            if drop[i]:
+                continue
+            b = buf[i]
+            if b & 0x80 and b == last and (buf[i - 1] if i else before) != b:
+                continue
+            ring.put(b)
+            last = b
+        return True
@@ -0,0 +1,156 @@
+# CircuitPython: Pipeline counters and latency histograms
+# Streams to the usb_cdc data channel, so the console stays quiet.
+"""
+One line per report on usb_cdc.data (enable it in boot.py):
+
+    S,<ticks_ms>,<bytes rx>,<overflow drops>,<unknown>,<hid errors>,<retries>,<idle gc>,<busy gc>,<polls>,<sleeps>,<bounces>,<ghosts>,<strays>,<merged>,<dropped makes>,<dropped breaks>,L,<h0>..<h11>,J,<h0>..<h11>,W,<h0>..<h11>
+
+L is the histogram of UART read -> HID report send, J the event loop
+jitter (how late a fixed sleep wakes up, only sampled while keys are
+active), W the latency of the first key after an idle spell (see
+stow_power). All in milliseconds, bucket 0 is "0 ms", bucket i counts
+values in [2**(i-1), 2**i). Counts are totals since boot over all
+keyboards; tools/stats_reader.py turns them into percentiles and rates.
+Idle gc counts the collections stow_gc ran between keystrokes, busy gc
+the ones the VM ran by itself while keys were coming in. Polls are
+UART checks by rx_task, sleeps the light sleeps of stow_power.
+Bounces, ghosts and strays are what the chatter filter dropped (see
+stow_filter; 0 while it is off). Merged, dropped makes and dropped
+breaks are what the overflow compactor squeezed out of the RX buffer
+(see stow_proto.Compactor); overflow drops only count what it couldn't
+handle, so with compaction on (the default) they stay 0.
+
+Once the first HID report has been sent, one boot line follows:
+
+    B,<phase>,<ms>,<phase>,<ms>,...
+
+with the time of each boot phase (see mark()) since the first one.
+"""
+
+import array
+import asyncio
+
+try:
+    from supervisor import ticks_ms
+except ImportError:
+    import time
+
+    def ticks_ms():
+        return int(time.monotonic() * 1000) & 0x3FFFFFFF
+
+BUCKETS = 12
+
+_TICKS_PERIOD = 1 << 29
+_TICKS_MAX = _TICKS_PERIOD - 1
+_TICKS_HALFPERIOD = _TICKS_PERIOD // 2
+
+
+def ticks_diff(t1, t2):
+    """t1 - t2 for supervisor.ticks_ms() values, which wrap around."""
+    diff = (t1 - t2) & _TICKS_MAX
+    return ((diff + _TICKS_HALFPERIOD) & _TICKS_MAX) - _TICKS_HALFPERIOD
+
+
+class Histogram:
+    """Fixed power-of-two buckets in a preallocated array."""
+    def __init__(self, buckets=BUCKETS):
+        self.counts = array.array("L", [0] * buckets)
+
+    def add(self, ms):
+        i = 0
+        while ms > 0 and i < len(self.counts) - 1:
+            ms >>= 1
+            i += 1
+        self.counts[i] += 1
+
+    def clear(self):
+        for i in range(len(self.counts)):
+            self.counts[i] = 0
+
+
+latency = Histogram()
+jitter = Histogram()
+wake = Histogram()  # First key after idle: last empty UART check -> HID report
+gc_idle = 0  # Collections run by stow_gc.gc_task
+gc_busy = 0  # Collections detected during typing
+polls = 0    # UART checks by rx_task - the current proxy
+sleeps = 0   # Light sleeps by stow_power.power_task
+
+# --------------------------
+# Boot phases
+# --------------------------
+boot_phases = []  # (name, ticks_ms) in the order they were reached
+FIRST_REPORT = "first_report"
+
+
+def mark(phase):
+    """Record when boot phase `phase` was reached (only the first time)."""
+    for name, _ in boot_phases:
+        if name == phase:
+            return
+    boot_phases.append((phase, ticks_ms()))
+
+
+def boot_ms(phase):
+    """Milliseconds from the first phase to `phase`, or -1 if not reached."""
+    for name, t in boot_phases:
+        if name == phase:
+            return ticks_diff(t, boot_phases[0][1])
+    return -1
+
+
+def format_boot_line():
+    parts = ["B"]
+    for name, _ in boot_phases:
+        parts.append(name)
+        parts.append(str(boot_ms(name)))
+    return ",".join(parts) + "\n"
+
+
+def format_line(kbd):
+    """`kbd` is a KeyboardReader or a KeyboardManager (totals of all keyboards)."""
+    c = kbd.counters()
+    parts = ["S", str(ticks_ms())]
+    parts.extend(str(n) for n in c[:5])
+    parts.extend((str(gc_idle), str(gc_busy), str(polls), str(sleeps)))
+    parts.extend(str(n) for n in c[5:])
+    parts.append("L")
+    parts.extend(str(c) for c in latency.counts)
+    parts.append("J")
+    parts.extend(str(c) for c in jitter.counts)
+    parts.append("W")
+    parts.extend(str(c) for c in wake.counts)
+    return ",".join(parts) + "\n"
+
+
+async def stats_task(kbd, port=None, period_s=1.0, tick_ms=10, idle=None):
+    """
+    Measure loop jitter every `tick_ms` and write a stats line to
+    `port` (default: usb_cdc.data, if enabled) every `period_s`.
+    While idle() returns True, only wake up for the stats lines.
+    """
+    if port is None:
+        try:
+            import usb_cdc
+            port = usb_cdc.data
+        except ImportError:
+            port = None
+    last_report = ticks_ms()
+    boot_sent = False
+    while True:
+        t0 = ticks_ms()
+        quiet = idle is not None and idle()
+        await asyncio.sleep(period_s if quiet else tick_ms / 1000)
+        now = ticks_ms()
+        if not quiet:
+            late = ticks_diff(now, t0) - tick_ms
+            jitter.add(late if late > 0 else 0)
+        if port is not None and ticks_diff(now, last_report) >= period_s * 1000:
+            last_report = now
+            try:
+                if not boot_sent and boot_ms(FIRST_REPORT) >= 0:
+                    port.write(format_boot_line().encode())
+                    boot_sent = True
+                port.write(format_line(kbd).encode())
+            except Exception:
+                pass  # Host not listening
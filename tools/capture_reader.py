@@ -0,0 +1,63 @@
+# CPython: Save a stow_capture stream from the Pico's usb_cdc data port
+"""
+Usage: python3 tools/capture_reader.py PORT OUT.stc [--baud 115200]
+
+With capture = True in main.py and CIRCUITPY read-only for the Pico
+(the default), captures stream to usb_cdc.data. This waits for the
+start of a stream and appends it to OUT.stc until Ctrl-C; replay it
+with python -m sim.replay OUT.stc. Restart it when the Pico resets.
+Needs pyserial (pip install pyserial).
+"""
+
+import argparse
+import os
+import sys
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(_ROOT, "src"))
+
+import stow_capture  # noqa: E402 - no hardware imports
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("port")
+    parser.add_argument("out")
+    parser.add_argument("--baud", type=int, default=115200)
+    args = parser.parse_args()
+    try:
+        import serial
+    except ImportError:
+        sys.exit("pyserial is needed to read a serial port: pip install pyserial")
+
+    append = os.path.exists(args.out) and os.path.getsize(args.out) > 0
+    total = 0
+    with serial.Serial(args.port, args.baud, timeout=1) as ser, open(args.out, "ab") as out:
+        # Everything before the header is from a stream we joined halfway
+        seen = b""
+        while True:
+            seen = (seen + ser.read(64))[-64:]
+            i = seen.find(stow_capture.MAGIC)
+            if i >= 0 and len(seen) - i >= stow_capture.HEADER_SIZE:
+                break
+        print("Capture started", flush=True)
+        if append:
+            # One file, several sessions: a marker instead of a second header
+            out.write(bytes((0, 0, 0, stow_capture.MARK_SESSION)))
+        else:
+            out.write(seen[i:i + stow_capture.HEADER_SIZE])
+        out.write(seen[i + stow_capture.HEADER_SIZE:])
+        try:
+            while True:
+                data = ser.read(256)
+                if data:
+                    out.write(data)
+                    out.flush()
+                    total += len(data)
+        except KeyboardInterrupt:
+            pass
+    print("{} bytes -> {}".format(total, args.out))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+# CPython: Compile layouts/*.txt into keymap tables for the Pico
+"""
+Usage: python3 tools/keymap_compiler.py LAYOUT.txt [...] [--out-dir DIR] [--py]
+
+Writes DIR/<name>.bin (default DIR: src/keymaps) for each layout file;
+copy the keymaps folder to CIRCUITPY. With --py, also writes
+DIR/keymap_<name>.py with the same bytes as DATA, for freezing into
+the firmware. The format is described in src/stow_keymap.py.
+
+Layout file, one line per scancode (# starts a comment line):
+
+    name de
+    0x00  ONE        fn=F1   1
+    0x22  FN
+    0x1B  -
+
+keycode is an adafruit_hid Keycode name, a number, FN for the Fn key
+or - for a key that sends nothing; fn= is what it sends while Fn is
+held; the rest of the line is the label shown for the key.
+
+A key can play a macro instead, always or only with Fn:
+
+    macro 0x42 fn  CONTROL+C
+    macro 0x4A fn  "Best regards," ENTER
+
+Each step is one keystroke: a keycode, or a chord joined with +
+(modifiers plus at most one other key). "text" is typed with the keys
+whose labels are its characters (capitals with Shift; space, \n and
+\t work too), so it comes out right for the layout the host is set to.
+Keycode names come from adafruit_hid if it is installed, else from
+the simulator's copy in sim/fakes.
+"""
+
+import argparse
+import os
+import shlex
+import struct
+import sys
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(_ROOT, "src"))
+
+import stow_keymap  # noqa: E402 - no hardware imports
+
+try:
+    from adafruit_hid.keycode import Keycode
+except ImportError:
+    sys.path.insert(0, os.path.join(_ROOT, "sim", "fakes"))
+    from adafruit_hid.keycode import Keycode
+
+
+class LayoutError(Exception):
+    pass
+
+
+_MODIFIERS = range(0xE0, 0xE8)
+_SHIFT = 0x02  # Left Shift in the modifier bits
+_WHITESPACE = {" ": "SPACEBAR", "\n": "ENTER", "\t": "TAB"}
+
+
+def _keycode(token, where):
+    if token.isdigit() or token.lower().startswith("0x"):
+        value = int(token, 0)
+    else:
+        value = getattr(Keycode, token, None)
+        if not isinstance(value, int):
+            raise LayoutError("{}: unknown keycode {}".format(where, token))
+    if not 0 < value < 256:
+        raise LayoutError("{}: keycode out of range: {}".format(where, token))
+    return value
+
+
+def _chord(token, where):
+    """Return the (modifier bits, keycode) step for KEY or MOD+...+KEY."""
+    mods = 0
+    key = 0
+    for part in token.split("+"):
+        k = _keycode(part, where)
+        if k in _MODIFIERS:
+            mods |= 1 << (k - 0xE0)
+        elif key:
+            raise LayoutError("{}: two keys in one step: {}".format(where, token))
+        else:
+            key = k
+    return mods, key
+
+
+def _text(text, keys, where):
+    """Return the steps that type `text` with the keys labelled with its characters."""
+    by_label = {}
+    for keycode, _, label in keys.values():
+        if keycode and label and label not in by_label:
+            by_label[label] = keycode
+    steps = []
+    for ch in text:
+        if ch in _WHITESPACE:
+            steps.append((0, getattr(Keycode, _WHITESPACE[ch])))
+        elif ch.isupper() and ch in by_label:
+            steps.append((_SHIFT, by_label[ch]))  # Letter keys are labelled in capitals
+        elif ch.upper() in by_label:
+            steps.append((0, by_label[ch.upper()]))
+        else:
+            raise LayoutError("{}: no key labelled {!r}".format(where, ch))
+    return steps
+
+
+def _macro(rest, keys, fn_scancode, where):
+    """Return (trigger, steps) for the text after `macro`."""
+    lex = shlex.shlex(rest, posix=False)  # Keeps the quotes: quoted tokens are text
+    lex.whitespace_split = True
+    lex.commenters = ""
+    try:
+        tokens = list(lex)
+    except ValueError as e:
+        raise LayoutError("{}: {}".format(where, e))
+    if len(tokens) < 2:
+        raise LayoutError("{}: expected scancode and steps".format(where))
+    sc = int(tokens[0], 0)
+    if sc not in keys or not keys[sc][0] or sc == fn_scancode:
+        raise LayoutError("{}: macro on 0x{:02X}, which is not a key".format(where, sc))
+    trigger = sc
+    steps_from = 1
+    if tokens[1] == "fn":
+        trigger |= stow_keymap.MACRO_FN
+        steps_from = 2
+    steps = []
+    for token in tokens[steps_from:]:
+        if len(token) > 1 and token[0] in "\"'" and token[-1] == token[0]:
+            text = token[1:-1].replace("\\n", "\n").replace("\\t", "\t")
+            steps += _text(text, keys, where)
+        else:
+            steps.append(_chord(token, where))
+    if not steps or len(steps) > 255:
+        raise LayoutError("{}: a macro has 1..255 steps".format(where))
+    return trigger, steps
+
+
+def parse(text, source="layout"):
+    """
+    Return (name, {scancode: (keycode, fn keycode, label)}, fn scancode,
+    [(trigger, [(modifier bits, keycode), ...]), ...]).
+    """
+    name = None
+    keys = {}
+    fn_scancode = stow_keymap.NO_FN
+    macro_lines = []
+    for lineno, line in enumerate(text.splitlines(), 1):
+        where = "{}:{}".format(source, lineno)
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        parts = line.split(None, 2)
+        if parts[0] == "name":
+            name = parts[1]
+            continue
+        if parts[0] == "macro":
+            # Text steps need the labels: resolve once all keys are read
+            macro_lines.append((line[len("macro"):], where))
+            continue
+        if len(parts) < 2:
+            raise LayoutError("{}: expected scancode and keycode".format(where))
+        sc = int(parts[0], 0)
+        if not 0 <= sc < 0x80:
+            raise LayoutError("{}: scancode out of range".format(where))
+        if sc in keys:
+            raise LayoutError("{}: scancode 0x{:02X} defined twice".format(where, sc))
+        rest = parts[2] if len(parts) > 2 else ""
+        fn = None
+        if rest.startswith("fn="):
+            fn_token, _, rest = rest.partition(" ")
+            fn = _keycode(fn_token[3:], where)
+        label = rest.strip() or None
+        if parts[1] == "FN":
+            if fn_scancode != stow_keymap.NO_FN:
+                raise LayoutError("{}: second FN key".format(where))
+            fn_scancode = sc
+            keys[sc] = (0, 0, label)
+        elif parts[1] == "-":
+            keys[sc] = (0, 0, label)
+        else:
+            keycode = _keycode(parts[1], where)
+            keys[sc] = (keycode, fn or keycode, label)
+    if not name:
+        raise LayoutError("{}: no name line".format(source))
+    macros = []
+    for rest, where in macro_lines:
+        trigger, steps = _macro(rest, keys, fn_scancode, where)
+        if any(t == trigger for t, _ in macros):
+            raise LayoutError("{}: second macro on the same key".format(where))
+        macros.append((trigger, steps))
+    if len(macros) > 255:
+        raise LayoutError("{}: more than 255 macros".format(source))
+    return name, keys, fn_scancode, macros
+
+
+def pack(keys, fn_scancode, macros=()):
+    """Return the binary image for a parsed layout."""
+    n = max(keys) + 1 if keys else 0
+    base = bytearray(n)
+    fn = bytearray(n)
+    offsets = [0]
+    text = bytearray()
+    for sc in range(n):
+        keycode, fn_keycode, label = keys.get(sc, (0, 0, None))
+        base[sc] = keycode
+        fn[sc] = fn_keycode
+        if label:
+            text += label.encode("utf-8")
+        offsets.append(len(text))
+    packed = bytearray()
+    for trigger, steps in macros:
+        packed += bytes((trigger, len(steps)))
+        for mods, key in steps:
+            packed += bytes((mods, key))
+    header = stow_keymap.MAGIC + bytes((stow_keymap.VERSION, n, fn_scancode, len(macros)))
+    return (header + bytes(base) + bytes(fn) + struct.pack("<H", len(packed)) + bytes(packed)
+            + struct.pack("<{}H".format(n + 1), *offsets) + bytes(text))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("layouts", nargs="+", help="Layout text files")
+    parser.add_argument("--out-dir", default=os.path.join(_ROOT, "src", stow_keymap.KEYMAP_DIR))
+    parser.add_argument("--py", action="store_true", help="Also write keymap_<name>.py for freezing")
+    args = parser.parse_args()
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    for path in args.layouts:
+        with open(path, encoding="utf-8") as f:
+            try:
+                name, keys, fn_scancode, macros = parse(f.read(), path)
+            except (LayoutError, ValueError) as e:
+                sys.exit("Error: {}".format(e))
+        image = pack(keys, fn_scancode, macros)
+        out = os.path.join(args.out_dir, name + ".bin")
+        with open(out, "wb") as f:
+            f.write(image)
+        print("{}: {} keys, {} macros, {} bytes -> {}".format(
+            name, len(keys), len(macros), len(image), out))
+        if args.py:
+            out = os.path.join(args.out_dir, "keymap_{}.py".format(name))
+            with open(out, "w") as f:
+                f.write("# Generated by tools/keymap_compiler.py from {} - do not edit\n".format(
+                    os.path.basename(path)))
+                f.write("DATA = {!r}\n".format(image))
+            print("{}: -> {}".format(name, out))
+
+
+if __name__ == "__main__":
+    main()
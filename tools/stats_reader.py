@@ -0,0 +1,136 @@
+# CPython: Read stow_stats lines from the Pico's usb_cdc data port
+"""
+Usage: python3 tools/stats_reader.py PORT [--baud 115200]
+       python3 tools/stats_reader.py -          (lines on stdin)
+
+PORT is the second serial device the Pico shows up as once boot.py has
+enabled usb_cdc.data (e.g. /dev/ttyACM1, /dev/cu.usbmodem...3).
+Needs pyserial (pip install pyserial) unless reading stdin.
+"""
+
+import argparse
+import sys
+
+FIELDS = ("ticks_ms", "bytes_rx", "drops", "unknown", "hid_errors", "retries",
+          "gc_idle", "gc_busy", "polls", "sleeps", "bounces", "ghosts", "strays",
+          "merged", "dropped_makes", "dropped_breaks")
+
+
+def parse_line(line):
+    """Return a dict for one 'S,...' line, or None if it is not one."""
+    parts = line.strip().split(",")
+    if not parts or parts[0] != "S" or "L" not in parts or "J" not in parts:
+        return None
+    try:
+        li = parts.index("L")
+        ji = parts.index("J")
+        stats = dict(zip(FIELDS, (int(p) for p in parts[1:li])))
+        wi = parts.index("W") if "W" in parts else len(parts)
+        stats["latency"] = [int(p) for p in parts[li + 1:ji]]
+        stats["jitter"] = [int(p) for p in parts[ji + 1:wi]]
+        stats["wake"] = [int(p) for p in parts[wi + 1:]]
+    except ValueError:
+        return None
+    return stats
+
+
+def parse_boot_line(line):
+    """Return [(phase, ms), ...] for a 'B,...' line, or None if it is not one."""
+    parts = line.strip().split(",")
+    if len(parts) < 3 or parts[0] != "B" or len(parts) % 2 != 1:
+        return None
+    try:
+        return [(parts[i], int(parts[i + 1])) for i in range(1, len(parts), 2)]
+    except ValueError:
+        return None
+
+
+def bucket_limit(i):
+    """Upper bound in ms of histogram bucket i (bucket 0 is 0 ms)."""
+    return 0 if i == 0 else (1 << i) - 1
+
+
+def percentile(counts, p):
+    """Upper bound of the bucket holding the p-th percentile, or None."""
+    total = sum(counts)
+    if not total:
+        return None
+    need = total * p / 100
+    seen = 0
+    for i, c in enumerate(counts):
+        seen += c
+        if seen >= need:
+            return bucket_limit(i)
+    return bucket_limit(len(counts) - 1)
+
+
+def delta(now, before):
+    """Histogram counts since the previous line."""
+    if before is None:
+        return now
+    return [a - b for a, b in zip(now, before)]
+
+
+def rate(stats, prev, field):
+    """Per-second rate of a counter since the previous line, or None."""
+    if prev is None or field not in stats or stats["ticks_ms"] <= prev["ticks_ms"]:
+        return None
+    return (stats[field] - prev[field]) * 1000 / (stats["ticks_ms"] - prev["ticks_ms"])
+
+
+def summary(stats, prev):
+    lat = delta(stats["latency"], prev and prev["latency"])
+    jit = delta(stats["jitter"], prev and prev["jitter"])
+    fmt = lambda v: "-" if v is None else "<={}".format(v)
+    polls = rate(stats, prev, "polls")
+    return ("t={ticks_ms} rx={bytes_rx} drop={drops} unk={unknown} "
+            "hiderr={hid_errors} retry={retries} ".format(**stats)
+            + "gc={}/{} ".format(stats.get("gc_idle", 0), stats.get("gc_busy", 0))
+            + "lat p50={} p99={} ({} reports) ".format(
+                fmt(percentile(lat, 50)), fmt(percentile(lat, 99)), sum(lat))
+            + "jitter p99={} ".format(fmt(percentile(jit, 99)))
+            + "polls/s={} sleeps={} ".format("-" if polls is None else round(polls),
+                                             stats.get("sleeps", 0))
+            + "wake p99={} ".format(fmt(percentile(stats.get("wake", []), 99)))
+            + "chatter b/g/s={}/{}/{} ".format(stats.get("bounces", 0), stats.get("ghosts", 0),
+                                               stats.get("strays", 0))
+            + "compact m/mk/br={}/{}/{}".format(stats.get("merged", 0),
+                                                stats.get("dropped_makes", 0),
+                                                stats.get("dropped_breaks", 0)))
+
+
+def lines_from(port, baud):
+    if port == "-":
+        yield from sys.stdin
+        return
+    try:
+        import serial
+    except ImportError:
+        sys.exit("pyserial is needed to read a serial port: pip install pyserial")
+    with serial.Serial(port, baud, timeout=5) as ser:
+        while True:
+            raw = ser.readline()
+            if raw:
+                yield raw.decode("ascii", "replace")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("port")
+    parser.add_argument("--baud", type=int, default=115200)
+    args = parser.parse_args()
+    prev = None
+    for line in lines_from(args.port, args.baud):
+        phases = parse_boot_line(line)
+        if phases:
+            print("boot: " + " ".join("{}={}ms".format(p, ms) for p, ms in phases), flush=True)
+            continue
+        stats = parse_line(line)
+        if stats is None:
+            continue
+        print(summary(stats, prev), flush=True)
+        prev = stats
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,333 @@
+# CPython: Run the Stowaway pipeline on Linux against a serial port
+"""
+Usage: python3 tools/stow_bridge.py TTY [--power dtr|rts|none] [--sink uinput|record]
+                                        [--layout NAME] [--baud 9600] [-v]
+
+For a Stowaway on a USB-serial adapter instead of a Pico: the same
+KeyboardReader (decoder, keymap, Fn layer, overflow handling) runs under
+CPython, reading TTY (e.g. /dev/ttyUSB0) in raw mode. Reads are event
+driven - asyncio wakes the bridge when the port has data, there is no
+polling sleep - and every batch of key events goes out at once.
+
+--power dtr / rts switches the keyboard's power with that modem line
+and waits for the handshake, like the Pico does with its power pin;
+--power none expects a keyboard that is always on.
+
+--sink uinput (default) creates a virtual keyboard through /dev/uinput
+(needs python-evdev and write access to /dev/uinput); --sink record
+prints the reports instead. Reports are N-key rollover (see
+src/stow_nkro.py), so the sink sees every key that is down.
+
+Runs in the foreground until the port goes away or SIGTERM/SIGINT, so
+it can be a systemd service. sim/bridge_check.py tests it over a pty.
+"""
+
+import argparse
+import asyncio
+import fcntl
+import os
+import signal
+import struct
+import sys
+import termios
+import time
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(_ROOT, "src"))
+
+import stow_kbd  # noqa: E402 - without busio etc. it takes uart/power/hid from us
+from stow_async import connect, watchdog_task  # noqa: E402
+from stow_hid import ReportBatcher  # noqa: E402
+from stow_macro import MacroPlayer, macro_task  # noqa: E402
+from stow_nkro import NkroKeyboard, REPORT_LEN, BITMAP, BITMAP_KEYS  # noqa: E402
+
+# HID keyboard usage -> Linux input event code (as drivers/hid/hid-input.c)
+HID_TO_LINUX = bytearray(256)
+HID_TO_LINUX[0x04:0x74] = bytes((
+    30, 48, 46, 32, 18, 33, 34, 35, 23, 36, 37, 38,      # a..l
+    50, 49, 24, 25, 16, 19, 31, 20, 22, 47, 17, 45,      # m..x
+    21, 44, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11,              # y z 1..0
+    28, 1, 14, 15, 57, 12, 13, 26, 27, 43, 43, 39,       # enter esc bs tab space - = [ ] \\ # ;
+    40, 41, 51, 52, 53, 58, 59, 60, 61, 62, 63, 64,      # ' ` , . / caps f1..f6
+    65, 66, 67, 68, 87, 88, 99, 70, 119, 110, 102, 104,  # f7..f12 sysrq scroll pause ins home pgup
+    111, 107, 109, 106, 105, 108, 103, 69, 98, 55, 74, 78,  # del end pgdn right left down up numlock kp/ * - +
+    96, 79, 80, 81, 75, 76, 77, 71, 72, 73, 82, 83,      # kp enter 1..9 0 .
+    86, 127, 116, 117, 183, 184, 185, 186, 187, 188, 189, 190,  # 102nd compose power kp= f13..f20
+    191, 192, 193, 194,                                  # f21..f24
+))
+HID_TO_LINUX[0xE0:0xE8] = bytes((29, 42, 56, 125, 97, 54, 100, 126))  # Modifiers
+
+
+# --------------------------
+# Serial port
+# --------------------------
+class TtyPort:
+    """
+    A tty or pty in raw mode, opened non-blocking. fill() reads what the
+    port has when asyncio reports it readable; KeyboardReader takes the
+    bytes through the busio.UART calls it uses (in_waiting, read, readinto).
+    """
+    def __init__(self, path, baudrate=9600):
+        self.path = path
+        self.fd = os.open(path, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+        self._rx = bytearray()
+        self.eof = False
+        attrs = termios.tcgetattr(self.fd)
+        speed = getattr(termios, "B{}".format(baudrate))
+        attrs[0] = 0                                            # iflag
+        attrs[1] = 0                                            # oflag
+        attrs[2] = termios.CS8 | termios.CREAD | termios.CLOCAL  # 8N1
+        attrs[3] = 0                                            # lflag: no echo, no line editing
+        attrs[4] = attrs[5] = speed
+        # VMIN 1: an empty port is EAGAIN, so an empty read means hang-up
+        attrs[6][termios.VMIN] = 1
+        attrs[6][termios.VTIME] = 0
+        termios.tcsetattr(self.fd, termios.TCSANOW, attrs)
+
+    def fill(self):
+        """Read what is waiting. Return False once the port is gone."""
+        try:
+            data = os.read(self.fd, 4096)
+        except BlockingIOError:
+            return True
+        except OSError:
+            data = b""  # EIO: the other end of a pty closed, adapter unplugged
+        if not data:
+            self.eof = True
+            return False
+        self._rx += data
+        return True
+
+    def close(self):
+        os.close(self.fd)
+
+    # --- busio.UART interface ---
+    @property
+    def in_waiting(self):
+        return len(self._rx)
+
+    def read(self, nbytes=None):
+        if not self._rx:
+            return None
+        n = len(self._rx) if nbytes is None else min(nbytes, len(self._rx))
+        data = bytes(self._rx[:n])
+        del self._rx[:n]
+        return data
+
+    def readinto(self, buf):
+        n = min(len(buf), len(self._rx))
+        if not n:
+            return None
+        buf[:n] = self._rx[:n]
+        del self._rx[:n]
+        return n
+
+
+class ModemLine:
+    """A modem control line (DTR or RTS) of `port`, with digitalio's `value`."""
+    LINES = {"dtr": termios.TIOCM_DTR, "rts": termios.TIOCM_RTS}
+
+    def __init__(self, port, line):
+        self._fd = port.fd
+        self._bit = struct.pack("I", self.LINES[line])
+        self._value = False
+
+    @property
+    def value(self):
+        return self._value
+
+    @value.setter
+    def value(self, on):
+        fcntl.ioctl(self._fd, termios.TIOCMBIS if on else termios.TIOCMBIC, self._bit)
+        self._value = on
+
+
+class AlwaysOn:
+    """Power for a keyboard that is always on: there is nothing to switch."""
+    value = True
+
+
+# --------------------------
+# Sinks: where the reports go
+# --------------------------
+class RecordingSink:
+    """Keeps every report with its time.monotonic(); for tests and --sink record."""
+    usage_page = 0x01
+    usage = 0x06
+
+    def __init__(self, echo=False):
+        self.reports = []
+        self.echo = echo
+
+    def send_report(self, report):
+        self.reports.append((time.monotonic(), bytes(report)))
+        if self.echo:
+            mods, keys = self.keys()
+            print("mods 0x{:02X} keys {}".format(mods, " ".join(
+                "0x{:02X}".format(k) for k in sorted(keys)) or "-"), flush=True)
+
+    def keys(self, report=None):
+        """Return (modifier byte, set of keycodes) of a report (default: last)."""
+        if report is None:
+            if not self.reports:
+                return 0, set()
+            report = self.reports[-1][1]
+        return report[0], {k for k in range(BITMAP_KEYS)
+                           if report[BITMAP + (k >> 3)] & (1 << (k & 7))}
+
+
+class UinputSink:
+    """A virtual keyboard through /dev/uinput: report changes become key events."""
+    usage_page = 0x01
+    usage = 0x06
+
+    def __init__(self, name="Stowaway"):
+        try:
+            from evdev import UInput, ecodes
+        except ImportError:
+            raise RuntimeError("python-evdev is needed for --sink uinput: pip install evdev")
+        self._ecodes = ecodes
+        codes = sorted({c for c in HID_TO_LINUX if c})
+        self._ui = UInput({ecodes.EV_KEY: codes}, name=name)
+        self._last = bytearray(REPORT_LEN)
+
+    def send_report(self, report):
+        last = self._last
+        changed = report[0] ^ last[0]
+        for bit in range(8):
+            if changed & (1 << bit):
+                self._key(0xE0 + bit, report[0] & (1 << bit))
+        for i in range(BITMAP, REPORT_LEN):
+            changed = report[i] ^ last[i]
+            for bit in range(8):
+                if changed & (1 << bit):
+                    self._key((i - BITMAP) * 8 + bit, report[i] & (1 << bit))
+        last[:] = report
+        self._ui.syn()
+
+    def _key(self, usage, down):
+        code = HID_TO_LINUX[usage]
+        if code:
+            self._ui.write(self._ecodes.EV_KEY, code, 1 if down else 0)
+
+    def close(self):
+        self._ui.close()
+
+
+# --------------------------
+# Bridge
+# --------------------------
+class Bridge:
+    """
+    One KeyboardReader on `port`, sending N-key rollover reports to
+    `sink`. With `power` (a ModemLine), the keyboard is powered up and
+    the handshake awaited; else it is taken as ready at once. The
+    layout's macros play at one report per `macro_pace_ms` (0: off);
+    `debounce_ms` turns on the chatter filter.
+    """
+    def __init__(self, port, sink, power=None, rxbuf=1024, on_key=None, macro_pace_ms=10,
+                 debounce_ms=0):
+        self.port = port
+        self.sink = sink
+        self.on_key = on_key
+        self.switched = power is not None
+        self.kbd = stow_kbd.KeyboardReader(
+            None, 9600, 8, None, 1, None, None, None,
+            ready_timeout_ms=1000, rxbuf_max=rxbuf,
+            hid=ReportBatcher(NkroKeyboard([sink])),
+            uart=port, power=power if power is not None else AlwaysOn(),
+            debounce_ms=debounce_ms)
+        if macro_pace_ms:
+            self.kbd.macros = MacroPlayer(self.kbd._batch, macro_pace_ms)
+        self._done = None
+
+    def stop(self):
+        if self._done:
+            self._done.set()
+
+    def _readable(self):
+        if not self.port.fill():
+            self.stop()
+        if self.kbd.ready:
+            self.kbd.get_all(self.on_key)
+            chatter = self.kbd.chatter
+            if chatter and chatter.held:
+                # Nothing else wakes us for a key-up the filter holds back
+                asyncio.get_running_loop().call_later(
+                    chatter.window_ms / 1000, self._held_due)
+
+    def _held_due(self):
+        if self.kbd.ready:
+            self.kbd.get_all(self.on_key)
+
+    async def run(self, max_errors=8):
+        """Until the port goes away or stop(): read, decode, send."""
+        loop = asyncio.get_running_loop()
+        self._done = asyncio.Event()
+        loop.add_reader(self.port.fd, self._readable)
+        tasks = []
+        if self.kbd.macros:
+            tasks.append(asyncio.ensure_future(macro_task(self.kbd.macros)))
+        try:
+            if self.switched:
+                await connect(self.kbd)
+                # Re-power on protocol errors or when the handshake is lost
+                tasks.append(asyncio.ensure_future(watchdog_task(self.kbd, 0, max_errors)))
+            else:
+                self.kbd.ready = True
+            self.kbd.get_all(self.on_key)  # Whatever came with the handshake
+            await self._done.wait()
+        finally:
+            loop.remove_reader(self.port.fd)
+            for task in tasks:
+                task.cancel()
+            # Nothing may stay pressed on the computer
+            self.kbd.keys.release_all()
+            self.kbd._batch.release_all(self.kbd.source)
+            if self.switched:
+                self.kbd.power.value = False
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("tty")
+    parser.add_argument("--power", choices=("dtr", "rts", "none"), default="dtr")
+    parser.add_argument("--sink", choices=("uinput", "record"), default="uinput")
+    parser.add_argument("--layout", help="Compiled keymap in src/keymaps (default: {})".format(
+        stow_kbd.DEFAULT_LAYOUT))
+    parser.add_argument("--baud", type=int, default=9600)
+    parser.add_argument("--macro-pace", type=int, default=10, metavar="MS",
+                        help="One macro report per MS ms (0: macros off)")
+    parser.add_argument("--debounce", type=int, default=0, metavar="MS",
+                        help="Chatter filter window (0: off, see src/stow_filter.py)")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Print every key")
+    args = parser.parse_args()
+
+    try:
+        stow_kbd.use_layout(args.layout or stow_kbd.DEFAULT_LAYOUT)
+        port = TtyPort(args.tty, args.baud)
+        sink = UinputSink() if args.sink == "uinput" else RecordingSink(echo=True)
+    except (OSError, ValueError, RuntimeError, termios.error) as e:
+        sys.exit("Error: {}".format(e))
+    power = ModemLine(port, args.power) if args.power != "none" else None
+    on_key = None
+    if args.verbose:
+        on_key = lambda sc, k: print("Scan: 0x{:02X} Key: 0x{:02X}".format(sc, k), flush=True)
+    bridge = Bridge(port, sink, power, on_key=on_key, macro_pace_ms=args.macro_pace,
+                    debounce_ms=args.debounce)
+
+    async def run():
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, bridge.stop)
+        await bridge.run()
+
+    print("Bridge: {} -> {}".format(args.tty, args.sink), flush=True)
+    asyncio.run(run())
+    port.close()
+    if hasattr(sink, "close"):
+        sink.close()
+
+
+if __name__ == "__main__":
+    main()